@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from .endpoints import camera, user, violation,pothole_detection,chatbot,feedback
+from .endpoints import camera, user, violation,pothole_detection,chatbot,feedback,metrics,license_plate
 
 api_router = APIRouter()
 api_router.include_router(camera.router, prefix="/api", tags=["Cameras"])
@@ -8,4 +8,6 @@ api_router.include_router(violation.router, prefix="/api/violation", tags=["Viol
 api_router.include_router(pothole_detection.router, prefix="/api/pothole", tags=["Pothole Detection"])
 api_router.include_router(chatbot.router, prefix="/api", tags=["Chatbot"])
 api_router.include_router(feedback.router, prefix="/api/feedback", tags=["Feedback"])
+api_router.include_router(metrics.router, prefix="/api/metrics", tags=["Metrics"])
+api_router.include_router(license_plate.router, prefix="/api/license-plate", tags=["License Plate"])
 # api(controller) -> service->crud (repository)->BD
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, Body, Form, File, UploadFile
 from sqlalchemy.orm import Session
-from fastapi.responses import StreamingResponse, Response, JSONResponse
+from fastapi.responses import StreamingResponse, Response, JSONResponse, FileResponse
 from fastapi.encoders import jsonable_encoder
 import cv2
 import json
@@ -34,12 +34,21 @@ from models.model import Camera
 from schemas.camera_schema import CameraCreate, CameraUpdate
 
 # Import updated tracking service
-from services.tracking.tracking_service import stream_vehicle_tracking_service
+from services.tracking.tracking_service import (
+    stream_vehicle_tracking_service, search_past_sightings, camera_config_from_row
+)
+from services.tracking.sighting_index import sighting_index
+from services.tracking.tracking_session import tracking_sessions
+from services.tracking.search_image_cache import search_image_cache, content_key
+from services.plate_sightings import plate_sightings
+from services.streaming.live_stream import live_streams, viewer_params
+from api.v1.endpoints.license_plate import with_snapshot_urls
+from starlette.concurrency import run_in_threadpool
 
 router = APIRouter()
 
-# ✅ Global in-memory storage for search images per camera
-search_images_by_camera = {}  # camera_id -> image_bytes
+# Ảnh tìm kiếm gần nhất của mỗi camera; bytes nằm trong search_image_cache theo hash nội dung
+search_images_by_camera = {}  # camera_id -> content hash
 
 class VehicleInfo(BaseModel):
     brand: Optional[str] = None
@@ -115,36 +124,41 @@ def delete_camera(camera_id: int, db: Session = Depends(get_db)):
     return {"detail": "Camera deleted successfully"}
 
 @router.get("/video/{camera_id}")
-def stream_video(camera_id: int, db: Session = Depends(get_db)):
+def stream_video(
+    camera_id: int,
+    max_fps: Optional[float] = None,
+    width: Optional[int] = None,
+    quality: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
     camera = db.query(Camera).filter(Camera.id == camera_id).first()
     if not camera:
         raise HTTPException(status_code=404, detail="Camera not found")
 
-    if camera.violation_type_id == 1:
-        return StreamingResponse(stream_violation_video_service1(camera.stream_url, camera.id), media_type="multipart/x-mixed-replace; boundary=frame")
-    elif camera.violation_type_id == 2:
-        return StreamingResponse(stream_overspeed_service(camera.stream_url, camera.id), media_type="multipart/x-mixed-replace; boundary=frame")
-    elif camera.violation_type_id == 3:
-        return StreamingResponse(analyze_traffic_video(camera.stream_url, camera.id), media_type="multipart/x-mixed-replace; boundary=frame")
-    elif camera.violation_type_id == 4:
-        return StreamingResponse(stream_violation_wrongway_video_service1(camera.stream_url, camera.id), media_type="multipart/x-mixed-replace; boundary=frame")
-    elif camera.violation_type_id == 5:
-        return StreamingResponse(stream_no_helmet_service(camera.stream_url, camera.id), media_type="multipart/x-mixed-replace; boundary=frame")
-    elif camera.violation_type_id == 6:
-        return StreamingResponse(stream_count_video_service(camera.stream_url, camera.id), media_type="multipart/x-mixed-replace; boundary=frame")
-    elif camera.violation_type_id == 7:
-
-        return StreamingResponse(
-            detect_potholes_in_video(camera.stream_url, camera.id),
-            media_type="multipart/x-mixed-replace; boundary=frame"
-        )
-
-    elif camera.violation_type_id == 8:
+    services = {
+        1: stream_violation_video_service1,
+        2: stream_overspeed_service,
+        3: analyze_traffic_video,
+        4: stream_violation_wrongway_video_service1,
+        5: stream_no_helmet_service,
+        6: stream_count_video_service,
+        7: detect_potholes_in_video,
+        8: stream_accident_video_service,
+    }
+    service = services.get(camera.violation_type_id)
+    if service is None:
+        raise HTTPException(status_code=400, detail="Unsupported violation type")
+
+    # Một pipeline cho mỗi camera; người xem thêm chỉ nhận bytes JPEG đã mã hóa sẵn
+    # (ô nhỏ trên dashboard xin width/quality/max_fps thấp, cùng tham số thì dùng chung biến thể)
+    max_fps, width, quality = viewer_params(max_fps, width, quality)
+    key = (camera.id, camera.violation_type_id, camera.stream_url)
+    stream_url = camera.stream_url
+    return StreamingResponse(
+        live_streams.subscribe(key, lambda: service(stream_url, camera_id), quality, width, max_fps),
+        media_type="multipart/x-mixed-replace; boundary=frame"
+    )
 
-        return StreamingResponse(
-            stream_accident_video_service(camera.stream_url, camera.id),
-            media_type="multipart/x-mixed-replace; boundary=frame"
-        )
 # Updated Tracking Models
 class VehicleInfo(BaseModel):
     brand: Optional[str] = None
@@ -153,12 +167,28 @@ class VehicleInfo(BaseModel):
 
 
 
+def tracking_stream_response(camera, search_image_bytes, max_fps, width, quality):
+    """MJPEG truy vết qua live stream: cùng camera và cùng ảnh truy vấn thì dùng chung một pipeline"""
+    max_fps, width, quality = viewer_params(max_fps, width, quality)
+    search_key = content_key(search_image_bytes) if search_image_bytes else None
+    # Pipeline chạy trong luồng riêng và sống lâu hơn request, nên không được dùng session DB của request
+    camera_config = camera_config_from_row(camera)
+    return StreamingResponse(
+        live_streams.subscribe(("tracking", camera.id, search_key),
+                               lambda: stream_vehicle_tracking_service(camera_config, search_image_bytes),
+                               quality, width, max_fps),
+        media_type="multipart/x-mixed-replace; boundary=frame"
+    )
+
 @router.get("/tracking/stream/{camera_id}")
 async def stream_tracking_video(
     camera_id: int,
     license_plate: Optional[str] = None,
     brand: Optional[str] = None,
     color: Optional[str] = None,
+    max_fps: Optional[float] = None,
+    width: Optional[int] = None,
+    quality: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
     camera = db.query(Camera).filter(Camera.id == camera_id).first()
@@ -171,10 +201,15 @@ async def stream_tracking_video(
         color=color
     )
 
-    return StreamingResponse(
-        stream_vehicle_tracking_service(camera_id, None, db),
-        media_type="multipart/x-mixed-replace; boundary=frame"
-    )
+    # Tìm theo biển số: lấy ảnh chụp của lần xuất hiện gần nhất làm ảnh truy vấn ReID
+    search_image_bytes = None
+    if license_plate:
+        for sighting in plate_sightings.lookup(license_plate, limit=10):
+            search_image_bytes = plate_sightings.snapshot(sighting["id"]) if sighting["snapshot"] else None
+            if search_image_bytes is not None:
+                break
+
+    return tracking_stream_response(camera, search_image_bytes, max_fps, width, quality)
 
 @router.api_route("/tracking/stream_with_image/{camera_id}", methods=["GET", "POST"])
 async def stream_tracking_video_with_image(
@@ -183,6 +218,9 @@ async def stream_tracking_video_with_image(
     license_plate: Optional[str] = Form(None),
     color: Optional[str] = Form(None),
     search_image: Optional[UploadFile] = File(None),
+    max_fps: Optional[float] = None,
+    width: Optional[int] = None,
+    quality: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
     camera = db.query(Camera).filter(Camera.id == camera_id).first()
@@ -198,16 +236,14 @@ async def stream_tracking_video_with_image(
     # ✅ Read uploaded image or fallback to stored one
     if search_image:
         search_image_bytes = await search_image.read()
-        search_images_by_camera[camera.id] = search_image_bytes
+        search_images_by_camera[camera.id] = search_image_cache.put(search_image_bytes)
     else:
-        search_image_bytes = search_images_by_camera.get(camera.id)
+        search_key = search_images_by_camera.get(camera.id)
+        search_image_bytes = search_image_cache.get_bytes(search_key) if search_key else None
         if search_image_bytes is None:
             raise HTTPException(status_code=400, detail="No search image provided or stored for this camera.")
 
-    return StreamingResponse(
-        stream_vehicle_tracking_service(camera_id, search_image_bytes, db),
-        media_type="multipart/x-mixed-replace; boundary=frame"
-    )
+    return tracking_stream_response(camera, search_image_bytes, max_fps, width, quality)
 
 @router.post("/tracking/start_session")
 async def start_tracking_session(
@@ -251,13 +287,32 @@ async def start_tracking_session(
     # ✅ Read and save image globally
     if search_image:
         search_image_bytes = await search_image.read()
+        search_key = search_image_cache.put(search_image_bytes)
         for cam in cameras:
-            search_images_by_camera[cam.id] = search_image_bytes
+            search_images_by_camera[cam.id] = search_key
+
+    # Một engine cho cả phiên: suy luận dùng chung, gallery ReID chung giữa các camera
+    session_cameras = [{
+        "id": camera.id,
+        "name": camera.name,
+        "location": camera.location or "Unknown",
+        "stream_url": camera.stream_url,
+    } for camera in cameras]
+    if search_image:
+        await run_in_threadpool(tracking_sessions.create, session_id, session_cameras, search_image_bytes)
+
+    # Tìm theo văn bản: trả lời ngay từ chỉ mục biển số thay vì chờ phân tích lại từng camera
+    plate_matches = []
+    if not search_image and license_plate:
+        plate_matches = with_snapshot_urls(plate_sightings.lookup(license_plate, camera_ids=final_camera_ids))
+    last_seen_by_camera = {}
+    for sighting in plate_matches:
+        last_seen_by_camera[sighting["cameraId"]] = max(last_seen_by_camera.get(sighting["cameraId"], 0), sighting["lastSeen"])
 
     camera_streams = []
     for camera in cameras:
         if search_image:
-            stream_url = f"/api/tracking/stream_with_image/{camera.id}"
+            stream_url = f"/api/tracking/sessions/{session_id}/stream/{camera.id}"
         else:
             stream_url = f"/api/tracking/stream/{camera.id}?license_plate={license_plate or ''}&brand={brand or ''}&color={color or ''}"
 
@@ -266,7 +321,8 @@ async def start_tracking_session(
             "cameraName": camera.name,
             "location": camera.location or "Unknown Location",
             "streamUrl": stream_url,
-            "status": "active" if camera.status else "inactive"
+            "status": "active" if camera.status else "inactive",
+            "lastPlateSighting": last_seen_by_camera.get(camera.id)
         })
 
     tracking_session = {
@@ -279,9 +335,90 @@ async def start_tracking_session(
         "searchMethod": search_method,
         "totalCameras": len(cameras)
     }
+    if plate_matches:
+        tracking_session["plateSightings"] = plate_matches
+    if search_image:
+        tracking_session["eventsUrl"] = f"/api/tracking/sessions/{session_id}/events"
 
     return tracking_session
 
+@router.get("/tracking/sessions/{session_id}")
+def get_tracking_session(session_id: str):
+    session = tracking_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Tracking session not found")
+    return session.info()
+
+@router.get("/tracking/sessions/{session_id}/stream/{camera_id}")
+def stream_tracking_session(
+    session_id: str,
+    camera_id: int,
+    max_fps: Optional[float] = None,
+    width: Optional[int] = None,
+    quality: Optional[int] = None
+):
+    session = tracking_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Tracking session not found")
+    if camera_id not in session.feeds:
+        raise HTTPException(status_code=404, detail="Camera is not part of this session")
+    max_fps, width, quality = viewer_params(max_fps, width, quality)
+    return StreamingResponse(
+        session.subscribe(camera_id, quality, width, max_fps),
+        media_type="multipart/x-mixed-replace; boundary=frame"
+    )
+
+@router.get("/tracking/sessions/{session_id}/events")
+def get_tracking_session_events(session_id: str, since: int = 0):
+    session = tracking_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Tracking session not found")
+    return {"sessionId": session_id, "events": session.events_since(since)}
+
+@router.delete("/tracking/sessions/{session_id}")
+def stop_tracking_session(session_id: str):
+    if not tracking_sessions.stop(session_id):
+        raise HTTPException(status_code=404, detail="Tracking session not found")
+    return {"sessionId": session_id, "status": "stopped"}
+
+@router.post("/tracking/sightings/search")
+async def search_tracking_sightings(
+    search_image: UploadFile = File(...),
+    hours: float = Form(2.0),
+    start_time: Optional[float] = Form(None),
+    end_time: Optional[float] = Form(None),
+    camera_ids_form: Optional[str] = Form(None),
+    top_k: int = Form(20)
+):
+    import time
+
+    if not sighting_index.enabled:
+        raise HTTPException(status_code=503, detail="Sighting index is disabled (set SIGHTING_INDEX_ENABLED=1)")
+    camera_ids = None
+    if camera_ids_form:
+        try:
+            camera_ids = json.loads(camera_ids_form)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=422, detail="Invalid camera_ids format: must be a JSON array of integers")
+    end_time = end_time or time.time()
+    start_time = start_time or end_time - hours * 3600
+    search_image_bytes = await search_image.read()
+    try:
+        sightings = await run_in_threadpool(search_past_sightings, search_image_bytes, start_time, end_time, camera_ids, top_k)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for sighting in sightings:
+        if sighting.get("crop"):
+            sighting["cropUrl"] = f"/api/tracking/sightings/crops/{sighting['day']}/{sighting['cameraId']}/{sighting['crop']}"
+    return {"startTime": start_time, "endTime": end_time, "sightings": sightings}
+
+@router.get("/tracking/sightings/crops/{day}/{camera_id}/{crop_name}")
+def get_tracking_sighting_crop(day: str, camera_id: int, crop_name: str):
+    path = sighting_index.crop_path(day, camera_id, crop_name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Crop not found")
+    return FileResponse(path, media_type="image/jpeg")
+
 @router.post("/track")
 async def track_vehicle_api(
     camera_ids: List[int] = Body(...),
@@ -0,0 +1,110 @@
+import json
+import tempfile
+from typing import List, Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse, Response
+from services.license_plate_return import recognize_plates_stream, iter_zip_images, url_source, is_image_name
+from services.plate_sightings import plate_sightings
+
+router = APIRouter()
+
+UPLOAD_COPY_CHUNK = 1 << 20
+
+
+def with_snapshot_urls(sightings):
+    for sighting in sightings:
+        if sighting.get("snapshot"):
+            sighting["snapshotUrl"] = f"/api/license-plate/sightings/{sighting['id']}/snapshot"
+    return sightings
+
+
+def _parse_urls(urls):
+    """Nhận mảng JSON hoặc danh sách URL cách nhau bởi xuống dòng / dấu phẩy"""
+    if not urls:
+        return []
+    urls = urls.strip()
+    if urls.startswith("["):
+        try:
+            return [str(url).strip() for url in json.loads(urls) if str(url).strip()]
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="urls must be a JSON array or a list of URLs")
+    return [url.strip() for url in urls.replace(",", "\n").splitlines() if url.strip()]
+
+
+async def _copy_upload(file):
+    """Chép upload ra file tạm thuộc về response; FastAPI bản mới đóng UploadFile ngay khi handler trả về"""
+    copy = tempfile.TemporaryFile()
+    await file.seek(0)
+    while True:
+        chunk = await file.read(UPLOAD_COPY_CHUNK)
+        if not chunk:
+            break
+        copy.write(chunk)
+    copy.seek(0)
+    return copy
+
+
+@router.post("/recognize/batch")
+async def recognize_plate_batch(
+    files: List[UploadFile] = File(default=[]),
+    urls: Optional[str] = Form(None),
+    conf: float = Form(0.6),
+):
+    url_list = _parse_urls(urls)
+    for file in files:
+        if not (is_image_name(file.filename or "") or (file.filename or "").lower().endswith(".zip")):
+            raise HTTPException(status_code=400, detail=f"Unsupported file: {file.filename}")
+    if not files and not url_list:
+        raise HTTPException(status_code=400, detail="Provide image files, a zip archive or image urls")
+
+    # Generator chạy sau khi handler trả về nên chỉ dùng bản sao của các upload
+    uploads = [(file.filename, await _copy_upload(file)) for file in files]
+
+    def sources():
+        # Ảnh được đọc lười theo từng lô nên zip hàng nghìn ảnh không nằm hết trong bộ nhớ
+        for filename, copy in uploads:
+            if filename.lower().endswith(".zip"):
+                yield from iter_zip_images(copy, filename)
+            else:
+                yield filename, copy.read
+        for url in url_list:
+            yield url_source(url)
+
+    def ndjson():
+        try:
+            for result in recognize_plates_stream(sources(), conf=conf):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            for _, copy in uploads:
+                copy.close()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.get("/sightings")
+def search_plate_sightings(
+    plate: str,
+    max_distance: Optional[int] = None,
+    hours: Optional[float] = None,
+    camera_ids: Optional[str] = None,
+    limit: int = 50,
+):
+    """Tra cứu tức thì các lần biển số xuất hiện trên mọi camera (chính xác hoặc gần đúng)"""
+    import time
+
+    start_time = time.time() - hours * 3600 if hours else None
+    try:
+        camera_id_list = [int(cid) for cid in camera_ids.split(",") if cid.strip()] if camera_ids else None
+    except ValueError:
+        raise HTTPException(status_code=422, detail="camera_ids must be a comma-separated list of integers")
+    sightings = plate_sightings.lookup(plate, max_distance=max_distance, start_time=start_time,
+                                      camera_ids=camera_id_list, limit=limit)
+    return {"plate": plate, "sightings": with_snapshot_urls(sightings)}
+
+
+@router.get("/sightings/{sighting_id}/snapshot")
+def get_plate_sighting_snapshot(sighting_id: str):
+    snapshot = plate_sightings.snapshot(sighting_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return Response(content=snapshot, media_type="image/jpeg")
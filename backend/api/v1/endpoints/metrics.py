@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from services.inference.budget_scheduler import inference_scheduler
+from services.inference.model_tier import model_tiers
+from services.streaming.live_stream import live_streams
+
+router = APIRouter()
+
+@router.get("/inference")
+def get_inference_metrics():
+    return {"cameras": inference_scheduler.snapshot(), "model_tiers": model_tiers.snapshot()}
+
+@router.get("/streams")
+def get_stream_metrics():
+    return live_streams.snapshot()
@@ -165,12 +165,7 @@ def stream_accident_video_service(youtube_url: str, camera_id: int):
     # Gửi frame đầu tiên ngay lập tức để giảm loading time
     ret, first_frame = cap.read()
     if ret:
-        encode_params = [cv2.IMWRITE_JPEG_QUALITY, 85]
-        _, jpeg = cv2.imencode('.jpg', first_frame, encode_params)
-        yield (
-            b"--frame\r\n"
-            b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
-        )
+        yield first_frame
 
     try:
         while True:
@@ -265,13 +260,8 @@ def stream_accident_video_service(youtube_url: str, camera_id: int):
                 active_event_id = None
                 last_event_detection_time = None
 
-            # Stream real-time frame với encoding tối ưu
-            encode_params = [cv2.IMWRITE_JPEG_QUALITY, 85]
-            _, jpeg = cv2.imencode('.jpg', annotated_frame, encode_params)
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
-            )
+            # Frame đã chú thích; mã hóa JPEG do live stream đảm nhận
+            yield annotated_frame
 
     finally:
         cap.release()
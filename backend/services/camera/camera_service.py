@@ -221,38 +221,27 @@ from datetime import datetime
 from collections import deque
 from ultralytics import YOLO
 from utils.yt_stream import get_stream_url
+from services.inference.detector import SharedDetector
+from services.inference.stream_tracker import StreamTracker
+from services.geometry.motion import TrackMotion
+from services.geometry.zone_index import box_centers
+from services.camera.static_overlay import StaticOverlay, polygon_label_anchor
 import traceback
 
 def stream_count_video_service(youtube_url: str, camera_id: int):
-    # Load model
-    model_vehicle = YOLO("bestv8m.pt")
+    # Load model (shared, stateless) and a tracker owned by this stream
+    model_vehicle = SharedDetector("bestv8m.pt")
+    tracker = StreamTracker("bytetrack.yaml")
     vehicle_classes = ['Bus', 'Car', 'Cycle', 'Truck', 'Van']  # Classes 0, 1, 2, 3, 4
 
     # Constants
     frame_buffer = deque(maxlen=30)  # Buffer for 1 second of frames at 30 FPS
     in_counts = {cls: 0 for cls in vehicle_classes}  # Count for vehicles moving "in"
     out_counts = {cls: 0 for cls in vehicle_classes}  # Count for vehicles moving "out"
-    track_position_history = {}  # Store previous positions of tracked vehicles
+    motion = None  # Vị trí các track và phía so với vạch đếm
+    static_overlay = None  # Vạch đếm và nhãn, vẽ một lần theo độ phân giải của stream
     counted_vehicles = set()  # Track IDs of vehicles already counted
 
-    def point_below_line(point, line_start, line_end):
-        x, y = point
-        x1, y1 = line_start
-        x2, y2 = line_end
-        cross_product = (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)
-        return cross_product > 0
-
-    def detect_line_crossing(prev_point, curr_point, line_start, line_end):
-        if prev_point is None or curr_point is None:
-            return None
-        was_below = point_below_line(prev_point, line_start, line_end)
-        is_below = point_below_line(curr_point, line_start, line_end)
-        if was_below and not is_below:
-            return "in"  # Below to above (upward movement)
-        elif not was_below and is_below:
-            return "out"  # Above to below (downward movement)
-        return None
-
     stream_url = get_stream_url(youtube_url)
     cap = cv2.VideoCapture(stream_url)
     if not cap.isOpened():
@@ -282,6 +271,10 @@ def stream_count_video_service(youtube_url: str, camera_id: int):
                 line_y = int(h * 0.8)  # 80% from top (2:8 ratio)
                 line_coords = np.array([[0, line_y], [w, line_y]], dtype=np.int32)
                 print(f"Line initialized at y={line_y} (frame size: {w}x{h})")
+                motion = TrackMotion([line_coords])
+                static_overlay = StaticOverlay(w, h)
+                static_overlay.polyline(line_coords, (0, 255, 255), 3)
+                static_overlay.text("Counting Line", line_coords[len(line_coords)//2], 0.5, (0, 255, 255), 2)
                 frame_size_initialized = True
 
                 # Initialize video output
@@ -289,15 +282,15 @@ def stream_count_video_service(youtube_url: str, camera_id: int):
                 out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
 
             # Draw counting line
-            cv2.polylines(frame_annotated, [line_coords], isClosed=False, color=(0, 255, 255), thickness=3)
-            mid_point = line_coords[len(line_coords)//2]
-            cv2.putText(frame_annotated, "Counting Line", tuple(mid_point), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
+            static_overlay.apply(frame_annotated)
 
             # Detect and track vehicles
-            results = model_vehicle.track(source=frame, persist=True, conf=0.4, iou=0.4, tracker="bytetrack.yaml")[0]
+            results = tracker.update(model_vehicle.detect(frame, conf=0.4, iou=0.4))
 
             if results.boxes is not None and results.boxes.id is not None:
+                # Hướng vượt vạch của mọi track trong một lần tính: lên = "in", xuống = "out"
+                crossed_in, crossed_out, _ = motion.update(results.boxes.id.int().cpu().tolist(),
+                                                           box_centers(results.boxes.xyxy.cpu().numpy()))
                 for i in range(len(results.boxes)):
                     cls_id = int(results.boxes.cls[i])
                     class_name = model_vehicle.names[cls_id]
@@ -305,23 +298,15 @@ def stream_count_video_service(youtube_url: str, camera_id: int):
                         continue
 
                     x1, y1, x2, y2 = map(int, results.boxes.xyxy[i])
-                    cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
                     track_id = int(results.boxes.id[i])
 
-                    # Save previous position
-                    prev_position = track_position_history.get(track_id)
-                    track_position_history[track_id] = (cx, cy)
-
                     # Check if vehicle crosses the line
-                    if prev_position and track_id not in counted_vehicles:
-                        line_start = tuple(line_coords[0])
-                        line_end = tuple(line_coords[1])
-                        direction = detect_line_crossing(prev_position, (cx, cy), line_start, line_end)
-                        if direction == "in":
+                    if track_id not in counted_vehicles:
+                        if crossed_in[i, 0]:
                             in_counts[class_name] += 1
                             counted_vehicles.add(track_id)
                             print(f"Vehicle {track_id} ({class_name}) crossed line (IN), count updated: {in_counts[class_name]}")
-                        elif direction == "out":
+                        elif crossed_out[i, 0]:
                             out_counts[class_name] += 1
                             counted_vehicles.add(track_id)
                             print(f"Vehicle {track_id} ({class_name}) crossed line (OUT), count updated: {out_counts[class_name]}")
@@ -346,12 +331,8 @@ def stream_count_video_service(youtube_url: str, camera_id: int):
             if out:
                 out.write(frame_annotated)
 
-            # Stream video
-            _, jpeg = cv2.imencode('.jpg', frame_annotated, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
-            )
+            # Stream video (mã hóa JPEG do live stream đảm nhận)
+            yield frame_annotated
 
     except Exception as e:
         print(f"❌ Error in stream_count_video_service: {e}")
@@ -684,35 +665,6 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
         
         return np.array(converted_coords, dtype=np.int32)
 
-    def point_below_line(point, line_start, line_end):
-        """
-        Kiểm tra điểm có ở phía dưới đường thẳng không (từ dưới màn hình lên trên)
-        Trả về True nếu điểm ở phía dưới đường
-        """
-        x, y = point
-        x1, y1 = line_start
-        x2, y2 = line_end
-        
-        # Tính tích có hướng để xác định vị trí điểm so với đường thẳng
-        cross_product = (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)
-        
-        # Nếu cross_product > 0, điểm ở bên trái đường (phía dưới trong hệ tọa độ màn hình)
-        # Nếu cross_product < 0, điểm ở bên phải đường (phía trên trong hệ tọa độ màn hình) 
-        return cross_product > 0
-
-    def detect_line_crossing(prev_point, curr_point, line_start, line_end):
-        """
-        Kiểm tra xe có vượt qua line từ dưới lên trên không
-        """
-        if prev_point is None or curr_point is None:
-            return False
-            
-        # Kiểm tra xe di chuyển từ phía dưới line lên phía trên line
-        was_below = point_below_line(prev_point, line_start, line_end)
-        is_above = not point_below_line(curr_point, line_start, line_end)
-        
-        return was_below and is_above
-
     # Parse zones và chuyển đổi tọa độ sẽ được thực hiện sau khi biết kích thước frame
     lane_zones_standard = {}
     light_zones_standard = {}
@@ -757,7 +709,8 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
 
     red_light_history = []
     track_zone_history = {}  # track_id: current_zone_id
-    track_position_history = {}  # track_id: previous_position
+    motion = None  # Vị trí track và phía so với các vạch, tính cho mọi track × mọi vạch
+    static_overlay = None  # Vùng, vạch và nhãn cố định, vẽ một lần theo độ phân giải của stream
     vehicle_violations = {}
     vehicle_violation_types = {}  # track_id: violation_type
 
@@ -803,24 +756,22 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
                         "coordinates": frame_coords
                     })
 
+                motion = TrackMotion([line["coordinates"] for line in zone_lines])
+
+                static_overlay = StaticOverlay(w, h)
+                for zone in lane_zones.values():
+                    static_overlay.polyline(zone["polygon"], (255, 255, 0), 2, closed=True)
+                    static_overlay.text(zone["name"], polygon_label_anchor(zone["polygon"]), 0.6, (255, 255, 0), 2)
+                for zone in light_zones.values():
+                    static_overlay.polyline(zone["polygon"], (0, 0, 255), 2, closed=True)
+                    static_overlay.text(zone["name"], polygon_label_anchor(zone["polygon"]), 0.6, (0, 0, 255), 2)
+                for line in zone_lines:
+                    static_overlay.polyline(line["coordinates"], (0, 255, 255), 3)
                 frame_size_initialized = True
                 print(f"Initialized {len(lane_zones)} lane zones, {len(light_zones)} light zones, {len(zone_lines)} lines")
 
-            # Step 1: Vẽ zones lên frame
-            for zone in lane_zones.values():
-                cv2.polylines(frame_annotated, [zone["polygon"]], isClosed=True, color=(255, 255, 0), thickness=2)
-                cx, cy = np.mean(zone["polygon"], axis=0).astype(int)
-                cv2.putText(frame_annotated, zone["name"], (cx, cy), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
-
-            for zone in light_zones.values():
-                cv2.polylines(frame_annotated, [zone["polygon"]], isClosed=True, color=(0, 0, 255), thickness=2)
-                cx, cy = np.mean(zone["polygon"], axis=0).astype(int)
-                cv2.putText(frame_annotated, zone["name"], (cx, cy), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-
-            for line in zone_lines:
-                cv2.polylines(frame_annotated, [line["coordinates"]], isClosed=False, color=(0, 255, 255), thickness=3)
+            # Step 1: Vẽ zones lên frame (lớp phủ dựng sẵn)
+            static_overlay.apply(frame_annotated)
 
             # Step 2: Detect đèn giao thông chỉ trong light zones
             red_detected_in_light_zone = False
@@ -865,6 +816,9 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
             if not results.boxes or results.boxes.id is None:
                 continue
 
+            # Vạch bị vượt từ dưới lên của mọi xe trong frame
+            crossed_up, _, _ = motion.update(results.boxes.id.int().cpu().tolist(),
+                                             box_centers(results.boxes.xyxy.cpu().numpy()))
             for i in range(len(results.boxes)):
                 cls_id = int(results.boxes.cls[i])
                 class_name = model_vehicle.names[cls_id]
@@ -875,10 +829,6 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
                 cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
                 track_id = int(results.boxes.id[i])
 
-                # Lưu vị trí trước đó
-                prev_position = track_position_history.get(track_id)
-                track_position_history[track_id] = (cx, cy)
-
                 # Xác định zone hiện tại của vehicle
                 current_zone_id = None
                 for z_id, z in lane_zones.items():
@@ -891,22 +841,14 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
                 track_zone_history[track_id] = current_zone_id
 
                 # Kiểm tra vi phạm vượt đèn đỏ (vượt qua line từ dưới lên khi đèn đỏ)
-                if is_red and prev_position and len(zone_lines) > 0:
-                    for line_data in zone_lines:
-                        line_coords = line_data["coordinates"]
-                        if len(line_coords) >= 2:
-                            line_start = tuple(line_coords[0])
-                            line_end = tuple(line_coords[1])
-                            
-                            # Kiểm tra xe có vượt qua line từ dưới lên không
-                            if detect_line_crossing(prev_position, (cx, cy), line_start, line_end):
-                                # Kiểm tra xe có đi đúng lane movement không
-                                if (prev_zone_id and current_zone_id and 
-                                    (prev_zone_id, current_zone_id) in lane_transitions):
-                                    # Xe đi đúng lane nhưng vượt đèn đỏ
-                                    vehicle_violations[track_id] = True
-                                    vehicle_violation_types[track_id] = "RED_LIGHT"
-                                    print(f"RED LIGHT VIOLATION: Vehicle {track_id} crossed line from zone {prev_zone_id} to {current_zone_id} during red light")
+                if is_red and crossed_up[i].any():
+                    # Kiểm tra xe có đi đúng lane movement không
+                    if (prev_zone_id and current_zone_id and 
+                        (prev_zone_id, current_zone_id) in lane_transitions):
+                        # Xe đi đúng lane nhưng vượt đèn đỏ
+                        vehicle_violations[track_id] = True
+                        vehicle_violation_types[track_id] = "RED_LIGHT"
+                        print(f"RED LIGHT VIOLATION: Vehicle {track_id} crossed line from zone {prev_zone_id} to {current_zone_id} during red light")
 
                 # Kiểm tra vi phạm đi sai làn (wrong way) khi đèn xanh
                 if (not is_red and prev_zone_id and current_zone_id and 
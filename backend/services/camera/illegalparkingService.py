@@ -7,12 +7,20 @@ import json
 import numpy as np
 from datetime import datetime
 from collections import deque
-from ultralytics import YOLO
 from shapely.geometry import Point, Polygon
 from database import SessionLocal
 from models.model import Violation
 from schemas.violation_schema import ViolationCreate
 from utils.yt_stream import get_stream_url
+from services.inference.budget_scheduler import inference_scheduler
+from services.inference.detector import SharedDetector
+from services.inference.model_tier import TieredDetector
+from services.inference.stream_tracker import StreamTracker
+from services.geometry.zone_index import ZoneIndex, box_centers
+from services.geometry.motion import TrackMotion
+from services.geometry.flow_field import FlowField
+from services.tracking.parked_objects import ParkedObjectTracker, PARKING_SAMPLE_FPS
+from services.camera.static_overlay import StaticOverlay, polygon_label_anchor
 from crud import violation_crud  
 import traceback
 import tempfile
@@ -21,15 +29,16 @@ import threading
 from concurrent.futures import ThreadPoolExecutor
 import atexit
 
-# Load models
-model_vehicle = YOLO("yolov8m.pt")
-model_light = YOLO("final.pt")  # Red light model
+# Load models (shared, stateless); each stream owns its own tracker
+model_light = SharedDetector("final.pt")  # Red light model
 
 # Constants
 stop_line_y = 550
 iou_threshold = 200
 red_light_buffer_size = 5
 VIOLATION_API_URL = "http://localhost:8081/api/violations"
+# Theo dõi đủ fps chỉ để xét ngược chiều trong làn; tắt đi thì camera chỉ lấy mẫu đỗ xe ~1 fps
+PARKING_DIRECTION_CHECKS = os.getenv("PARKING_DIRECTION_CHECKS", "1") == "1"
 
 # Create violations directory
 VIOLATIONS_DIR = "violations"
@@ -157,26 +166,48 @@ def analyze_traffic_video(youtube_url: str, camera_id: int):
     lane_zones = {}
     light_zones = {}
     zone_lines = []
+    lane_index = light_index = None  # Ảnh nhãn vùng (và dải quanh vạch) theo độ phân giải của stream
+    static_overlay = None  # Vùng, vạch và nhãn cố định, vẽ một lần theo độ phân giải của stream
     frame_size_initialized = False
 
     frame_buffer = deque(maxlen=30)  # Buffer for 1 second of frames at 30 FPS
     fps = cap.get(cv2.CAP_PROP_FPS) or 30
-    duration_threshold_frames = int(fps * 8)  # 3 seconds
+    tracker = StreamTracker("bytetrack.yaml")
+    # Model xe theo bậc tải (n/s/m), chỉ giữ lớp phương tiện ngay tại NMS
+    model_vehicle = TieredDetector(camera_id)
+    vehicle_class_ids = model_vehicle.class_ids(['car', 'truck', 'bus', 'motorbike', 'bicycle'])
+    # Xe dừng lâu: lấy mẫu vùng PARKING_SAMPLE_FPS, ghép với bản ghi xe đang dừng, tính giây thực
+    parked = ParkedObjectTracker()
+    last_parking_sample = 0.0
+    direction_checks = PARKING_DIRECTION_CHECKS and bool(lane_zones_percentage)
     
-    track_zone_duration = {}
-    frame_counter = 0
-    violation_sent = set()  # Track which vehicles already had violations sent
+    violation_sent = set()  # Track which vehicles already had wrong direction violations sent
     
     # Wrong direction detection
-    lane_direction_vectors = {}  # Store reference direction for each lane
-    track_position_history = {}  # Store position history for each vehicle
-    track_direction_samples = {}  # Store direction samples for each vehicle
+    flow_field = None  # Hướng đúng theo từng ô lưới, học từ mọi track và lưu lại giữa các lần chạy
+    motion = TrackMotion()  # Vị trí và vòng đệm hướng của mọi track, tính theo mảng
     min_samples_for_direction = 5  # Minimum samples to establish direction
 
+    def describe_zones(centers):
+        """Mô tả vùng vi phạm (làn, vùng đèn hoặc gần vạch) cho từng tâm xe, "" nếu ngoài mọi vùng"""
+        details = []
+        for lane_id, light_id, line_id in zip(lane_index.zone_at(centers), light_index.zone_at(centers),
+                                              lane_index.line_at(centers)):
+            if lane_id is not None:
+                details.append(f"lane_zone_{lane_id}({lane_zones[lane_id]['name']})")
+            elif light_id is not None:
+                details.append(f"light_zone_{light_id}({light_zones[light_id]['name']})")
+            elif line_id is not None:
+                details.append(f"near_line_{line_id}({lines_by_id[line_id]['name']})")
+            else:
+                details.append("")
+        return details
+
     # Video output for debug
     out = None
     output_video_path = None
 
+    inference_scheduler.register(camera_id)
     try:
         while True:
             ret, frame = cap.read()
@@ -186,11 +217,23 @@ def analyze_traffic_video(youtube_url: str, camera_id: int):
                 cap = cv2.VideoCapture(stream_url)
                 continue
 
-            frame_counter += 1
             frame_annotated = frame.copy()
             h, w, _ = frame.shape
             frame_buffer.append(frame_annotated.copy())
 
+            now = time.time()
+            parking_sample = now - last_parking_sample >= 1.0 / PARKING_SAMPLE_FPS
+            run_model = direction_checks or parking_sample
+
+            # Bỏ qua suy luận khi camera đã dùng hết ngân sách; người xem và video đầu ra
+            # vẫn nhận frame (kèm vùng, vạch cố định) để hình không bị đứng
+            if frame_size_initialized and run_model and not inference_scheduler.acquire(camera_id):
+                static_overlay.apply(frame_annotated)
+                if out:
+                    out.write(frame_annotated)
+                yield frame_annotated
+                continue
+
             # Initialize zones with frame size
             if not frame_size_initialized:
                 print(f"Frame size: {w}x{h}")
@@ -211,6 +254,31 @@ def analyze_traffic_video(youtube_url: str, camera_id: int):
                     zone_lines.append({"id": line_data["id"], "name": line_data["name"], "coordinates": frame_coords})
                     print(f"Line {line_data['id']} ({line_data['name']}): {len(frame_coords)} points")
 
+                lane_index = ZoneIndex(w, h, {zone_id: zone["polygon"] for zone_id, zone in lane_zones.items()},
+                                       lines={line["id"]: line["coordinates"] for line in zone_lines})
+                light_index = ZoneIndex(w, h, {zone_id: zone["polygon"] for zone_id, zone in light_zones.items()})
+                lines_by_id = {line["id"]: line for line in zone_lines}
+                flow_field = FlowField(camera_id, w, h)
+
+                static_overlay = StaticOverlay(w, h)
+                for zone in lane_zones.values():
+                    static_overlay.polyline(zone["polygon"], (255, 255, 0), 2, closed=True)
+                    if len(zone["polygon"]) > 0:
+                        static_overlay.text(f"Lane: {zone['name']}", polygon_label_anchor(zone["polygon"]),
+                                            0.6, (255, 255, 0), 2)
+                for light_zone_id, light_zone in light_zones.items():
+                    static_overlay.polyline(light_zone["polygon"], (0, 0, 255), 2, closed=True)
+                    if len(light_zone["polygon"]) > 0:
+                        lane_zone_id = next((k for k, v in light_control_map.items() if v == light_zone_id), None)
+                        lane_zone_name = lane_zones[lane_zone_id]["name"] if lane_zone_id in lane_zones else "Unknown"
+                        top_y = int(np.min(light_zone["polygon"][:, 1]))
+                        cx = int(np.mean(light_zone["polygon"][:, 0]))
+                        static_overlay.text(f"Light of Zone: {lane_zone_name}", (cx, top_y - 10), 0.6, (0, 0, 255), 2)
+                for line in zone_lines:
+                    if len(line["coordinates"]) >= 2:
+                        static_overlay.polyline(line["coordinates"], (0, 255, 255), 3)
+                        mid_point = line["coordinates"][len(line["coordinates"])//2]
+                        static_overlay.text(f"Line: {line['name']}", mid_point, 0.5, (0, 255, 255), 2)
                 frame_size_initialized = True
                 print(f"Initialized {len(lane_zones)} lane zones, {len(light_zones)} light zones, {len(zone_lines)} lines")
 
@@ -218,149 +286,118 @@ def analyze_traffic_video(youtube_url: str, camera_id: int):
                 output_video_path = os.path.join(VIOLATIONS_DIR, f"output_{camera_id}.mp4")
                 out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
 
-            # Draw zones
-            for zone_id, zone in lane_zones.items():
-                cv2.polylines(frame_annotated, [zone["polygon"]], isClosed=True, color=(255, 255, 0), thickness=2)
-                if len(zone["polygon"]) > 0:
-                    cx, cy = np.mean(zone["polygon"], axis=0).astype(int)
-                    cv2.putText(frame_annotated, f"Lane: {zone['name']}", (cx, cy), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
-
-            # Draw light zones
-            for light_zone_id, light_zone in light_zones.items():
-                cv2.polylines(frame_annotated, [light_zone["polygon"]], isClosed=True, color=(0, 0, 255), thickness=2)
-                if len(light_zone["polygon"]) > 0:
-                    lane_zone_id = next((k for k, v in light_control_map.items() if v == light_zone_id), None)
-                    lane_zone_name = lane_zones[lane_zone_id]["name"] if lane_zone_id in lane_zones else "Unknown"
-                    top_y = int(np.min(light_zone["polygon"][:, 1]))
-                    cx = int(np.mean(light_zone["polygon"][:, 0]))
-                    cv2.putText(frame_annotated, f"Light of Zone: {lane_zone_name}", 
-                                (cx, top_y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-
-            # Draw lines
-            for line in zone_lines:
-                if len(line["coordinates"]) >= 2:
-                    cv2.polylines(frame_annotated, [line["coordinates"]], isClosed=False, color=(0, 255, 255), thickness=3)
-                    mid_point = line["coordinates"][len(line["coordinates"])//2]
-                    cv2.putText(frame_annotated, f"Line: {line['name']}", tuple(mid_point), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
-
-            # Detect and track vehicles
-            results = model_vehicle.track(source=frame, persist=True, conf=0.25, iou=0.4, tracker="bytetrack.yaml")[0]
-
-            if results.boxes is not None and results.boxes.id is not None:
+            # Vùng làn, vùng đèn, vạch và nhãn: ghép lớp phủ dựng sẵn thay vì vẽ lại mỗi frame
+            static_overlay.apply(frame_annotated)
+
+            # Detect vehicles: mỗi frame khi xét ngược chiều, còn lại chỉ ở các lần lấy mẫu đỗ xe
+            detections = None
+            if run_model:
+                detections = model_vehicle.detect(frame, conf=0.25, iou=0.4, classes=vehicle_class_ids)
+            tracked_count = 0
+
+            # Parking mode: ghép detection trong vùng với bản ghi xe đang dừng, không cần track ID
+            if parking_sample:
+                last_parking_sample = now
+                if detections.boxes is not None and len(detections.boxes) > 0:
+                    boxes = detections.boxes.xyxy.cpu().numpy()
+                    class_names = [model_vehicle.names[int(c)] for c in detections.boxes.cls.cpu().tolist()]
+                else:
+                    boxes, class_names = np.zeros((0, 4)), []
+                parked.update(frame, boxes, class_names, describe_zones(box_centers(boxes)), now)
+
+                for record in parked.due(now):
+                    duration_seconds = parked.dwell(record, now)
+                    zone_details = record["zone"]
+                    print(f"🚨 PROLONGED PRESENCE VIOLATION: Parked object {record['id']} stayed in {zone_details} for {duration_seconds:.2f}s")
+                    
+                    # Create temporary files for violation
+                    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_image, \
+                         tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
+                        image_path = temp_image.name
+                        video_path = temp_video.name
+
+                        # Save image
+                        x1, y1, x2, y2 = record["bbox"]
+                        evidence = frame_annotated.copy()
+                        cv2.rectangle(evidence, (x1, y1), (x2, y2), (0, 0, 255), 2)
+                        cv2.imwrite(image_path, evidence)
+
+                        # Save video (1s before and after)
+                        violation_frames = list(frame_buffer)[-15:] + [evidence] + list(frame_buffer)[:15]
+                        save_temp_violation_video(violation_frames, fps, video_path, w, h)
+
+                        # Prepare violation data for API
+                        violation_data = {
+                            "camera": {"id": camera_id},
+                            "status": "PENDING",
+                            "createdAt": datetime.now().isoformat(),
+                            "violationDetails": [{
+                                "violationTypeId": 3,  # PROLONGED_PRESENCE
+                                "violationTime": datetime.now().isoformat(),
+                                "licensePlate": f"PARKED_{record['id']}",
+                                "description": f"Vehicle stayed in {zone_details} for {duration_seconds:.2f}s"
+                            }]
+                        }
+
+                        # Send violation asynchronously (non-blocking)
+                        print(f"📤 Sending prolonged presence violation for parked object {record['id']} asynchronously...")
+                        send_violation_async(violation_data, image_path, video_path, f"parked_{record['id']}")
+                        
+                        # Mark as sent to avoid duplicate violations
+                        record["reported"] = True
+
+            results = tracker.update(detections) if direction_checks else None
+            if results is not None and results.boxes is not None and results.boxes.id is not None:
+                # Vùng của mọi xe trong frame: mỗi loại một lần tra ảnh nhãn
+                centers = box_centers(results.boxes.xyxy.cpu().numpy())
+                frame_lane_ids = lane_index.zone_at(centers)
+                frame_zone_details = describe_zones(centers)
+                # Hướng di chuyển của mọi track cập nhật một lần cho cả frame
+                frame_track_ids = results.boxes.id.int().cpu().tolist()
+                _, _, moved = motion.update(frame_track_ids, centers)
+                headings, heading_counts = motion.headings(frame_track_ids)
+                # So hướng mọi track với trường hướng trong một lần tra; track ngược chiều không được học
+                has_direction = heading_counts >= min_samples_for_direction
+                flow_cosine, flow_known = flow_field.agreement(centers, headings)
+                wrong_direction = has_direction & flow_known & (flow_cosine < -0.3)
+                learn = has_direction & moved & ~wrong_direction
+                flow_field.observe(centers[learn], headings[learn])
+                flow_headings, _, _ = flow_field.lookup(centers)
                 for i in range(len(results.boxes)):
                     cls_id = int(results.boxes.cls[i])
                     class_name = model_vehicle.names[cls_id]
-                    if class_name not in ['car', 'truck', 'bus', 'motorbike', 'bicycle']:
-                        continue
+                    tracked_count += 1
 
                     x1, y1, x2, y2 = map(int, results.boxes.xyxy[i])
-                    cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
                     track_id = int(results.boxes.id[i])
 
-                    print(f"Vehicle {track_id}: cx={cx}, cy={cy}")
+                    # Hướng trung bình chỉ có nghĩa khi đã đủ mẫu
+                    vehicle_direction = None
+                    if heading_counts[i] >= min_samples_for_direction:
+                        vehicle_direction = (float(headings[i][0]), float(headings[i][1]))
 
-                    # Track vehicle position for direction detection
-                    prev_position = track_position_history.get(track_id)
-                    track_position_history[track_id] = (cx, cy)
-                    
-                    # Calculate direction vector if we have previous position
-                    current_direction = None
-                    if prev_position:
-                        dx = cx - prev_position[0]
-                        dy = cy - prev_position[1]
-                        # Only consider significant movements (>5 pixels)
-                        if abs(dx) > 5 or abs(dy) > 5:
-                            # Normalize direction vector
-                            magnitude = (dx**2 + dy**2)**0.5
-                            if magnitude > 0:
-                                current_direction = (dx/magnitude, dy/magnitude)
-                                
-                                # Store direction sample for this vehicle
-                                if track_id not in track_direction_samples:
-                                    track_direction_samples[track_id] = []
-                                track_direction_samples[track_id].append(current_direction)
-                                
-                                # Keep only recent samples
-                                if len(track_direction_samples[track_id]) > 10:
-                                    track_direction_samples[track_id].pop(0)
-
-                    # Check if vehicle is in violation zone (lane zones, light zones, or near lines)
-                    in_violation_zone = False
-                    zone_details = ""
-
-                    # Check lane zones
-                    current_lane_id = None
-                    for zone_id, zone in lane_zones.items():
-                        if cv2.pointPolygonTest(zone["polygon"], (cx, cy), False) >= 0:
-                            in_violation_zone = True
-                            zone_details = f"lane_zone_{zone_id}({zone['name']})"
-                            current_lane_id = zone_id
-                            break
-
-                    # Check light zones if not already in violation zone
-                    if not in_violation_zone:
-                        for zone_id, zone in light_zones.items():
-                            if cv2.pointPolygonTest(zone["polygon"], (cx, cy), False) >= 0:
-                                in_violation_zone = True
-                                zone_details = f"light_zone_{zone_id}({zone['name']})"
-                                break
+                    current_lane_id = frame_lane_ids[i]
+                    zone_details = frame_zone_details[i]
+                    in_violation_zone = bool(zone_details)
 
-                    # Check if near lines if not already in violation zone
-                    if not in_violation_zone:
-                        for line in zone_lines:
-                            coords = line["coordinates"]
-                            if len(coords) >= 2:
-                                line_start, line_end = tuple(coords[0]), tuple(coords[1])
-                                # Calculate distance from point to line
-                                try:
-                                    distance = abs((line_end[1] - line_start[1]) * cx - (line_end[0] - line_start[0]) * cy + line_end[0] * line_start[1] - line_end[1] * line_start[0]) / (
-                                        ((line_end[1] - line_start[1]) ** 2 + (line_end[0] - line_start[0]) ** 2) ** 0.5)
-                                    if distance < 10:
-                                        in_violation_zone = True
-                                        zone_details = f"near_line_{line['id']}({line['name']})"
-                                        break
-                                except ZeroDivisionError:
-                                    continue
-
-                    print(f"Vehicle {track_id}: in_violation_zone={in_violation_zone}, zone_details={zone_details}")
-                    
                     # Wrong direction detection for lane zones
-                    if current_lane_id and current_direction and track_id not in violation_sent:
+                    if current_lane_id and moved[i] and track_id not in violation_sent:
                         # Check if we have enough samples to determine direction
-                        if (track_id in track_direction_samples and 
-                            len(track_direction_samples[track_id]) >= min_samples_for_direction):
-                            
-                            # Calculate average direction for this vehicle
-                            avg_dx = sum(d[0] for d in track_direction_samples[track_id]) / len(track_direction_samples[track_id])
-                            avg_dy = sum(d[1] for d in track_direction_samples[track_id]) / len(track_direction_samples[track_id])
-                            vehicle_direction = (avg_dx, avg_dy)
-                            
+                        if vehicle_direction is not None:
                             print(f"Vehicle {track_id} direction: {vehicle_direction}")
                             
-                            # Check if this lane has established direction
-                            if current_lane_id not in lane_direction_vectors:
-                                # First vehicle in this lane - establish reference direction
-                                lane_direction_vectors[current_lane_id] = vehicle_direction
-                                print(f"🎯 Lane {current_lane_id} direction established: {vehicle_direction}")
-                            else:
-                                # Compare with established lane direction
-                                lane_direction = lane_direction_vectors[current_lane_id]
-                                
-                                # Calculate dot product to determine if same direction
-                                dot_product = (vehicle_direction[0] * lane_direction[0] + 
-                                             vehicle_direction[1] * lane_direction[1])
-                                
-                                print(f"Vehicle {track_id} vs Lane {current_lane_id}: dot_product={dot_product:.3f}")
-                                
+                            # Compare with the learned flow direction of the vehicle's cell
+                            dot_product = float(flow_cosine[i])
+                            if flow_known[i]:
+                                print(f"Vehicle {track_id} vs flow cell: dot_product={dot_product:.3f}")
+
                                 # If dot product < 0, directions are opposite (wrong way)
-                                if dot_product < -0.3:  # Threshold for opposite direction
+                                if wrong_direction[i]:
                                     print(f"🚨 WRONG DIRECTION VIOLATION: Vehicle {track_id} going opposite in lane {current_lane_id}")
                                     print(f"   Vehicle direction: {vehicle_direction}")
-                                    print(f"   Lane direction: {lane_direction}")
+                                    print(f"   Flow direction: {tuple(flow_headings[i])}")
                                     print(f"   Dot product: {dot_product}")
-                                    
+
                                     # Create temporary files for violation
                                     with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_image, \
                                          tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
@@ -394,117 +431,29 @@ def analyze_traffic_video(youtube_url: str, camera_id: int):
                                         # Mark as sent to avoid duplicate violations
                                         violation_sent.add(track_id)
 
-                    # Handle prolonged presence detection
-                    if in_violation_zone:
-                        if track_id not in track_zone_duration:
-                            track_zone_duration[track_id] = frame_counter
-                            print(f"Vehicle {track_id} entered violation zone at frame {frame_counter} ({zone_details})")
-                        else:
-                            duration_frames = frame_counter - track_zone_duration[track_id]
-                            if duration_frames >= duration_threshold_frames and track_id not in violation_sent:
-                                duration_seconds = duration_frames / fps
-                                print(f"🚨 PROLONGED PRESENCE VIOLATION: Vehicle {track_id} stayed in {zone_details} for {duration_frames} frames ({duration_seconds:.2f}s)")
-                                
-                                # Create temporary files for violation
-                                with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_image, \
-                                     tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
-                                    image_path = temp_image.name
-                                    video_path = temp_video.name
-
-                                    # Save image
-                                    cv2.imwrite(image_path, frame_annotated)
-
-                                    # Save video (1s before and after)
-                                    violation_frames = list(frame_buffer)[-15:] + [frame_annotated] + list(frame_buffer)[:15]
-                                    save_temp_violation_video(violation_frames, fps, video_path, w, h)
-
-                                    # Prepare violation data for API
-                                    violation_data = {
-                                        "camera": {"id": camera_id},
-                                        "status": "PENDING",
-                                        "createdAt": datetime.now().isoformat(),
-                                        "violationDetails": [{
-                                            "violationTypeId": 3,  # PROLONGED_PRESENCE
-                                            "violationTime": datetime.now().isoformat(),
-                                            "licensePlate": f"TRACK_{track_id}",
-                                            "description": f"Vehicle stayed in {zone_details} for {duration_seconds:.2f}s"
-                                        }]
-                                    }
-
-                                    # Send violation asynchronously (non-blocking)
-                                    print(f"📤 Sending prolonged presence violation for track {track_id} asynchronously...")
-                                    send_violation_async(violation_data, image_path, video_path, track_id)
-                                    
-                                    # Mark as sent to avoid duplicate violations
-                                    violation_sent.add(track_id)
-
-                    else:
-                        # Vehicle left violation zone, reset tracking
-                        if track_id in track_zone_duration:
-                            duration_frames = frame_counter - track_zone_duration[track_id]
-                            duration_seconds = duration_frames / fps
-                            print(f"Vehicle {track_id} left violation zone after {duration_frames} frames ({duration_seconds:.2f}s)")
-                            del track_zone_duration[track_id]
-                            # Remove from violation_sent if it was there (allow new violations)
-                            violation_sent.discard(track_id)
-                            
-                        # Clean up direction tracking when vehicle leaves all zones
-                        if not in_violation_zone:
-                            if track_id in track_direction_samples:
-                                del track_direction_samples[track_id]
-                            if track_id in track_position_history:
-                                del track_position_history[track_id]
+                    if not in_violation_zone:
+                        # Vehicle left violation zone: allow new violations, clean up direction tracking
+                        violation_sent.discard(track_id)
+                        motion.forget([track_id])
 
                     # Draw bounding box and label
                     color = (0, 255, 0)  # Green for normal tracking
                     violation_text = "OK"
                     
                     # Check for wrong direction violation
-                    if (current_lane_id and current_lane_id in lane_direction_vectors and 
-                        track_id in track_direction_samples and 
-                        len(track_direction_samples[track_id]) >= min_samples_for_direction):
+                    dot_product = None
+                    if current_lane_id and flow_known[i]:
+                        # Compare with flow direction
+                        dot_product = float(flow_cosine[i])
                         
-                        # Calculate current vehicle direction
-                        avg_dx = sum(d[0] for d in track_direction_samples[track_id]) / len(track_direction_samples[track_id])
-                        avg_dy = sum(d[1] for d in track_direction_samples[track_id]) / len(track_direction_samples[track_id])
-                        vehicle_direction = (avg_dx, avg_dy)
-                        
-                        # Compare with lane direction
-                        lane_direction = lane_direction_vectors[current_lane_id]
-                        dot_product = (vehicle_direction[0] * lane_direction[0] + 
-                                     vehicle_direction[1] * lane_direction[1])
-                        
-                        if dot_product < -0.3:  # Wrong direction
+                        if wrong_direction[i]:  # Wrong direction
                             color = (128, 0, 128)  # Purple for wrong direction
                             violation_text = "WRONG_DIRECTION"
                     
-                    # Check for prolonged presence
-                    if track_id in track_zone_duration:
-                        duration = frame_counter - track_zone_duration[track_id]
-                        if duration >= duration_threshold_frames:
-                            if violation_text == "OK":  # Don't override wrong direction
-                                color = (0, 0, 255)  # Red for violation
-                                violation_text = "PROLONGED_PRESENCE"
-                        else:
-                            if violation_text == "OK":  # Don't override wrong direction
-                                color = (0, 255, 255)  # Yellow for warning
-                                violation_text = "WARNING"
-                    
                     label = f"ID:{track_id} {class_name} {violation_text}"
-                    if track_id in track_zone_duration:
-                        duration = frame_counter - track_zone_duration[track_id]
-                        duration_seconds = duration / fps
-                        label += f" T:{duration_seconds:.1f}s"
                     
                     # Add direction info if available
-                    if (current_lane_id and current_lane_id in lane_direction_vectors and 
-                        track_id in track_direction_samples and 
-                        len(track_direction_samples[track_id]) >= min_samples_for_direction):
-                        
-                        avg_dx = sum(d[0] for d in track_direction_samples[track_id]) / len(track_direction_samples[track_id])
-                        avg_dy = sum(d[1] for d in track_direction_samples[track_id]) / len(track_direction_samples[track_id])
-                        dot_product = (avg_dx * lane_direction_vectors[current_lane_id][0] + 
-                                     avg_dy * lane_direction_vectors[current_lane_id][1])
+                    if dot_product is not None:
                         label += f" Dir:{dot_product:.2f}"
                     
                     cv2.rectangle(frame_annotated, (x1, y1), (x2, y2), color, 2)
@@ -515,31 +464,53 @@ def analyze_traffic_video(youtube_url: str, camera_id: int):
                         cv2.putText(frame_annotated, zone_details, (x1, y2 + 20), 
                                     cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
                     
-                    # Display lane direction info
-                    if current_lane_id and current_lane_id in lane_direction_vectors:
-                        lane_dir = lane_direction_vectors[current_lane_id]
-                        direction_text = f"Lane_dir:({lane_dir[0]:.2f},{lane_dir[1]:.2f})"
+                    # Display flow direction info
+                    if current_lane_id and flow_known[i]:
+                        lane_dir = flow_headings[i]
+                        direction_text = f"Flow_dir:({lane_dir[0]:.2f},{lane_dir[1]:.2f})"
                         cv2.putText(frame_annotated, direction_text, (x1, y2 + 40), 
                                     cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
 
                     print(f"Vehicle {track_id}: violation_sent={track_id in violation_sent}, violation_text={violation_text}")
 
+            # Draw parked objects (cập nhật ở lần lấy mẫu gần nhất)
+            for record in parked.records.values():
+                x1, y1, x2, y2 = record["bbox"]
+                duration_seconds = parked.dwell(record, now)
+                if duration_seconds >= parked.dwell_seconds:
+                    color, violation_text = (0, 0, 255), "PROLONGED_PRESENCE"  # Red for violation
+                else:
+                    color, violation_text = (0, 255, 255), "WARNING"  # Yellow for warning
+                cv2.rectangle(frame_annotated, (x1, y1), (x2, y2), color, 2)
+                cv2.putText(frame_annotated, f"P{record['id']} {record['className']} {violation_text} T:{duration_seconds:.1f}s",
+                            (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+                cv2.putText(frame_annotated, record["zone"], (x1, y2 + 20),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
+
+            if run_model:
+                # Xe đang dừng trong vùng được tính là vi phạm chờ xử lý
+                inference_scheduler.report_activity(camera_id, tracked=tracked_count,
+                                                    pending_violations=len(parked.records))
+                model_vehicle.frame_done()
+            if flow_field is not None:
+                flow_field.maybe_save()
+
             # Save frame to video output
             if out:
                 out.write(frame_annotated)
 
             # Stream video
-            _, jpeg = cv2.imencode('.jpg', frame_annotated, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
-            )
+            yield frame_annotated
 
     except Exception as e:
         print(f"❌ Error in analyze_traffic_video: {e}")
         traceback.print_exc()
     finally:
         # Clean up resources
+        inference_scheduler.unregister(camera_id)
+        model_vehicle.close()
+        if flow_field is not None:
+            flow_field.save()
         cap.release()
         if out:
             out.release()
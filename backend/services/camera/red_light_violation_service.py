@@ -7,12 +7,18 @@ import json
 import numpy as np
 from datetime import datetime
 from collections import deque
-from ultralytics import YOLO
 from shapely.geometry import Point, Polygon
 from database import SessionLocal
 from models.model import Violation
 from schemas.violation_schema import ViolationCreate
 from utils.yt_stream import get_stream_url
+from services.inference.budget_scheduler import inference_scheduler
+from services.inference.detector import SharedDetector
+from services.inference.model_tier import TieredDetector
+from services.inference.stream_tracker import StreamTracker
+from services.geometry.zone_index import ZoneIndex, box_centers
+from services.geometry.motion import TrackMotion
+from services.camera.static_overlay import StaticOverlay, polygon_label_anchor
 from crud import violation_crud  
 import traceback
 import tempfile
@@ -21,14 +27,15 @@ import threading
 from concurrent.futures import ThreadPoolExecutor
 import atexit
 
-# Load models
-model_vehicle = YOLO("yolov8m.pt")
-model_light = YOLO("final.pt")  # Red light model
+# Load models (shared, stateless); each stream owns its own tracker
+model_light = SharedDetector("final.pt")  # Red light model
 
 # Constants
 stop_line_y = 550
 iou_threshold = 200
-red_light_buffer_size = 5
+# Trạng thái đèn bỏ phiếu theo cửa sổ thời gian thực: số frame suy luận mỗi giây thay đổi theo ngân sách
+RED_LIGHT_WINDOW_SECONDS = float(os.getenv("RED_LIGHT_WINDOW_SECONDS", "0.5"))
+RED_LIGHT_MIN_HITS = 2
 VIOLATION_API_URL = "http://localhost:8081/api/violations"
 
 # Create violations directory
@@ -38,6 +45,36 @@ os.makedirs(VIOLATIONS_DIR, exist_ok=True)
 # Thread pool for async violation sending
 violation_executor = ThreadPoolExecutor(max_workers=5)
 
+
+class RedLightHistory:
+    """Các lần nhận diện đèn đỏ trong RED_LIGHT_WINDOW_SECONDS gần nhất của một vùng đèn.
+
+    Đỏ khi có ít nhất RED_LIGHT_MIN_HITS lần thấy đỏ trong cửa sổ (hoặc mọi mẫu đều đỏ khi
+    cửa sổ có ít mẫu hơn), nên một lần nhận nhầm không bật trạng thái đỏ.
+    """
+
+    def __init__(self, window_seconds=RED_LIGHT_WINDOW_SECONDS, min_hits=RED_LIGHT_MIN_HITS):
+        self.window_seconds = window_seconds
+        self.min_hits = min_hits
+        self._samples = deque()
+
+    def add(self, is_red, now=None):
+        now = time.time() if now is None else now
+        self._samples.append((now, bool(is_red)))
+        self._expire(now)
+
+    def is_red(self, now=None):
+        self._expire(time.time() if now is None else now)
+        hits = sum(red for _, red in self._samples)
+        return hits > 0 and hits >= min(self.min_hits, len(self._samples))
+
+    def _expire(self, now):
+        while self._samples and now - self._samples[0][0] > self.window_seconds:
+            self._samples.popleft()
+
+    def __repr__(self):
+        return f"RedLightHistory({[red for _, red in self._samples]})"
+
 def send_violation_async(violation_data, image_path, video_path, track_id):
     """Send violation to API asynchronously"""
     def send_violation():
@@ -108,21 +145,6 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
             converted_coords.append([x_pixel, y_pixel])
         return np.array(converted_coords, dtype=np.int32)
 
-    def point_below_line(point, line_start, line_end):
-        x, y = point
-        x1, y1 = line_start
-        x2, y2 = line_end
-        cross_product = (x2 - x1) * (y - y1) - (y2 - y1) * (x - x1)
-        return cross_product > 0
-
-    def detect_line_crossing(prev_point, curr_point, line_start, line_end):
-        if prev_point is None or curr_point is None:
-            return False
-        was_below = point_below_line(prev_point, line_start, line_end)
-        is_above = not point_below_line(curr_point, line_start, line_end)
-        print(f"Detect line crossing: prev={prev_point}, curr={curr_point}, was_below={was_below}, is_above={is_above}")
-        return was_below and is_above
-
     def save_temp_violation_video(frames, fps, output_path, width, height):
         out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
         for frame in frames:
@@ -173,20 +195,27 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
     lane_zones = {}
     light_zones = {}
     zone_lines = []
+    lane_index = None  # Ảnh nhãn vùng làn theo độ phân giải của stream
+    static_overlay = None  # Vùng, vạch và nhãn cố định, vẽ một lần theo độ phân giải của stream
     frame_size_initialized = False
 
-    red_light_history = {zone_id: deque(maxlen=red_light_buffer_size) for zone_id in light_zones_percentage}
+    red_light_history = {zone_id: RedLightHistory() for zone_id in light_zones_percentage}
     track_zone_history = {}
-    track_position_history = {}
+    motion = None  # Vị trí track và phía so với các vạch, tính cho mọi track × mọi vạch mỗi frame
     vehicle_violations = {}
     vehicle_violation_types = {}
     frame_buffer = deque(maxlen=30)  # Buffer for 1 second of frames at 30 FPS
     fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    tracker = StreamTracker("bytetrack.yaml")
+    # Model xe theo bậc tải (n/s/m), chỉ giữ lớp phương tiện ngay tại NMS
+    model_vehicle = TieredDetector(camera_id)
+    vehicle_class_ids = model_vehicle.class_ids(['car', 'truck', 'bus', 'motorbike', 'bicycle'])
 
     # Video output for debug
     out = None
     output_video_path = None
 
+    inference_scheduler.register(camera_id)
     try:
         while True:
             ret, frame = cap.read()
@@ -200,6 +229,15 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
             h, w, _ = frame.shape
             frame_buffer.append(frame_annotated.copy())
 
+            # Bỏ qua suy luận khi camera đã dùng hết ngân sách; người xem và video đầu ra
+            # vẫn nhận frame (kèm vùng, vạch cố định) để hình không bị đứng
+            if frame_size_initialized and not inference_scheduler.acquire(camera_id):
+                static_overlay.apply(frame_annotated)
+                if out:
+                    out.write(frame_annotated)
+                yield frame_annotated
+                continue
+
             # Initialize zones with frame size
             if not frame_size_initialized:
                 print(f"Frame size: {w}x{h}")
@@ -220,6 +258,28 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
                     zone_lines.append({"id": line_data["id"], "name": line_data["name"], "coordinates": frame_coords})
                     print(f"Line {line_data['id']} ({line_data['name']}): {len(frame_coords)} points")
 
+                lane_index = ZoneIndex(w, h, {zone_id: zone["polygon"] for zone_id, zone in lane_zones.items()})
+                motion = TrackMotion([line["coordinates"] for line in zone_lines])
+
+                static_overlay = StaticOverlay(w, h)
+                for zone in lane_zones.values():
+                    static_overlay.polyline(zone["polygon"], (255, 255, 0), 2, closed=True)
+                    if len(zone["polygon"]) > 0:
+                        static_overlay.text(f"Lane: {zone['name']}", polygon_label_anchor(zone["polygon"]),
+                                            0.6, (255, 255, 0), 2)
+                for light_zone_id, light_zone in light_zones.items():
+                    static_overlay.polyline(light_zone["polygon"], (0, 0, 255), 2, closed=True)
+                    if len(light_zone["polygon"]) > 0:
+                        lane_zone_id = next((k for k, v in light_control_map.items() if v == light_zone_id), None)
+                        lane_zone_name = lane_zones[lane_zone_id]["name"] if lane_zone_id in lane_zones else "Unknown"
+                        top_y = int(np.min(light_zone["polygon"][:, 1]))
+                        cx = int(np.mean(light_zone["polygon"][:, 0]))
+                        static_overlay.text(f"Light of Zone: {lane_zone_name}", (cx, top_y - 10), 0.6, (0, 0, 255), 2)
+                for line in zone_lines:
+                    if len(line["coordinates"]) >= 2:
+                        static_overlay.polyline(line["coordinates"], (0, 255, 255), 3)
+                        mid_point = line["coordinates"][len(line["coordinates"])//2]
+                        static_overlay.text(f"Line: {line['name']}", mid_point, 0.5, (0, 255, 255), 2)
                 frame_size_initialized = True
                 print(f"Initialized {len(lane_zones)} lane zones, {len(light_zones)} light zones, {len(zone_lines)} lines")
 
@@ -227,24 +287,13 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
                 output_video_path = os.path.join(VIOLATIONS_DIR, f"output_{camera_id}.mp4")
                 out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
 
-            # Draw zones
-            for zone_id, zone in lane_zones.items():
-                cv2.polylines(frame_annotated, [zone["polygon"]], isClosed=True, color=(255, 255, 0), thickness=2)
-                if len(zone["polygon"]) > 0:
-                    cx, cy = np.mean(zone["polygon"], axis=0).astype(int)
-                    cv2.putText(frame_annotated, f"Lane: {zone['name']}", (cx, cy), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
+            # Vùng, vạch và nhãn cố định: ghép lớp phủ dựng sẵn
+            static_overlay.apply(frame_annotated)
 
-            # Draw light zones and status
+            # Light status (dynamic)
             for light_zone_id, light_zone in light_zones.items():
-                cv2.polylines(frame_annotated, [light_zone["polygon"]], isClosed=True, color=(0, 0, 255), thickness=2)
                 if len(light_zone["polygon"]) > 0:
-                    lane_zone_id = next((k for k, v in light_control_map.items() if v == light_zone_id), None)
-                    lane_zone_name = lane_zones[lane_zone_id]["name"] if lane_zone_id in lane_zones else "Unknown"
-                    top_y = int(np.min(light_zone["polygon"][:, 1]))
                     cx = int(np.mean(light_zone["polygon"][:, 0]))
-                    cv2.putText(frame_annotated, f"Light of Zone: {lane_zone_name}", 
-                                (cx, top_y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
 
                     # Detect traffic light
                     mask = np.zeros((h, w), dtype=np.uint8)
@@ -256,8 +305,8 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
                         for box in light_results.boxes
                     )
                     
-                    red_light_history[light_zone_id].append(zone_red_detected)
-                    is_red = red_light_history[light_zone_id].count(True) > 1
+                    red_light_history[light_zone_id].add(zone_red_detected)
+                    is_red = red_light_history[light_zone_id].is_red()
 
                     print(f"Light zone {light_zone_id}: {red_light_history[light_zone_id]}, is_red: {is_red}")
 
@@ -267,22 +316,21 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
                     cv2.putText(frame_annotated, status_text, (cx, bottom_y + 20), 
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, status_color, 2)
 
-            for line in zone_lines:
-                if len(line["coordinates"]) >= 2:
-                    cv2.polylines(frame_annotated, [line["coordinates"]], isClosed=False, color=(0, 255, 255), thickness=3)
-                    mid_point = line["coordinates"][len(line["coordinates"])//2]
-                    cv2.putText(frame_annotated, f"Line: {line['name']}", tuple(mid_point), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
-
             # Detect and track vehicles
-            results = model_vehicle.track(source=frame, persist=True, conf=0.4, iou=0.4, tracker="bytetrack.yaml")[0]
+            results = tracker.update(model_vehicle.detect(frame, conf=0.4, iou=0.4, classes=vehicle_class_ids))
+            tracked_count = 0
+            frame_violations = 0
 
             if results.boxes is not None and results.boxes.id is not None:
+                # Vùng làn của mọi xe trong frame bằng một lần tra ảnh nhãn
+                centers = box_centers(results.boxes.xyxy.cpu().numpy())
+                frame_zone_ids = lane_index.zone_at(centers)
+                # Vạch bị vượt từ dưới lên của mọi xe trong frame
+                crossed_up, _, _ = motion.update(results.boxes.id.int().cpu().tolist(), centers)
                 for i in range(len(results.boxes)):
                     cls_id = int(results.boxes.cls[i])
                     class_name = model_vehicle.names[cls_id]
-                    if class_name not in ['car', 'truck', 'bus', 'motorbike', 'bicycle']:
-                        continue
+                    tracked_count += 1
 
                     x1, y1, x2, y2 = map(int, results.boxes.xyxy[i])
                     cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
@@ -290,16 +338,8 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
 
                     print(f"Vehicle {track_id}: cx={cx}, cy={cy}")
 
-                    # Save previous position
-                    prev_position = track_position_history.get(track_id)
-                    track_position_history[track_id] = (cx, cy)
-
                     # Determine current zone
-                    current_zone_id = None
-                    for z_id, z in lane_zones.items():
-                        if cv2.pointPolygonTest(z["polygon"], (cx, cy), False) >= 0:
-                            current_zone_id = z_id
-                            break
+                    current_zone_id = frame_zone_ids[i]
 
                     print(f"Vehicle {track_id}: current_zone_id={current_zone_id}")
 
@@ -308,59 +348,53 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
                     track_zone_history[track_id] = current_zone_id
 
                     # Check red light violation
-                    if prev_position and len(zone_lines) > 0:
-                        for line_data in zone_lines:
-                            line_coords = line_data["coordinates"]
-                            if len(line_coords) >= 2:
-                                line_start = tuple(line_coords[0])
-                                line_end = tuple(line_coords[1])
-                                
-                                if detect_line_crossing(prev_position, (cx, cy), line_start, line_end):
-                                    print(f"Vehicle {track_id} crossed line: prev={prev_position}, curr={(cx, cy)}, line={line_start}->{line_end}")
-                                    
-                                    for light_zone_id in red_light_history:
-                                        if red_light_history[light_zone_id].count(True) > 1:
-                                            vehicle_violations[track_id] = True
-                                            vehicle_violation_types[track_id] = "RED_LIGHT"
-                                            print(f"🚨 RED LIGHT VIOLATION: Vehicle {track_id} crossed line during red light (light_zone_id={light_zone_id})")
-
-                                            # Create temporary files for violation
-                                            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_image, \
-                                                 tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
-                                                image_path = temp_image.name
-                                                video_path = temp_video.name
-
-                                                # Save image
-                                                cv2.imwrite(image_path, frame_annotated)
-
-                                                # Save video (1s before and after)
-                                                violation_frames = list(frame_buffer)[-15:] + [frame_annotated] + list(frame_buffer)[:15]
-                                                save_temp_violation_video(violation_frames, fps, video_path, w, h)
-
-                                                # Prepare violation data for API
-                                                violation_data = {
-                                                    "camera": {"id": camera_id},
-                                                    "status": "PENDING",
-                                                    "createdAt": datetime.now().isoformat(),
-                                                    "violationDetails": [{
-                                                        "violationTypeId": 1,  # RED_LIGHT
-                                                        "violationTime": datetime.now().isoformat(),
-                                                        "licensePlate": f"TRACK_{track_id}"  # Replace with OCR later
-                                                    }]
-                                                }
-
-                                                # Send violation asynchronously (non-blocking)
-                                                print(f"📤 Sending RED_LIGHT violation for track {track_id} asynchronously...")
-                                                send_violation_async(violation_data, image_path, video_path, track_id)
-                                            break
-                                    else:
-                                        print(f"No red light violation: No red light detected in any light zone")
+                    for line_idx in np.flatnonzero(crossed_up[i]):
+                        line_start, line_end = map(tuple, zone_lines[line_idx]["coordinates"][:2])
+                        print(f"Vehicle {track_id} crossed line: curr={(cx, cy)}, line={line_start}->{line_end}")
+                        
+                        for light_zone_id in red_light_history:
+                            if red_light_history[light_zone_id].is_red():
+                                vehicle_violations[track_id] = True
+                                vehicle_violation_types[track_id] = "RED_LIGHT"
+                                print(f"🚨 RED LIGHT VIOLATION: Vehicle {track_id} crossed line during red light (light_zone_id={light_zone_id})")
+
+                                # Create temporary files for violation
+                                with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_image, \
+                                     tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
+                                    image_path = temp_image.name
+                                    video_path = temp_video.name
+
+                                    # Save image
+                                    cv2.imwrite(image_path, frame_annotated)
+
+                                    # Save video (1s before and after)
+                                    violation_frames = list(frame_buffer)[-15:] + [frame_annotated] + list(frame_buffer)[:15]
+                                    save_temp_violation_video(violation_frames, fps, video_path, w, h)
+
+                                    # Prepare violation data for API
+                                    violation_data = {
+                                        "camera": {"id": camera_id},
+                                        "status": "PENDING",
+                                        "createdAt": datetime.now().isoformat(),
+                                        "violationDetails": [{
+                                            "violationTypeId": 1,  # RED_LIGHT
+                                            "violationTime": datetime.now().isoformat(),
+                                            "licensePlate": f"TRACK_{track_id}"  # Replace with OCR later
+                                        }]
+                                    }
+
+                                    # Send violation asynchronously (non-blocking)
+                                    print(f"📤 Sending RED_LIGHT violation for track {track_id} asynchronously...")
+                                    send_violation_async(violation_data, image_path, video_path, track_id)
+                                break
+                        else:
+                            print(f"No red light violation: No red light detected in any light zone")
 
                     # Check wrong lane violation
                     if (current_zone_id and prev_zone_id and prev_zone_id != current_zone_id and 
                         (prev_zone_id, current_zone_id) not in lane_transitions):
                         light_zone_id = light_control_map.get(current_zone_id)
-                        if light_zone_id and not red_light_history.get(light_zone_id, deque([False])).count(True) > 1:
+                        if light_zone_id and not (light_zone_id in red_light_history and red_light_history[light_zone_id].is_red()):
                             vehicle_violations[track_id] = True
                             vehicle_violation_types[track_id] = "WRONG_LANE"
                             print(f"🚨 WRONG LANE VIOLATION: Vehicle {track_id} moved from zone {prev_zone_id} to {current_zone_id}")
@@ -395,6 +429,8 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
                                 send_violation_async(violation_data, image_path, video_path, track_id)
 
                     # Draw bounding box and label
+                    if vehicle_violations.get(track_id, False):
+                        frame_violations += 1
                     violation_type = vehicle_violation_types.get(track_id, "")
                     color = (0, 0, 255) if vehicle_violations.get(track_id, False) else (0, 255, 0)
                     violation_text = violation_type if vehicle_violations.get(track_id, False) else "OK"
@@ -411,22 +447,25 @@ def stream_violation_video_service1(youtube_url: str, camera_id: int):
 
                     print(f"Vehicle {track_id}: vehicle_violations={vehicle_violations.get(track_id, False)}, violation_type={violation_type}")
 
+            red_phase = any(history.is_red() for history in red_light_history.values())
+            inference_scheduler.report_activity(camera_id, tracked=tracked_count, red_phase=red_phase,
+                                                pending_violations=frame_violations)
+            model_vehicle.frame_done()
+
             # Save frame to video output
             if out:
                 out.write(frame_annotated)
 
             # Stream video
-            _, jpeg = cv2.imencode('.jpg', frame_annotated, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
-            )
+            yield frame_annotated
 
     except Exception as e:
         print(f"❌ Error in stream_violation_video_service1: {e}")
         traceback.print_exc()
     finally:
         # Clean up resources
+        inference_scheduler.unregister(camera_id)
+        model_vehicle.close()
         cap.release()
         if out:
             out.release()
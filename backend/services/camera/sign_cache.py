@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+import cv2
+import numpy as np
+from services.camera.static_overlay import StaticOverlay
+
+# Biển báo là vật cố định: phát hiện khi mở stream rồi định kỳ hoặc khi cảnh thay đổi
+SIGN_REFRESH_SECONDS = float(os.getenv("SIGN_REFRESH_SECONDS", "60"))
+SIGN_CONFIDENCE = 0.1
+SCENE_CHECK_SECONDS = 2.0
+SCENE_CHANGE_THRESHOLD = 30.0  # Chênh lệch xám trung bình trên ảnh thu nhỏ; xe chạy qua không đủ vượt ngưỡng
+SCENE_THUMB_SIZE = (32, 18)
+
+OBJECT_SIZE, MARGIN = 64, 10
+ESTIMATED_TEXT_HEIGHT = 25  # Chiều cao nhãn ước lượng với font_scale=0.6
+THUMB_BORDER_COLOR = (0, 165, 255)
+
+
+def scene_signature(frame):
+    """Ảnh xám 32x18 đã làm mờ, đủ để nhận ra camera bị xoay hay đổi góc"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.GaussianBlur(cv2.resize(gray, SCENE_THUMB_SIZE, interpolation=cv2.INTER_AREA), (3, 3), 0).astype(np.float32)
+
+
+class CameraSigns:
+    def __init__(self):
+        self.signs = []  # (nhãn, thumbnail)
+        self.overlay = None
+        self.size = None
+        self.detected_at = 0.0
+        self.checked_at = 0.0
+        self.signature = None
+
+
+class SignCache:
+    """Biển báo đã phát hiện và thumbnail của chúng theo camera.
+
+    Detector biển báo chỉ chạy khi camera chưa có kết quả, sau SIGN_REFRESH_SECONDS, hoặc
+    khi ảnh thu nhỏ của cảnh khác hẳn lần phát hiện trước (kiểm tra mỗi SCENE_CHECK_SECONDS).
+    Hàng thumbnail được vẽ sẵn thành StaticOverlay; mỗi frame chỉ ghép lớp phủ đó.
+    """
+
+    def __init__(self, refresh_seconds=SIGN_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._cameras = {}
+        self._lock = threading.Lock()
+
+    def overlay(self, camera_id, frame, detector):
+        """Lớp phủ hàng biển báo cho frame (độ phân giải xử lý), phát hiện lại nếu cần"""
+        now = time.time()
+        with self._lock:
+            entry = self._cameras.setdefault(camera_id, CameraSigns())
+        height, width = frame.shape[:2]
+        if self._needs_refresh(entry, frame, now) or entry.size != (width, height):
+            signs = self._detect(frame, detector)
+            with self._lock:
+                entry.signs = signs
+                entry.size = (width, height)
+                entry.overlay = self._render(signs, width, height)
+                entry.detected_at = entry.checked_at = now
+                entry.signature = scene_signature(frame)
+            print(f"[INFO] Camera {camera_id}: detected {len(signs)} traffic signs")
+        return entry.overlay
+
+    def signs(self, camera_id):
+        with self._lock:
+            entry = self._cameras.get(camera_id)
+            return [label for label, _ in entry.signs] if entry else []
+
+    def invalidate(self, camera_id):
+        with self._lock:
+            self._cameras.pop(camera_id, None)
+
+    def _needs_refresh(self, entry, frame, now):
+        if entry.overlay is None or now - entry.detected_at >= self.refresh_seconds:
+            return True
+        if now - entry.checked_at < SCENE_CHECK_SECONDS:
+            return False
+        entry.checked_at = now
+        difference = float(np.mean(np.abs(scene_signature(frame) - entry.signature)))
+        return difference > SCENE_CHANGE_THRESHOLD
+
+    @staticmethod
+    def _detect(frame, detector):
+        height, width = frame.shape[:2]
+        boxes = detector(frame, conf=SIGN_CONFIDENCE).boxes
+        signs = []
+        for box in boxes:
+            x1, y1, x2, y2 = map(int, box.xyxy[0])
+            x1, y1, x2, y2 = max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            crop = frame[y1:y2, x1:x2]
+            signs.append((detector.names[int(box.cls)], cv2.resize(crop, (OBJECT_SIZE, OBJECT_SIZE))))
+        return signs
+
+    @staticmethod
+    def _render(signs, width, height):
+        """Hàng thumbnail từ mép phải sang trái ở đầu khung, như cách vẽ mỗi frame trước đây"""
+        overlay = StaticOverlay(width, height)
+        y = MARGIN
+        right = width - MARGIN
+        for label, thumb in signs:
+            x = right - OBJECT_SIZE
+            if x < MARGIN or y + OBJECT_SIZE + MARGIN + ESTIMATED_TEXT_HEIGHT > height:
+                break
+            overlay.image(thumb, (x, y))
+            overlay.polyline([(x, y), (x + OBJECT_SIZE, y), (x + OBJECT_SIZE, y + OBJECT_SIZE), (x, y + OBJECT_SIZE)],
+                             THUMB_BORDER_COLOR, 2, closed=True)
+            # Chữ có viền: nét đen dày rồi nét trắng, giống put_text_with_outline
+            org = (x, y + OBJECT_SIZE + MARGIN + 15)
+            overlay.text(label, org, 0.5, (0, 0, 0), 4, cv2.LINE_AA)
+            overlay.text(label, org, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+            right = x - MARGIN
+        return overlay.finalize()
+
+
+sign_cache = SignCache()
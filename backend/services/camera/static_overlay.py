@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+SPARSE_FILL_RATIO = 0.3  # Vùng có nét phủ dưới tỉ lệ này của bounding box thì ghép theo từng pixel
+
+
+class StaticOverlay:
+    """Lớp chú thích tĩnh (vùng, vạch, nhãn) vẽ một lần cho mỗi camera/độ phân giải.
+
+    Mỗi nét vẽ được ghép lần lượt theo công thức "over" vào hai ảnh: phần màu đã nhân
+    alpha (premult) và độ truyền qua (transmittance), nên fillPoly bán trong suốt và các
+    nét đặc cho kết quả giống vẽ tuần tự lên frame. Mỗi frame chỉ cần
+    frame * transmittance + premult, và chỉ trong bounding box của các vùng có nét vẽ.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._premult = np.zeros((height, width, 3), dtype=np.float32)
+        self._transmittance = np.ones((height, width, 1), dtype=np.float32)
+        self._regions = None
+
+    def _compose(self, mask, color, alpha):
+        if self._premult is None:
+            raise RuntimeError("Overlay already applied; build a new one to change static annotations")
+        coverage = (mask.astype(np.float32) * (alpha / 255.0))[..., None]
+        self._premult *= 1.0 - coverage
+        self._premult += coverage * np.asarray(color, dtype=np.float32)
+        self._transmittance *= 1.0 - coverage
+
+    def _mask(self):
+        return np.zeros((self.height, self.width), dtype=np.uint8)
+
+    def fill_polygon(self, polygon, color, alpha=1.0):
+        mask = self._mask()
+        cv2.fillPoly(mask, [np.asarray(polygon, dtype=np.int32).reshape(-1, 1, 2)], 255)
+        self._compose(mask, color, alpha)
+
+    def polyline(self, points, color, thickness=2, closed=False, alpha=1.0):
+        mask = self._mask()
+        cv2.polylines(mask, [np.asarray(points, dtype=np.int32).reshape(-1, 1, 2)], closed, 255, thickness)
+        self._compose(mask, color, alpha)
+
+    def text(self, text, org, font_scale, color, thickness=1, line_type=cv2.LINE_8, alpha=1.0):
+        mask = self._mask()
+        cv2.putText(mask, text, tuple(int(v) for v in org), FONT, font_scale, 255, thickness, line_type)
+        self._compose(mask, color, alpha)
+
+    def image(self, image, org):
+        """Dán ảnh (đục) với góc trên trái tại org, phần ra ngoài khung bị cắt"""
+        if self._premult is None:
+            raise RuntimeError("Overlay already applied; build a new one to change static annotations")
+        x, y = map(int, org)
+        height, width = image.shape[:2]
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(self.width, x + width), min(self.height, y + height)
+        if x2 <= x1 or y2 <= y1:
+            return
+        self._premult[y1:y2, x1:x2] = image[y1 - y:y2 - y, x1 - x:x2 - x]
+        self._transmittance[y1:y2, x1:x2] = 0.0
+
+    def _build_regions(self):
+        """Cắt lớp phủ theo bounding box của từng vùng liên thông có nét vẽ.
+
+        Vùng đặc (ví dụ polygon tô màu) được ghép theo cả khối; vùng thưa (viền polygon lớn,
+        vạch, chữ) chỉ ghép đúng các pixel có nét qua chỉ số phẳng. Bộ đệm toàn frame được
+        giải phóng sau bước này.
+        """
+        covered = self._transmittance[..., 0] < 1.0
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(covered.astype(np.uint8), connectivity=8)
+        blocks, sparse = [], []
+        for label in range(1, count):
+            x, y, w, h, area = stats[label]
+            if area >= SPARSE_FILL_RATIO * w * h:
+                window = (slice(y, y + h), slice(x, x + w))
+                # blendLinear cần màu uint8 và hai trọng số một kênh: frame * T + màu * (1 - T)
+                transmittance = self._transmittance[window][..., 0].copy()
+                opacity = 1.0 - transmittance
+                color = self._premult[window] / np.maximum(opacity, 1e-6)[..., None]
+                blocks.append((window, transmittance, opacity, np.clip(color + 0.5, 0, 255).astype(np.uint8)))
+            else:
+                sparse.append(np.flatnonzero(labels.ravel() == label))
+        self._blocks = blocks
+        self._sparse = None
+        if sparse:
+            index = np.concatenate(sparse)
+            self._sparse = (index, self._transmittance.reshape(-1, 1)[index], self._premult.reshape(-1, 3)[index])
+        self._premult = self._transmittance = None
+        self._regions = True
+
+    def finalize(self):
+        """Chốt lớp phủ; gọi trước khi dùng chung giữa nhiều luồng (apply tự gọi nếu cần)"""
+        if self._regions is None:
+            self._build_regions()
+        return self
+
+    def apply(self, frame):
+        """Ghép lớp phủ vào frame (tại chỗ) và trả về chính frame"""
+        if frame.shape[0] != self.height or frame.shape[1] != self.width:
+            raise ValueError(f"Overlay is {self.width}x{self.height}, frame is {frame.shape[1]}x{frame.shape[0]}")
+        self.finalize()
+        for window, transmittance, opacity, color in self._blocks:
+            roi = frame[window]
+            np.copyto(roi, cv2.blendLinear(roi, color, transmittance, opacity))
+        if self._sparse is not None:
+            index, transmittance, premult = self._sparse
+            pixels = frame.reshape(-1, 3)
+            pixels[index] = (pixels[index] * transmittance + premult + 0.5).astype(np.uint8)
+        return frame
+
+
+def polygon_label_anchor(polygon):
+    """Vị trí nhãn ở tâm polygon (trung bình các đỉnh), như cách các dịch vụ vẫn đặt nhãn"""
+    cx, cy = np.mean(polygon, axis=0).astype(int)
+    return int(cx), int(cy)
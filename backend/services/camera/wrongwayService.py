@@ -7,18 +7,25 @@ import json
 import numpy as np
 from datetime import datetime
 from collections import deque, defaultdict
-from ultralytics import YOLO
 import traceback
 import tempfile
 import threading
 from concurrent.futures import ThreadPoolExecutor
 import atexit
 from utils.yt_stream import get_stream_url # Assuming this utility exists
+from services.inference.budget_scheduler import inference_scheduler
+from services.inference.detector import SharedDetector
+from services.inference.model_tier import TieredDetector
+from services.inference.stream_tracker import StreamTracker
+from services.geometry.zone_index import ZoneIndex, box_centers
+from services.camera.static_overlay import StaticOverlay
+from services.camera.sign_cache import sign_cache
 
 # Constants
 VIOLATIONS_DIR = "violations"
 os.makedirs(VIOLATIONS_DIR, exist_ok=True)
 VIOLATION_API_URL = "http://localhost:8081/api/violations"
+DETECT_IMGSZ = 640  # Cạnh dài ảnh đưa vào model; letterbox giữ tỉ lệ gốc của stream
 
 # Thread pool for async violation sending
 violation_executor = ThreadPoolExecutor(max_workers=5)
@@ -47,24 +54,61 @@ def put_text_with_shadow(img, text, org, font_scale, color, shadow_color=(0, 0,
 
 def put_text_with_semi_transparent_bg(img, text, org, font_scale, color, bg_color=(0, 0, 0), bg_alpha=0.6, thickness=1, padding=5):
     """Hiển thị text với nền trong suốt"""
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    (text_width, text_height), baseline = cv2.getTextSize(text, font, font_scale, thickness)
+    draw_labels(img, [(text, org, bg_color)], font_scale, color, bg_alpha, thickness, padding)
+
+def _label_rect(img, text, org, font_scale, thickness, padding):
+    """Khung nền của nhãn (x1, y1, x2, y2), đã cắt theo ảnh; None nếu nằm ngoài ảnh"""
+    (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
     x, y = org
-    
-    # Tạo overlay cho background trong suốt
-    overlay = img.copy()
-    
-    # Vẽ rectangle với padding
-    cv2.rectangle(overlay, 
-                 (x - padding, y - text_height - padding), 
-                 (x + text_width + padding, y + baseline + padding), 
-                 bg_color, -1)
-    
-    # Áp dụng alpha blending
-    cv2.addWeighted(overlay, bg_alpha, img, 1 - bg_alpha, 0, img)
-    
-    # Vẽ text
-    cv2.putText(img, text, (x, y), font, font_scale, color, thickness, cv2.LINE_AA)
+    height, width = img.shape[:2]
+    x1, y1 = max(0, x - padding), max(0, y - text_height - padding)
+    x2, y2 = min(width, x + text_width + padding + 1), min(height, y + baseline + padding + 1)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+def _overlap_groups(rects):
+    """Gom các khung chồng lấn nhau thành nhóm: (bounding box chung, chỉ số các khung)"""
+    groups = []
+    for idx, rect in enumerate(rects):
+        box, members = list(rect), [idx]
+        merged = True
+        while merged:
+            merged = False
+            for group in groups:
+                gx1, gy1, gx2, gy2 = group[0]
+                if gx1 < box[2] and box[0] < gx2 and gy1 < box[3] and box[1] < gy2:
+                    groups.remove(group)
+                    box = [min(gx1, box[0]), min(gy1, box[1]), max(gx2, box[2]), max(gy2, box[3])]
+                    members = group[1] + members
+                    merged = True
+                    break
+        groups.append((box, members))
+    return groups
+
+def draw_labels(img, labels, font_scale=0.5, color=(255, 255, 255), bg_alpha=0.6, thickness=1, padding=5):
+    """Vẽ mọi nhãn nền trong suốt của một frame: labels là dãy (text, org, bg_color).
+
+    Chỉ pha trộn trong khung của các nhãn, tại chỗ: các khung chồng lấn được gom thành
+    một vùng và mỗi pixel chỉ pha trộn một lần (nền nhãn sau đè nền nhãn trước), rồi
+    toàn bộ chữ được vẽ lên trên. Chi phí theo diện tích nhãn, không theo kích thước frame.
+    """
+    labels = [(text, tuple(map(int, org)), bg_color) for text, org, bg_color in labels]
+    placed = [(rect, label) for label in labels
+              for rect in [_label_rect(img, label[0], label[1], font_scale, thickness, padding)] if rect is not None]
+    for (x1, y1, x2, y2), members in _overlap_groups([rect for rect, _ in placed]):
+        region = img[y1:y2, x1:x2]
+        background = np.empty_like(region)
+        covered = np.zeros(region.shape[:2], dtype=bool)
+        for idx in sorted(members):
+            (rx1, ry1, rx2, ry2), (_, _, bg_color) = placed[idx]
+            background[ry1 - y1:ry2 - y1, rx1 - x1:rx2 - x1] = bg_color
+            covered[ry1 - y1:ry2 - y1, rx1 - x1:rx2 - x1] = True
+        blended = cv2.addWeighted(background, bg_alpha, region, 1 - bg_alpha, 0)
+        np.copyto(region, blended, where=covered[..., None])
+
+    for text, (x, y), _ in labels:
+        cv2.putText(img, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, thickness, cv2.LINE_AA)
 
 def save_temp_violation_video(frames, fps, output_path, width, height):
     """Save a list of frames to a temporary video file."""
@@ -116,10 +160,9 @@ def stream_violation_wrongway_video_service1(youtube_url: str, camera_id: int):
 
     # Load models
     model_sign_path = "trafficsign.pt"
-    model_vehicle_path = "yolov8m.pt"
     try:
-        model_sign = YOLO(model_sign_path)
-        model_vehicle = YOLO(model_vehicle_path)
+        model_sign = SharedDetector(model_sign_path)
+        model_vehicle = TieredDetector(camera_id)  # Model xe theo bậc tải (n/s/m)
     except Exception as e:
         print(f"❌ Error loading models: {e}")
         yield b"Error: Could not load AI models."
@@ -159,10 +202,24 @@ def stream_violation_wrongway_video_service1(youtube_url: str, camera_id: int):
 
     original_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    
-    # Fixed processing resolution for consistency with user's original code
-    # We will upscale the final output frame back to original_width, original_height
-    processing_width, processing_height = 640, 640 
+    first_frame = None  # Frame đã đọc để lấy kích thước được đưa vào vòng xử lý, không bỏ đi
+    if original_width <= 0 or original_height <= 0:
+        ret, first_frame = cap.read()
+        if not ret:
+            print("❌ Cannot read the first frame to determine stream resolution.")
+            yield b"Error: Cannot read from video stream."
+            return
+        original_height, original_width = first_frame.shape[:2]
+
+    # Xử lý và vẽ ở độ phân giải gốc: detector tự letterbox về DETECT_IMGSZ giữ nguyên tỉ lệ
+    # và trả box theo tọa độ frame gốc, nên vùng/lớp phủ chỉ cần quy đổi một lần sang tọa độ gốc
+    processing_width, processing_height = original_width, original_height
+    # Nét vẽ và cỡ chữ được chỉnh cho khung DETECT_IMGSZ; nhân theo tỉ lệ để nhìn như nhau ở mọi độ phân giải
+    draw_scale = processing_width / DETECT_IMGSZ
+    line_thickness = max(1, round(2 * draw_scale))
+    center_radius = max(2, round(4 * draw_scale))
+    label_font_scale = 0.5 * draw_scale
+    label_thickness = max(1, round(draw_scale))
 
     # Function to convert percentage coordinates to pixel coordinates
     def convert_percentage_to_frame(percentage_coords_str, frame_width, frame_height):
@@ -226,23 +283,38 @@ def stream_violation_wrongway_video_service1(youtube_url: str, camera_id: int):
         # Add other zone types if needed for sign detection zones, etc.
         # For now, the wrongway service only uses 'lane' zones for vehicle checks.
 
+    # Ảnh nhãn vùng làn ở độ phân giải xử lý: tra vùng cho mọi xe bằng một phép index
+    lane_index = ZoneIndex(processing_width, processing_height,
+                           {zone_id: zone["polygon"] for zone_id, zone in lane_zones.items()})
+
+    # Vùng làn được vẽ một lần vào lớp phủ tĩnh; mỗi frame chỉ ghép lớp phủ, không tô lại từng vùng
+    static_overlay = StaticOverlay(processing_width, processing_height)
+    for zone_data in lane_zones.values():
+        static_overlay.fill_polygon(zone_data["polygon"], zone_data["color"], alpha=0.4)
+        static_overlay.polyline(zone_data["polygon"], zone_data["color"], line_thickness, closed=True)
+
     # Constants for tracking and display
     object_tracks = defaultdict(lambda: deque(maxlen=5)) # Still track for potential future use or other analytics
-    OBJECT_SIZE, MARGIN = 64, 10
     target_vehicle_classes = ['car', 'motorcycle', 'truck', 'bus'] # Added 'bus' as it's a common vehicle type
-    print(f"🔴 Starting camera {camera_id}, original resolution: {original_width}x{original_height}, processing at {processing_width}x{processing_height}")
+    print(f"🔴 Starting camera {camera_id}, original resolution: {original_width}x{original_height}, detection letterboxed to {DETECT_IMGSZ}")
 
     # Use a dictionary to store violation status per track_id, including a flag if it's been recorded
     vehicle_violation_status = defaultdict(lambda: {"is_wrong_way": False, "recorded_wrong_way": False})
         
     # Buffer for 1 second of frames at 30 FPS (assuming typical stream FPS)
-    # This buffer will now store frames at the ORIGINAL resolution
+    # This buffer stores annotated frames at the ORIGINAL resolution
     frame_buffer = deque(maxlen=30) 
     fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    tracker = StreamTracker("bytetrack.yaml")
+    vehicle_class_ids = model_vehicle.class_ids(target_vehicle_classes)
 
+    inference_scheduler.register(camera_id)
     try:
         while True:
-            ret, frame = cap.read()
+            if first_frame is not None:
+                ret, frame, first_frame = True, first_frame, None
+            else:
+                ret, frame = cap.read()
             if not ret:
                 print("⚠️ Failed to read frame, attempting to reconnect...")
                 cap.release()
@@ -252,74 +324,37 @@ def stream_violation_wrongway_video_service1(youtube_url: str, camera_id: int):
                     print("❌ Failed to reconnect to stream. Exiting.")
                     break
                 continue
-            
-            # Resize frame for AI processing
-            resized_frame = cv2.resize(frame, (processing_width, processing_height))
-            annotated_frame = resized_frame.copy() # This frame is 640x640 for drawing
-
-            alpha = 0.4
-            # Draw zones on the annotated frame (640x640)
-            for zone_id, zone_data in lane_zones.items():
-                if zone_data["polygon"].size == 0: continue # Skip if polygon is empty
-                overlay = annotated_frame.copy()
-                pts = zone_data["polygon"].reshape((-1, 1, 2))
-                color = zone_data["color"] # Use the stored color
-                cv2.fillPoly(overlay, [pts], color)
-                cv2.addWeighted(overlay, alpha, annotated_frame, 1 - alpha, 0, annotated_frame)
-                cv2.polylines(annotated_frame, [pts], True, color, 2)
-                        
-            # Traffic Sign Detection
-            results_sign = model_sign(resized_frame, conf=0.1)
-            boxes_sign = results_sign[0].boxes
-                    
-            # Variables for horizontal sign display
-            sign_display_y_fixed = MARGIN # Fixed Y position for the row of signs (top of the frame)
-            current_sign_x = processing_width - MARGIN # Start from the right edge, move left for each sign
-            for i, box in enumerate(boxes_sign):
-                cls_id = int(box.cls)
-                label = model_sign.names[cls_id]
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                x1, y1, x2, y2 = max(0, x1), max(0, y1), min(processing_width, x2), min(processing_height, y2)
-                if x2 <= x1 or y2 <= y1:
-                    continue
-                crop = resized_frame[y1:y2, x1:x2]
-                if crop.size == 0:
-                    continue
-                thumb = cv2.resize(crop, (OBJECT_SIZE, OBJECT_SIZE))
-                        
-                # Calculate x position for the current sign thumbnail
-                x_thumb = current_sign_x - OBJECT_SIZE
-                # Check if the sign thumbnail would go off-screen to the left
-                # Estimate text height for this check (a reasonable estimate for font_scale=0.6)
-                estimated_text_height = 25
-                if x_thumb < MARGIN or (sign_display_y_fixed + OBJECT_SIZE + MARGIN + estimated_text_height) > processing_height:
-                    break # Stop displaying signs if no more space horizontally or vertically
-                        
-                # Place the thumbnail
-                annotated_frame[sign_display_y_fixed : sign_display_y_fixed + OBJECT_SIZE,
-                                x_thumb : x_thumb + OBJECT_SIZE] = thumb
-                # Draw bounding box around the sign thumbnail
-                cv2.rectangle(annotated_frame, (x_thumb, sign_display_y_fixed),
-                                (x_thumb + OBJECT_SIZE, sign_display_y_fixed + OBJECT_SIZE), (0, 165, 255), 2)
-                
-                # Improved text display for sign labels - sử dụng outline thay vì background box
-                text_org_x = x_thumb
-                text_org_y = sign_display_y_fixed + OBJECT_SIZE + MARGIN + 15
-                put_text_with_outline(annotated_frame, label, (text_org_x, text_org_y), 
-                                    font_scale=0.5, color=(255, 255, 255), outline_color=(0, 0, 0), thickness=1)
-                
-                # Update x for the next sign (move further left, including margin)
-                current_sign_x = x_thumb - MARGIN
-                        
-            # Vehicle Detection and Tracking
-            results_vehicle = model_vehicle.track(source=resized_frame, persist=True, conf=0.3, iou=0.5, tracker="bytetrack.yaml")[0]
+
+            # Stream đổi độ phân giải giữa chừng (ví dụ sau khi kết nối lại): đưa về kích thước của vùng đã quy đổi
+            if frame.shape[1] != processing_width or frame.shape[0] != processing_height:
+                frame = cv2.resize(frame, (processing_width, processing_height))
+
+            # Bỏ qua suy luận khi camera đã dùng hết ngân sách, nhưng vẫn giữ frame trong buffer
+            # để video vi phạm không bị nén thời gian, và vẫn gửi cho người xem (kèm vùng làn)
+            if not inference_scheduler.acquire(camera_id):
+                static_overlay.apply(frame)
+                frame_buffer.append(frame)
+                yield frame
+                continue
+
+            # Vehicle Detection and Tracking (trên frame gốc, trước khi vẽ)
+            results_vehicle = tracker.update(model_vehicle.detect(frame, conf=0.3, iou=0.5, imgsz=DETECT_IMGSZ,
+                                                                  classes=vehicle_class_ids))
+
+            # Traffic signs: phát hiện khi mở stream rồi định kỳ/khi đổi cảnh, vẽ từ cache theo camera
+            sign_overlay = sign_cache.overlay(camera_id, frame, model_sign)
+
+            # Frame đọc từ stream là mảng mới mỗi lần nên vẽ thẳng lên đó, không cần bản sao
+            annotated_frame = frame
+            static_overlay.apply(annotated_frame)
+            sign_overlay.apply(annotated_frame)
             current_frame_track_ids = set()
+            vehicle_labels = []
             if results_vehicle.boxes is not None and results_vehicle.boxes.id is not None:
+                frame_zone_ids = lane_index.zone_at(box_centers(results_vehicle.boxes.xyxy.cpu().numpy()))
                 for i in range(len(results_vehicle.boxes)):
                     cls_id = int(results_vehicle.boxes.cls[i])
                     cls_name = model_vehicle.names[cls_id]
-                    if cls_name not in target_vehicle_classes:
-                        continue
                                         
                     x1, y1, x2, y2 = map(int, results_vehicle.boxes.xyxy[i])
                     cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
@@ -333,56 +368,52 @@ def stream_violation_wrongway_video_service1(youtube_url: str, camera_id: int):
                     label = f"ID:{track_id} {cls_name}"
                     bbox_color = (0, 255, 0) # Default to green (OK)
                                         
-                    found_zone = False
-                    for z_id, z_data in lane_zones.items():
-                        if z_data["polygon"].size == 0: continue # Skip if polygon is empty
-                        if cv2.pointPolygonTest(z_data["polygon"], (cx, cy), False) >= 0:
-                            found_zone = True
-                            # If the detected vehicle type is NOT allowed in this zone, it's a "wrong way" violation
-                            if cls_name not in z_data["allowed_vehicles"]:
-                                vehicle_violation_status[track_id]["is_wrong_way"] = True
-                                bbox_color = (0, 0, 255) # Red for violation
-                                label += f" - SAI LÀN ({z_data['name']})"
-                                print(f"WRONG WAY VIOLATION (Zone): Vehicle {track_id} ({cls_name}) in zone {z_data['name']} (ID: {z_id}) - not allowed.")
-                                
-                                # Save violation to API (only if not already recorded for this track_id)
-                                if not vehicle_violation_status[track_id]['recorded_wrong_way']:
-                                    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_image, \
-                                         tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
-                                        image_path = temp_image.name
-                                        video_path = temp_video.name
-                                        
-                                        # Save image (current annotated frame, upscaled to original resolution)
-                                        # Create the final output frame at original resolution for saving and streaming
-                                        final_output_frame_for_save = cv2.resize(annotated_frame, (original_width, original_height))
-                                        cv2.imwrite(image_path, final_output_frame_for_save)
-                                        
-                                        # Save video (1s before and after the current frame)
-                                        # Ensure violation_frames are correctly captured from the buffer (which now stores original resolution frames)
-                                        # The buffer should contain frames at original resolution
-                                        violation_frames = list(frame_buffer)[-int(fps):] + [final_output_frame_for_save] + list(frame_buffer)[:int(fps)]
-                                        save_temp_violation_video(violation_frames, fps, video_path, original_width, original_height)
-                                        
-                                        # Prepare violation data for API
-                                        violation_data = {
-                                            "camera": {"id": camera_id},
-                                            "status": "PENDING",
-                                            "createdAt": datetime.now().isoformat(),
-                                            "violationDetails": [{
-                                                "violationTypeId": 4,  # Assuming 4 is WRONG_LANE
-                                                "violationTime": datetime.now().isoformat(),
-                                                "licensePlate": f"TRACK_{track_id}"  # Placeholder
-                                            }]
-                                        }
-                                        # Send violation asynchronously (non-blocking)
-                                        print(f"📤 Sending WRONG_LANE violation for track {track_id} asynchronously...")
-                                        send_violation_async(violation_data, image_path, video_path, track_id)
-                                        
-                                    vehicle_violation_status[track_id]['recorded_wrong_way'] = True
-                            else:
-                                # If vehicle is in a correct lane, reset the recorded flag
-                                vehicle_violation_status[track_id]['recorded_wrong_way'] = False
-                            break # Found the zone, no need to check others
+                    z_id = frame_zone_ids[i]
+                    found_zone = z_id is not None
+                    if found_zone:
+                        z_data = lane_zones[z_id]
+                        # If the detected vehicle type is NOT allowed in this zone, it's a "wrong way" violation
+                        if cls_name not in z_data["allowed_vehicles"]:
+                            vehicle_violation_status[track_id]["is_wrong_way"] = True
+                            bbox_color = (0, 0, 255) # Red for violation
+                            label += f" - SAI LÀN ({z_data['name']})"
+                            print(f"WRONG WAY VIOLATION (Zone): Vehicle {track_id} ({cls_name}) in zone {z_data['name']} (ID: {z_id}) - not allowed.")
+                            
+                            # Save violation to API (only if not already recorded for this track_id)
+                            if not vehicle_violation_status[track_id]['recorded_wrong_way']:
+                                with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_image, \
+                                     tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_video:
+                                    image_path = temp_image.name
+                                    video_path = temp_video.name
+                                    
+                                    # Save image (current annotated frame, already at original resolution)
+                                    final_output_frame_for_save = annotated_frame.copy()
+                                    cv2.imwrite(image_path, final_output_frame_for_save)
+                                    
+                                    # Save video (1s before and after the current frame)
+                                    # The buffer stores annotated frames at original resolution
+                                    violation_frames = list(frame_buffer)[-int(fps):] + [final_output_frame_for_save] + list(frame_buffer)[:int(fps)]
+                                    save_temp_violation_video(violation_frames, fps, video_path, original_width, original_height)
+                                    
+                                    # Prepare violation data for API
+                                    violation_data = {
+                                        "camera": {"id": camera_id},
+                                        "status": "PENDING",
+                                        "createdAt": datetime.now().isoformat(),
+                                        "violationDetails": [{
+                                            "violationTypeId": 4,  # Assuming 4 is WRONG_LANE
+                                            "violationTime": datetime.now().isoformat(),
+                                            "licensePlate": f"TRACK_{track_id}"  # Placeholder
+                                        }]
+                                    }
+                                    # Send violation asynchronously (non-blocking)
+                                    print(f"📤 Sending WRONG_LANE violation for track {track_id} asynchronously...")
+                                    send_violation_async(violation_data, image_path, video_path, track_id)
+                                    
+                                vehicle_violation_status[track_id]['recorded_wrong_way'] = True
+                        else:
+                            # If vehicle is in a correct lane, reset the recorded flag
+                            vehicle_violation_status[track_id]['recorded_wrong_way'] = False
                                 
                     # If vehicle is not in any defined lane zone, reset wrong way flag
                     if not found_zone:
@@ -397,17 +428,18 @@ def stream_violation_wrongway_video_service1(youtube_url: str, camera_id: int):
                         label = f"ID:{track_id} {cls_name}"
                                         
                     # Draw bounding box
-                    cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), bbox_color, 2)
+                    cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), bbox_color, line_thickness)
                     
                     # Improved text display for vehicle labels
-                    # Sử dụng semi-transparent background cho text của vehicle
-                    text_y = max(y1 - 8, 20)  # Đảm bảo text không bị cắt ở phía trên
-                    put_text_with_semi_transparent_bg(annotated_frame, label, (x1, text_y), 
-                                                    font_scale=0.5, color=(255, 255, 255), 
-                                                    bg_color=bbox_color, bg_alpha=0.7, padding=3)
+                    # Nhãn nền trong suốt được gom lại, vẽ một lượt sau vòng lặp
+                    text_y = max(y1 - round(8 * draw_scale), round(20 * draw_scale))  # Đảm bảo text không bị cắt ở phía trên
+                    vehicle_labels.append((label, (x1, text_y), bbox_color))
                     
                     # Vẽ điểm trung tâm
-                    cv2.circle(annotated_frame, (cx, cy), 4, (0, 255, 255), -1)
+                    cv2.circle(annotated_frame, (cx, cy), center_radius, (0, 255, 255), -1)
+
+                draw_labels(annotated_frame, vehicle_labels, font_scale=label_font_scale, color=(255, 255, 255),
+                            bg_alpha=0.7, thickness=label_thickness, padding=max(2, round(3 * draw_scale)))
                                         
             # Clean up tracks of objects no longer appearing in the current frame
             # Iterate over a copy of keys to allow modification during iteration
@@ -418,23 +450,26 @@ def stream_violation_wrongway_video_service1(youtube_url: str, camera_id: int):
                     if obj_id in vehicle_violation_status:
                         del vehicle_violation_status[obj_id]
             
-            # Upscale the annotated frame to the original resolution for output
-            final_output_frame = cv2.resize(annotated_frame, (original_width, original_height))
-            
-            # Store the final_output_frame (original resolution) in the buffer
-            frame_buffer.append(final_output_frame.copy()) 
+            inference_scheduler.report_activity(
+                camera_id,
+                tracked=len(current_frame_track_ids),
+                pending_violations=sum(1 for status in vehicle_violation_status.values() if status["is_wrong_way"])
+            )
+            model_vehicle.frame_done()
+
+            # Annotated frame is already at the original resolution; it is not modified after this point
+            final_output_frame = annotated_frame
+            frame_buffer.append(final_output_frame)
 
             # Encode and yield the annotated frame (now at original resolution)
-            _, jpeg = cv2.imencode('.jpg', final_output_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
-            )
+            yield final_output_frame
     except Exception as e:
         print(f"Error in stream_violation_wrongway_video_service1: {e}")
         traceback.print_exc()
         yield b"Error: An unexpected error occurred during streaming."
     finally:
+        inference_scheduler.unregister(camera_id)
+        model_vehicle.close()
         if cap.isOpened():
             cap.release()
         print("✅ Stream ended.")
@@ -0,0 +1,113 @@
+import os
+import time
+import numpy as np
+
+# Trường hướng di chuyển học từ mọi track, mỗi camera một file
+FLOW_FIELD_DIR = os.getenv("FLOW_FIELD_DIR", "flow_fields")
+FLOW_GRID_COLS = int(os.getenv("FLOW_GRID_COLS", "32"))
+FLOW_GRID_ROWS = int(os.getenv("FLOW_GRID_ROWS", "18"))
+FLOW_MIN_SAMPLES = float(os.getenv("FLOW_MIN_SAMPLES", "20"))  # Ô có ít mẫu hơn thì chưa dùng để xét ngược chiều
+FLOW_MIN_CONFIDENCE = 0.5  # Độ dài vector trung bình (0..1): thấp nghĩa là các xe trong ô đi nhiều hướng
+FLOW_DECAY = 0.999  # Mỗi mẫu mới làm mẫu cũ của ô nhẹ đi, để trường theo kịp thay đổi tổ chức giao thông
+FLOW_SAVE_SECONDS = 60
+
+
+class FlowField:
+    """Hướng di chuyển đúng của từng ô trên một lưới thô phủ khung hình.
+
+    Mỗi ô giữ tổng các vector hướng đơn vị (có suy giảm) và tổng trọng số: hướng của ô
+    là trung bình vòng của mọi track đi qua, confidence là độ dài vector trung bình.
+    Lưới tính theo tọa độ chuẩn hóa nên không phụ thuộc độ phân giải stream và được lưu
+    ra FLOW_FIELD_DIR/cam_<id>.npz để dùng lại sau khi khởi động lại.
+    """
+
+    def __init__(self, camera_id, width, height, cols=FLOW_GRID_COLS, rows=FLOW_GRID_ROWS,
+                 root=FLOW_FIELD_DIR, decay=FLOW_DECAY):
+        self.camera_id = camera_id
+        self.width = width
+        self.height = height
+        self.cols = cols
+        self.rows = rows
+        self.decay = decay
+        self.path = os.path.join(root, f"cam_{camera_id}.npz") if root else None
+        self.vectors = np.zeros((rows * cols, 2), dtype=np.float64)
+        self.weights = np.zeros(rows * cols, dtype=np.float64)
+        self._saved_at = time.time()
+        self._dirty = False
+        self._load()
+
+    def cells(self, points):
+        """Chỉ số ô (phẳng) của mảng điểm Nx2 theo pixel"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        col = np.clip((points[:, 0] * self.cols / self.width).astype(np.int64), 0, self.cols - 1)
+        row = np.clip((points[:, 1] * self.rows / self.height).astype(np.int64), 0, self.rows - 1)
+        return row * self.cols + col
+
+    def observe(self, points, headings):
+        """Cộng hướng của các track (đã đủ mẫu) vào ô chứa chúng"""
+        headings = np.asarray(headings, dtype=np.float64).reshape(-1, 2)
+        norm = np.hypot(headings[:, 0], headings[:, 1])
+        valid = norm > 0
+        if not valid.any():
+            return
+        cells = self.cells(points)[valid]
+        units = headings[valid] / norm[valid, None]
+        # Suy giảm theo số mẫu mới của từng ô, không theo thời gian: ô vắng xe giữ nguyên
+        counts = np.bincount(cells, minlength=len(self.weights))
+        touched = np.flatnonzero(counts)
+        factor = self.decay ** counts[touched]
+        self.vectors[touched] *= factor[:, None]
+        self.weights[touched] *= factor
+        np.add.at(self.vectors, cells, units)
+        np.add.at(self.weights, cells, 1.0)
+        self._dirty = True
+
+    def lookup(self, points):
+        """(hướng đơn vị Nx2, confidence N, trọng số N) của ô chứa từng điểm"""
+        cells = self.cells(points)
+        vectors = self.vectors[cells]
+        weights = self.weights[cells]
+        length = np.hypot(vectors[:, 0], vectors[:, 1])
+        headings = np.divide(vectors, length[:, None], out=np.zeros_like(vectors), where=length[:, None] > 0)
+        confidence = np.divide(length, weights, out=np.zeros_like(length), where=weights > 0)
+        return headings, confidence, weights
+
+    def agreement(self, points, headings, min_samples=FLOW_MIN_SAMPLES, min_confidence=FLOW_MIN_CONFIDENCE):
+        """Cosine giữa hướng track và hướng ô (N), cùng mặt nạ ô đã học đủ để tin cậy"""
+        headings = np.asarray(headings, dtype=np.float64).reshape(-1, 2)
+        flow, confidence, weights = self.lookup(points)
+        norm = np.hypot(headings[:, 0], headings[:, 1])
+        cosine = np.divide((headings * flow).sum(axis=1), norm, out=np.zeros_like(norm), where=norm > 0)
+        known = (weights >= min_samples) & (confidence >= min_confidence) & (norm > 0)
+        return cosine, known
+
+    def maybe_save(self, interval=FLOW_SAVE_SECONDS):
+        if self._dirty and time.time() - self._saved_at >= interval:
+            self.save()
+
+    def save(self):
+        self._saved_at = time.time()
+        if not self.path or not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp.npz"
+            np.savez(tmp_path, vectors=self.vectors, weights=self.weights, grid=np.array([self.rows, self.cols]))
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            print(f"[-] Failed to save flow field for camera {self.camera_id}: {e}")
+
+    def _load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                if tuple(data["grid"]) != (self.rows, self.cols):
+                    print(f"[-] Flow field grid changed for camera {self.camera_id}, relearning")
+                    return
+                self.vectors[:] = data["vectors"]
+                self.weights[:] = data["weights"]
+            print(f"[+] Loaded flow field for camera {self.camera_id} ({int((self.weights >= FLOW_MIN_SAMPLES).sum())} learned cells)")
+        except (OSError, KeyError, ValueError) as e:
+            print(f"[-] Failed to load flow field for camera {self.camera_id}: {e}")
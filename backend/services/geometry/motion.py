@@ -0,0 +1,128 @@
+import numpy as np
+
+HEADING_WINDOW = 10  # Số mẫu hướng gần nhất giữ cho mỗi track
+MIN_STEP_PX = 5  # Dịch chuyển nhỏ hơn (theo cả hai trục) không được tính là một mẫu hướng
+MAX_MISSING_UPDATES = 30  # Track không xuất hiện quá số lần cập nhật này thì bị xóa trạng thái
+
+
+def line_segments(lines):
+    """Mảng Lx4 (x1, y1, x2, y2) từ hai điểm đầu của mỗi vạch; vạch thiếu điểm thành NaN"""
+    segments = np.full((len(lines), 4), np.nan, dtype=np.float64)
+    for idx, coords in enumerate(lines):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if len(coords) >= 2:
+            segments[idx] = coords[:2].ravel()
+    return segments
+
+
+def side_of_lines(points, segments):
+    """Tích có hướng NxL của mọi điểm với mọi vạch; > 0 là phía dưới vạch trên màn hình"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    return (dx[None, :] * (points[:, 1:2] - segments[None, :, 1])
+            - dy[None, :] * (points[:, 0:1] - segments[None, :, 0]))
+
+
+class TrackMotion:
+    """Vị trí, phía so với vạch và hướng di chuyển của mọi track trong một stream.
+
+    Trạng thái nằm trong các mảng NumPy, mỗi track một hàng. update() nhận tâm của mọi
+    track trong frame và trong vài phép tính vector trả về: vạch nào bị vượt từ dưới lên
+    (up) hoặc từ trên xuống (down), và track nào có mẫu hướng mới. Hướng của track là
+    trung bình các vector đơn vị trong vòng đệm HEADING_WINDOW mẫu gần nhất.
+    """
+
+    def __init__(self, lines=(), window=HEADING_WINDOW, min_step=MIN_STEP_PX,
+                 max_missing=MAX_MISSING_UPDATES, capacity=64):
+        self.segments = line_segments(lines)
+        self.window = window
+        self.min_step = min_step
+        self.max_missing = max_missing
+        self._rows = {}  # track_id -> hàng
+        self._free = []
+        self._tick = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        old = getattr(self, "positions", None)
+        size = 0 if old is None else len(old)
+        self._free.extend(range(capacity - 1, size - 1, -1))
+
+        def grow(array, shape, dtype, fill=0):
+            new = np.full((capacity,) + shape, fill, dtype=dtype)
+            if array is not None:
+                new[:size] = array
+            return new
+
+        self.positions = grow(old, (2,), np.float64)
+        self.below = grow(getattr(self, "below", None), (len(self.segments),), bool)
+        self.samples = grow(getattr(self, "samples", None), (self.window, 2), np.float64)
+        self.sample_count = grow(getattr(self, "sample_count", None), (), np.int64)
+        self.last_seen = grow(getattr(self, "last_seen", None), (), np.int64)
+
+    def _rows_for(self, track_ids):
+        rows = np.empty(len(track_ids), dtype=np.int64)
+        fresh = np.zeros(len(track_ids), dtype=bool)
+        for i, track_id in enumerate(track_ids):
+            row = self._rows.get(track_id)
+            if row is None:
+                if not self._free:
+                    self._allocate(len(self.positions) * 2)
+                row = self._rows[track_id] = self._free.pop()
+                self.sample_count[row] = 0
+                fresh[i] = True
+            rows[i] = row
+        return rows, fresh
+
+    def update(self, track_ids, points):
+        """Cập nhật vị trí; trả về (crossed_up NxL, crossed_down NxL, moved N)"""
+        self._tick += 1
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        rows, fresh = self._rows_for(list(track_ids))
+        had_prev = ~fresh
+
+        with np.errstate(invalid="ignore"):
+            below = side_of_lines(points, self.segments) > 0
+        prev_below = self.below[rows]
+        crossed_up = had_prev[:, None] & prev_below & ~below
+        crossed_down = had_prev[:, None] & ~prev_below & below
+
+        step = points - self.positions[rows]
+        magnitude = np.hypot(step[:, 0], step[:, 1])
+        moved = had_prev & (np.abs(step) > self.min_step).any(axis=1) & (magnitude > 0)
+        moved_rows = rows[moved]
+        slots = self.sample_count[moved_rows] % self.window
+        self.samples[moved_rows, slots] = step[moved] / magnitude[moved, None]
+        self.sample_count[moved_rows] += 1
+
+        self.positions[rows] = points
+        self.below[rows] = below
+        self.last_seen[rows] = self._tick
+        self._prune()
+        return crossed_up, crossed_down, moved
+
+    def headings(self, track_ids):
+        """(hướng trung bình Nx2, số mẫu N); track chưa có mẫu có hướng (0, 0)"""
+        rows = np.array([self._rows.get(track_id, -1) for track_id in track_ids], dtype=np.int64)
+        known = rows >= 0
+        headings = np.zeros((len(rows), 2), dtype=np.float64)
+        counts = np.zeros(len(rows), dtype=np.int64)
+        if known.any():
+            counts[known] = np.minimum(self.sample_count[rows[known]], self.window)
+            sums = self.samples[rows[known]].sum(axis=1)
+            headings[known] = sums / np.maximum(counts[known], 1)[:, None]
+        return headings, counts
+
+    def forget(self, track_ids):
+        for track_id in track_ids:
+            row = self._rows.pop(track_id, None)
+            if row is not None:
+                self.samples[row] = 0
+                self._free.append(row)
+
+    def _prune(self):
+        stale = [track_id for track_id, row in self._rows.items()
+                 if self._tick - self.last_seen[row] > self.max_missing]
+        if stale:
+            self.forget(stale)
@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+
+LINE_BAND_PX = 10  # Tâm xe cách vạch dưới ngưỡng này được coi là "gần vạch"
+
+
+class ZoneIndex:
+    """Chỉ mục vùng dựng một lần cho mỗi độ phân giải camera.
+
+    Các polygon được tô bằng fillPoly vào một ảnh nhãn uint16 (0 = ngoài mọi vùng,
+    i + 1 = vùng thứ i); vùng khai báo trước được ưu tiên khi chồng lấn, giống vòng lặp
+    pointPolygonTest cũ dừng ở vùng đầu tiên. Quanh các vạch có một dải tính bằng
+    distance transform, lưu nhãn vạch gần nhất và khoảng cách tới nó. Tra cứu cho mọi tâm
+    xe trong frame chỉ là một phép fancy-index, không phụ thuộc số vùng.
+    """
+
+    def __init__(self, width, height, zones=None, lines=None, line_band=LINE_BAND_PX):
+        self.width = width
+        self.height = height
+        self.zone_ids = list(zones or {})
+        self.line_ids = list(lines or {})
+        self.labels = np.zeros((height, width), dtype=np.uint16)
+        for idx in reversed(range(len(self.zone_ids))):
+            polygon = np.asarray(zones[self.zone_ids[idx]], dtype=np.int32).reshape(-1, 1, 2)
+            if len(polygon) >= 3:
+                cv2.fillPoly(self.labels, [polygon], idx + 1)
+
+        self.line_labels = np.zeros((height, width), dtype=np.uint16)
+        self.line_distance = np.full((height, width), np.inf, dtype=np.float32)
+        for idx, line_id in enumerate(self.line_ids):
+            coords = np.asarray(lines[line_id], dtype=np.int32).reshape(-1, 1, 2)
+            if len(coords) < 2:
+                continue
+            # distanceTransform đo khoảng cách tới điểm 0 gần nhất: vạch = 0, còn lại = 1
+            mask = np.ones((height, width), dtype=np.uint8)
+            cv2.polylines(mask, [coords], isClosed=False, color=0, thickness=1)
+            distance = cv2.distanceTransform(mask, cv2.DIST_L2, 5)
+            closer = (distance < line_band) & (distance < self.line_distance)
+            self.line_labels[closer] = idx + 1
+            self.line_distance = np.minimum(self.line_distance, distance)
+
+    def _pixels(self, points):
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        xs = np.clip(points[:, 0], 0, self.width - 1)
+        ys = np.clip(points[:, 1], 0, self.height - 1)
+        return ys, xs
+
+    def zone_indices(self, points):
+        """Chỉ số vùng (1-based, 0 = không thuộc vùng nào) cho mảng điểm Nx2"""
+        if len(points) == 0:
+            return np.zeros(0, dtype=np.uint16)
+        return self.labels[self._pixels(points)]
+
+    def zone_at(self, points):
+        """ID vùng chứa từng điểm, None nếu ở ngoài"""
+        return [self.zone_ids[idx - 1] if idx else None for idx in self.zone_indices(points)]
+
+    def line_at(self, points):
+        """ID vạch gần nhất trong dải line_band quanh từng điểm, None nếu xa mọi vạch"""
+        if len(points) == 0:
+            return []
+        return [self.line_ids[idx - 1] if idx else None for idx in self.line_labels[self._pixels(points)]]
+
+
+def box_centers(xyxy):
+    """Tâm (cx, cy) nguyên của mảng box Nx4, giống (x1 + x2) // 2 trong các vòng lặp cũ"""
+    boxes = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4).astype(np.int64)
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) // 2, (boxes[:, 1] + boxes[:, 3]) // 2], axis=1)
@@ -0,0 +1,150 @@
+import os
+import time
+import threading
+
+# Tổng ngân sách suy luận (số lần chạy detector mỗi giây) cho toàn bộ camera trên node
+TOTAL_INFERENCE_FPS = float(os.getenv("TOTAL_INFERENCE_FPS", "30"))
+MIN_CAMERA_FPS = float(os.getenv("MIN_CAMERA_FPS", "2"))  # Sàn cho camera đang rảnh
+MAX_CAMERA_FPS = float(os.getenv("MAX_CAMERA_FPS", "30"))  # Không vượt quá fps của stream
+
+# Trọng số hoạt động dùng để chia phần ngân sách còn lại
+TRACK_WEIGHT = 1.0
+RED_PHASE_WEIGHT = 5.0
+PENDING_VIOLATION_WEIGHT = 3.0
+ACTIVITY_DECAY_SECONDS = 5.0  # Hoạt động cũ hơn mức này được coi như camera rảnh
+
+
+class CameraBudget:
+    def __init__(self, max_fps):
+        self.max_fps = max_fps
+        self.viewers = 0
+        self.tracked = 0
+        self.red_phase = False
+        self.pending_violations = 0
+        self.reported_at = 0.0
+        self.budget_fps = 0.0
+        self.tokens = 1.0
+        self.refilled_at = time.monotonic()
+        self.inferences = 0
+        self.skipped = 0
+
+    def activity_score(self, now):
+        if now - self.reported_at > ACTIVITY_DECAY_SECONDS:
+            return 0.0
+        return (TRACK_WEIGHT * self.tracked
+                + RED_PHASE_WEIGHT * (1 if self.red_phase else 0)
+                + PENDING_VIOLATION_WEIGHT * self.pending_violations)
+
+
+class InferenceBudgetScheduler:
+    """Chia ngân sách suy luận cố định giữa các camera theo mức độ hoạt động.
+
+    Mỗi camera luôn có một mức sàn; phần còn lại được chia theo số xe đang track,
+    pha đèn đỏ và số vi phạm đang chờ xử lý. Mỗi camera dùng một token bucket
+    được nạp theo ngân sách hiện tại của nó.
+    """
+
+    def __init__(self, total_fps=TOTAL_INFERENCE_FPS, floor_fps=MIN_CAMERA_FPS, max_fps=MAX_CAMERA_FPS):
+        self.total_fps = total_fps
+        self.floor_fps = floor_fps
+        self.max_fps = max_fps
+        self._cameras = {}
+        self._lock = threading.Lock()
+
+    def register(self, camera_id, max_fps=None):
+        with self._lock:
+            camera = self._cameras.get(camera_id)
+            if camera is None:
+                camera = CameraBudget(max_fps or self.max_fps)
+                self._cameras[camera_id] = camera
+            camera.viewers += 1
+            self._rebalance()
+
+    def unregister(self, camera_id):
+        with self._lock:
+            camera = self._cameras.get(camera_id)
+            if camera is None:
+                return
+            camera.viewers -= 1
+            if camera.viewers <= 0:
+                del self._cameras[camera_id]
+            self._rebalance()
+
+    def report_activity(self, camera_id, tracked=0, red_phase=False, pending_violations=0):
+        with self._lock:
+            camera = self._cameras.get(camera_id)
+            if camera is None:
+                return
+            camera.tracked = tracked
+            camera.red_phase = red_phase
+            camera.pending_violations = pending_violations
+            camera.reported_at = time.monotonic()
+            self._rebalance()
+
+    def acquire(self, camera_id):
+        """Trả về True nếu camera được phép chạy suy luận cho frame hiện tại."""
+        with self._lock:
+            camera = self._cameras.get(camera_id)
+            if camera is None:
+                return True
+            now = time.monotonic()
+            camera.tokens = min(1.0, camera.tokens + (now - camera.refilled_at) * camera.budget_fps)
+            camera.refilled_at = now
+            if camera.tokens >= 1.0:
+                camera.tokens -= 1.0
+                camera.inferences += 1
+                return True
+            camera.skipped += 1
+            return False
+
+    def budget(self, camera_id):
+        with self._lock:
+            camera = self._cameras.get(camera_id)
+            return camera.budget_fps if camera else self.max_fps
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                camera_id: {
+                    "budget_fps": round(camera.budget_fps, 2),
+                    "activity": round(camera.activity_score(now), 2),
+                    "tracked": camera.tracked,
+                    "red_phase": camera.red_phase,
+                    "pending_violations": camera.pending_violations,
+                    "viewers": camera.viewers,
+                    "inferences": camera.inferences,
+                    "skipped": camera.skipped,
+                }
+                for camera_id, camera in self._cameras.items()
+            }
+
+    def _rebalance(self):
+        if not self._cameras:
+            return
+        now = time.monotonic()
+        cameras = list(self._cameras.values())
+        floor = min(self.floor_fps, self.total_fps / len(cameras))
+        for camera in cameras:
+            camera.budget_fps = min(floor, camera.max_fps)
+
+        # Water-filling: chia phần dư theo trọng số, camera chạm trần trả lại phần thừa
+        remaining = self.total_fps - sum(camera.budget_fps for camera in cameras)
+        open_cameras = [camera for camera in cameras if camera.budget_fps < camera.max_fps]
+        while remaining > 1e-6 and open_cameras:
+            weights = [camera.activity_score(now) for camera in open_cameras]
+            total_weight = sum(weights)
+            if total_weight <= 0:
+                weights = [1.0] * len(open_cameras)
+                total_weight = float(len(open_cameras))
+            leftover = 0.0
+            for camera, weight in zip(open_cameras, weights):
+                share = remaining * weight / total_weight
+                headroom = camera.max_fps - camera.budget_fps
+                camera.budget_fps += min(share, headroom)
+                leftover += max(0.0, share - headroom)
+            remaining = leftover
+            open_cameras = [camera for camera in open_cameras if camera.budget_fps < camera.max_fps - 1e-6]
+
+
+inference_scheduler = InferenceBudgetScheduler()
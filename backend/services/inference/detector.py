@@ -0,0 +1,58 @@
+import threading
+from ultralytics import YOLO
+
+# Cache model theo đường dẫn weights để mọi stream dùng chung một bản trong bộ nhớ,
+# kèm một khóa cho mỗi model: mọi detector dùng chung model đó đều suy luận qua khóa này
+_model_cache = {}
+_model_lock = threading.Lock()
+
+
+def get_shared_model(model_path):
+    """Lấy (YOLO model, khóa suy luận) từ cache hoặc load mới nếu chưa có"""
+    with _model_lock:
+        if model_path not in _model_cache:
+            print(f"Loading YOLO model {model_path}...")
+            _model_cache[model_path] = (YOLO(model_path), threading.Lock())
+        return _model_cache[model_path]
+
+
+class SharedDetector:
+    """Detector không giữ trạng thái tracking, an toàn khi dùng chung giữa nhiều camera.
+
+    Ultralytics predictor không thread-safe nên mỗi lần suy luận giữ khóa của model
+    (chung cho mọi detector cùng weights); trạng thái tracking nằm ở StreamTracker
+    riêng của từng pipeline.
+    """
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.model, self._lock = get_shared_model(model_path)
+        self.names = self.model.names
+
+    def detect(self, frame, conf=0.25, iou=0.45, classes=None, **kwargs):
+        with self._lock:
+            return self.model.predict(frame, conf=conf, iou=iou, classes=classes, verbose=False, **kwargs)[0]
+
+    def detect_batch(self, frames, conf=0.25, iou=0.45, classes=None, **kwargs):
+        """Suy luận một lô ảnh trong một lần gọi model, trả về danh sách kết quả theo thứ tự"""
+        if not frames:
+            return []
+        with self._lock:
+            return self.model.predict(list(frames), conf=conf, iou=iou, classes=classes, verbose=False, **kwargs)
+
+    def __call__(self, frame, conf=0.25, iou=0.45, **kwargs):
+        return self.detect(frame, conf=conf, iou=iou, **kwargs)
+
+
+_detectors = {}
+
+
+def get_detector(model_path):
+    """SharedDetector dùng chung cho cả process theo đường dẫn weights"""
+    with _model_lock:
+        detector = _detectors.get(model_path)
+    if detector is None:
+        detector = SharedDetector(model_path)
+        with _model_lock:
+            detector = _detectors.setdefault(model_path, detector)
+    return detector
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+from services.inference.detector import get_detector
+from services.inference.budget_scheduler import inference_scheduler
+
+# Thang model từ nhẹ đến nặng; camera bắt đầu ở bậc cao nhất và hạ bậc khi không theo kịp
+VEHICLE_MODEL_LADDER = [p.strip() for p in os.getenv(
+    "VEHICLE_MODEL_LADDER", "yolov8n.pt,yolov8s.pt,yolov8m.pt").split(",") if p.strip()]
+
+LATENCY_EMA_ALPHA = 0.1
+STEP_DOWN_RATIO = 1.0  # Độ trễ trung bình vượt thời gian cho phép mỗi frame
+STEP_UP_RATIO = 0.5  # Còn dư ít nhất một nửa thời gian mới thử bậc nặng hơn
+STEP_DOWN_PATIENCE = 10  # Số frame liên tiếp quá chậm trước khi hạ bậc
+STEP_UP_PATIENCE = 90  # Số frame liên tiếp dư thời gian trước khi nâng bậc
+
+
+class TieredDetector:
+    """Detector chọn model theo tải cho một camera.
+
+    Mỗi frame được đo từ lúc detect() đến frame_done() (toàn bộ pipeline của frame đó).
+    Thời gian cho phép là 1 / ngân sách fps mà InferenceBudgetScheduler cấp cho camera;
+    nếu độ trễ trung bình vượt mức đó liên tục, camera chuyển xuống model nhẹ hơn, và
+    quay lại model nặng hơn khi có dư thời gian. Model của mỗi bậc dùng chung giữa các camera.
+    """
+
+    def __init__(self, camera_id, ladder=None, start_tier=None):
+        self.camera_id = camera_id
+        self.ladder = list(ladder or VEHICLE_MODEL_LADDER)
+        self.tier = len(self.ladder) - 1 if start_tier is None else start_tier
+        self.latency_ema = None
+        self._frame_started = None
+        self._slow_frames = 0
+        self._fast_frames = 0
+        self.step_downs = 0
+        self.step_ups = 0
+        model_tiers.register(camera_id, self)
+
+    @property
+    def detector(self):
+        return get_detector(self.ladder[self.tier])
+
+    @property
+    def model_path(self):
+        return self.ladder[self.tier]
+
+    @property
+    def names(self):
+        return self.detector.names
+
+    def class_ids(self, class_names):
+        """ID lớp ứng với các tên, dùng cho classes= để lọc ngay tại NMS"""
+        return [cls_id for cls_id, name in self.names.items() if name in class_names]
+
+    def detect(self, frame, conf=0.25, iou=0.45, classes=None, **kwargs):
+        self._frame_started = time.perf_counter()
+        return self.detector.detect(frame, conf=conf, iou=iou, classes=classes, **kwargs)
+
+    def frame_done(self):
+        """Gọi khi frame đã xử lý xong; cập nhật độ trễ và bậc model"""
+        if self._frame_started is None:
+            return
+        elapsed = time.perf_counter() - self._frame_started
+        self._frame_started = None
+        if self.latency_ema is None:
+            self.latency_ema = elapsed
+        else:
+            self.latency_ema += LATENCY_EMA_ALPHA * (elapsed - self.latency_ema)
+
+        budget_fps = inference_scheduler.budget(self.camera_id)
+        frame_time = 1.0 / budget_fps if budget_fps > 0 else float("inf")
+        if self.latency_ema > frame_time * STEP_DOWN_RATIO:
+            self._slow_frames += 1
+            self._fast_frames = 0
+        elif self.latency_ema < frame_time * STEP_UP_RATIO:
+            self._fast_frames += 1
+            self._slow_frames = 0
+        else:
+            self._slow_frames = self._fast_frames = 0
+
+        if self._slow_frames >= STEP_DOWN_PATIENCE and self.tier > 0:
+            self._switch(self.tier - 1)
+            self.step_downs += 1
+        elif self._fast_frames >= STEP_UP_PATIENCE and self.tier < len(self.ladder) - 1:
+            self._switch(self.tier + 1)
+            self.step_ups += 1
+
+    def close(self):
+        model_tiers.unregister(self.camera_id, self)
+
+    def stats(self):
+        budget_fps = inference_scheduler.budget(self.camera_id)
+        return {
+            "tier": self.tier,
+            "model": self.model_path,
+            "ladder": self.ladder,
+            "latency_ms": round(self.latency_ema * 1000, 1) if self.latency_ema is not None else None,
+            "frame_budget_ms": round(1000.0 / budget_fps, 1) if budget_fps > 0 else None,
+            "step_downs": self.step_downs,
+            "step_ups": self.step_ups,
+        }
+
+    def _switch(self, tier):
+        print(f"[INFO] Camera {self.camera_id}: model tier {self.ladder[self.tier]} -> {self.ladder[tier]} "
+              f"(latency {self.latency_ema * 1000:.0f} ms)")
+        self.tier = tier
+        self.latency_ema = None
+        self._slow_frames = self._fast_frames = 0
+
+
+class ModelTierRegistry:
+    """Bậc model hiện tại của từng camera, phục vụ metrics"""
+
+    def __init__(self):
+        self._detectors = {}
+        self._lock = threading.Lock()
+
+    def register(self, camera_id, detector):
+        with self._lock:
+            self._detectors[camera_id] = detector
+
+    def unregister(self, camera_id, detector):
+        with self._lock:
+            if self._detectors.get(camera_id) is detector:
+                del self._detectors[camera_id]
+
+    def snapshot(self):
+        with self._lock:
+            detectors = dict(self._detectors)
+        return {camera_id: detector.stats() for camera_id, detector in detectors.items()}
+
+
+model_tiers = ModelTierRegistry()
@@ -0,0 +1,134 @@
+import os
+import queue
+import threading
+from collections import Counter, defaultdict
+
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", "2"))
+OCR_MAX_PENDING = int(os.getenv("OCR_MAX_PENDING", "8"))  # Quá mức này yêu cầu OCR mới bị bỏ, không xếp hàng
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))  # Số crop tối đa nhận dạng trong một lần gọi engine
+
+PLATE_CONFIDENT_SCORE = 0.85  # Đạt ngưỡng này thì ngừng OCR cho track
+PLATE_MIN_READINGS = 2  # Cần ít nhất chừng này lần đọc trước khi tin kết quả
+PLATE_MAX_READINGS = 8  # Giới hạn số lần OCR cho một biển số trong suốt vòng đời track
+
+
+class PlateVote:
+    """Gộp nhiều lần đọc biển số của cùng một track bằng bỏ phiếu theo từng ký tự.
+
+    Độ dài được chọn theo tổng confidence; trong các lần đọc cùng độ dài, mỗi vị trí
+    chọn ký tự có tổng confidence lớn nhất. Confidence của kết quả là tỉ lệ đồng thuận
+    thấp nhất giữa các vị trí nhân với confidence OCR trung bình.
+    """
+
+    def __init__(self, confident_score=PLATE_CONFIDENT_SCORE, min_readings=PLATE_MIN_READINGS,
+                 max_readings=PLATE_MAX_READINGS):
+        self.confident_score = confident_score
+        self.min_readings = min_readings
+        self.max_readings = max_readings
+        self.readings = []
+        self.attempts = 0
+        self.text = "Unknown"
+        self.confidence = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        """Không cần OCR thêm: đã đủ tin cậy hoặc đã dùng hết số lần cho phép"""
+        return ((self.confidence >= self.confident_score and len(self.readings) >= self.min_readings)
+                or self.attempts >= self.max_readings)
+
+    def add(self, text, confidence):
+        with self._lock:
+            self.attempts += 1
+            if text and text != "Unknown":
+                self.readings.append((text, float(confidence)))
+                self.text, self.confidence = self._vote()
+
+    def _vote(self):
+        length_weights = defaultdict(float)
+        for text, conf in self.readings:
+            length_weights[len(text)] += conf
+        length = max(length_weights, key=length_weights.get)
+        same_length = [(text, conf) for text, conf in self.readings if len(text) == length]
+
+        chars, shares = [], []
+        for pos in range(length):
+            weights = Counter()
+            for text, conf in same_length:
+                weights[text[pos]] += conf
+            char, weight = weights.most_common(1)[0]
+            chars.append(char)
+            shares.append(weight / sum(weights.values()))
+        mean_conf = sum(conf for _, conf in same_length) / len(same_length)
+        return "".join(chars), min(shares) * mean_conf
+
+
+class OCRWorkerPool:
+    """Pool OCR có giới hạn, chạy ngoài vòng lặp frame.
+
+    submit() không bao giờ chặn: nếu khóa đang được OCR hoặc hàng đợi đầy thì yêu cầu
+    bị bỏ và sẽ được thử lại ở frame sau. Mỗi worker lấy tối đa batch_size crop đang chờ
+    và nhận dạng chúng trong một lần gọi recognize_batch(crops) -> [(text, confidence)];
+    kết quả được gộp vào PlateVote của khóa tương ứng trên luồng worker.
+    """
+
+    def __init__(self, recognize_batch, max_workers=OCR_MAX_WORKERS, max_pending=OCR_MAX_PENDING,
+                 batch_size=OCR_BATCH_SIZE, name="ocr"):
+        self.recognize_batch = recognize_batch
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, daemon=True, name=f"{name}-{i}")
+                         for i in range(max_workers)]
+        for worker in self._workers:
+            worker.start()
+        self.submitted = 0
+        self.dropped = 0
+
+    def submit(self, key, crop, vote):
+        """Gửi crop đi OCR, trả về False nếu bị bỏ qua"""
+        if vote.done:
+            return False
+        with self._lock:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.add(key)
+            self.submitted += 1
+        self._queue.put((key, crop, vote))
+        return True
+
+    def is_pending(self, key):
+        with self._lock:
+            return key in self._pending
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            jobs = [job]
+            while len(jobs) < self.batch_size:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)
+                    break
+                jobs.append(job)
+            try:
+                results = self.recognize_batch([crop for _, crop, _ in jobs])
+            except Exception as e:
+                print(f"[-] OCR worker error for {len(jobs)} crops: {e}")
+                results = [("Unknown", 0.0)] * len(jobs)
+            for (key, _, vote), (text, confidence) in zip(jobs, results):
+                vote.add(text, confidence)
+                with self._lock:
+                    self._pending.discard(key)
+
+    def shutdown(self):
+        for _ in self._workers:
+            self._queue.put(None)
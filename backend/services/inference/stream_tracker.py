@@ -0,0 +1,28 @@
+import torch
+from ultralytics.trackers.byte_tracker import BYTETracker
+from ultralytics.utils import IterableSimpleNamespace, yaml_load
+from ultralytics.utils.checks import check_yaml
+
+
+class StreamTracker:
+    """ByteTrack riêng cho một pipeline camera.
+
+    Thay cho model.track(persist=True): trạng thái track nằm ở đây thay vì trên
+    model dùng chung, nên hai camera (hoặc hai người xem) không làm lẫn track ID.
+    """
+
+    def __init__(self, tracker_config="bytetrack.yaml", frame_rate=30):
+        cfg = IterableSimpleNamespace(**yaml_load(check_yaml(tracker_config)))
+        self.tracker = BYTETracker(args=cfg, frame_rate=frame_rate)
+
+    def update(self, results):
+        """Gán track ID cho kết quả detect, trả về Results giống model.track()"""
+        # Frame không có detection vẫn phải qua tracker để track bị mất được tính tuổi và loại bỏ
+        det = results.boxes.cpu().numpy()
+        tracks = self.tracker.update(det, results.orig_img)
+        if len(det) == 0 or len(tracks) == 0:
+            return results
+        idx = tracks[:, -1].astype(int)
+        results = results[idx]
+        results.update(boxes=torch.as_tensor(tracks[:, :-1]))
+        return results
@@ -1,64 +1,173 @@
+import os
+import time
+import socket
+import zipfile
+import ipaddress
+from urllib.parse import urljoin, urlparse
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
-from ultralytics import YOLO
-import easyocr
-
-# Initialize YOLOv8 model and EasyOCR reader
-model = YOLO('backend/best90.pt')
-reader = easyocr.Reader(['en'], gpu=True)
-
-def preprocess_plate_image(plate_img):
-    # Convert to grayscale
-    gray = cv2.cvtColor(plate_img, cv2.COLOR_BGR2GRAY)
-    
-    # Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    
-    # Adaptive thresholding to binarize image
-    thresh = cv2.adaptiveThreshold(
-        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY_INV, 11, 2
-    )
-    
-    # Contrast Limited Adaptive Histogram Equalization (CLAHE)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    enhanced = clahe.apply(gray)
-    
-    # Combine thresholded and enhanced images
-    processed = cv2.bitwise_and(enhanced, enhanced, mask=thresh)
-    
-    return processed
+import requests
+from services.plate_recognition import (
+    recognize_plates,
+    get_plate_detector,
+    plate_recognizer,
+    format_plate,
+    is_valid_plate,
+)
+from services.inference.ocr_pool import OCR_MAX_WORKERS, OCR_BATCH_SIZE
 
+PLATE_BATCH_IMAGES = int(os.getenv("PLATE_BATCH_IMAGES", "16"))  # Số ảnh phát hiện biển số trong một lần gọi model
+PLATE_DOWNLOAD_WORKERS = int(os.getenv("PLATE_DOWNLOAD_WORKERS", "8"))
+PLATE_DOWNLOAD_TIMEOUT = 10
+PLATE_DOWNLOAD_MAX_BYTES = int(os.getenv("PLATE_DOWNLOAD_MAX_BYTES", str(10 * 1024 * 1024)))  # Ảnh lớn hơn bị từ chối
+PLATE_DOWNLOAD_MAX_REDIRECTS = 3
+PLATE_DOWNLOAD_CHUNK = 64 * 1024
+ALLOWED_URL_SCHEMES = ("http", "https")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+# Phát hiện (best90.pt) và OCR dùng chung engine với các dịch vụ vi phạm qua plate_recognition
 def get_license_plate_text(image_path):
     img = cv2.imread(image_path)
     if img is None:
         return []
 
-    # YOLOv8 detection
-    results = model(img)
-    texts = []
-
-    for result in results:
-        for box in result.boxes:
-            if box.conf[0] > 0.6:  # Increased confidence threshold
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                plate_img = img[y1:y2, x1:x2]
-                
-                # Preprocess the license plate image
-                processed_img = preprocess_plate_image(plate_img)
-                
-                # Run EasyOCR with adjusted parameters
-                ocr_results = reader.readtext(
-                    processed_img,
-                    detail=0,
-                    paragraph=False,
-                    contrast_ths=0.1,  # Lower contrast threshold
-                    adjust_contrast=0.5,  # Adjust contrast
-                    text_threshold=0.7  # Higher text confidence
-                )
-                text = ' '.join(ocr_results).strip()
-                if text:
-                    texts.append(text)
-
-    return texts
+    # Giữ ngưỡng phát hiện 0.6 như trước, trả về biển số đã chuẩn hóa theo định dạng VN
+    return [plate["text"] for plate in recognize_plates(img, conf=0.6) if plate["text"] != "Unknown"]
+
+
+def is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_zip_images(fileobj, archive_name="archive.zip"):
+    """Liệt kê ảnh trong file zip, mỗi ảnh là (tên, hàm đọc bytes); chỉ đọc khi cần"""
+    archive = zipfile.ZipFile(fileobj)
+    for info in archive.infolist():
+        if info.is_dir() or not is_image_name(info.filename):
+            continue
+        yield f"{archive_name}/{info.filename}", (lambda name=info.filename: archive.read(name))
+
+
+def check_public_url(url):
+    """Chỉ cho phép http/https tới địa chỉ công khai: chặn loopback, mạng nội bộ, link-local, địa chỉ dành riêng"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ALLOWED_URL_SCHEMES or not parsed.hostname:
+        raise ValueError("Only http and https URLs are allowed")
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)}
+    except socket.gaierror as e:
+        raise ValueError(f"Cannot resolve host {parsed.hostname}: {e}")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise ValueError(f"Host {parsed.hostname} resolves to a non-public address")
+
+
+def download_image(url, max_bytes=PLATE_DOWNLOAD_MAX_BYTES):
+    """Tải ảnh theo từng khối, dừng ngay khi vượt max_bytes; mỗi lần chuyển hướng đều được kiểm tra lại"""
+    for _ in range(PLATE_DOWNLOAD_MAX_REDIRECTS + 1):
+        check_public_url(url)
+        with requests.get(url, timeout=PLATE_DOWNLOAD_TIMEOUT, stream=True, allow_redirects=False) as response:
+            if response.is_redirect:
+                url = urljoin(url, response.headers["Location"])
+                continue
+            response.raise_for_status()
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > max_bytes:
+                raise ValueError(f"Image larger than {max_bytes} bytes")
+            data = bytearray()
+            for block in response.iter_content(PLATE_DOWNLOAD_CHUNK):
+                data += block
+                if len(data) > max_bytes:
+                    raise ValueError(f"Image larger than {max_bytes} bytes")
+            return bytes(data)
+    raise ValueError("Too many redirects")
+
+
+def url_source(url):
+    return url, lambda: download_image(url)
+
+
+def _load_image(source):
+    name, load = source
+    try:
+        image = cv2.imdecode(np.frombuffer(load(), np.uint8), cv2.IMREAD_COLOR)
+    except Exception as e:
+        return name, None, str(e)
+    if image is None:
+        return name, None, "Cannot decode image"
+    return name, image, None
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def recognize_plates_stream(sources, conf=0.6):
+    """Đọc biển số cho nhiều ảnh, trả kết quả từng ảnh ngay khi xong một lô.
+
+    sources là dãy (tên, hàm đọc bytes). Mỗi lô PLATE_BATCH_IMAGES ảnh được tải/giải mã
+    song song, phát hiện biển số trong một lần gọi model, rồi mọi crop của lô được chia
+    thành nhóm OCR_BATCH_SIZE. Engine OCR được khóa trong PlateRecognizer nên các nhóm
+    được nhận dạng lần lượt; các worker chỉ chồng phần chuẩn bị crop và chuẩn hóa kết quả
+    lên lần gọi engine của nhóm khác. Dòng cuối cùng là tổng kết.
+    """
+    started = time.perf_counter()
+    detector = get_plate_detector()
+    total_images = total_plates = failed = 0
+    with ThreadPoolExecutor(max_workers=PLATE_DOWNLOAD_WORKERS) as loader, \
+            ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS) as ocr:
+        for chunk in _chunks(sources, PLATE_BATCH_IMAGES):
+            loaded = list(loader.map(_load_image, chunk))
+            images = [image for _, image, _ in loaded if image is not None]
+            detections = iter(detector.detect_batch(images, conf=conf))
+
+            crops, owners, entries = [], [], []
+            for name, image, error in loaded:
+                entry = {"source": name, "plates": []}
+                entries.append(entry)
+                if image is None:
+                    entry["error"] = error
+                    continue
+                results = next(detections)
+                if results.boxes is None or len(results.boxes) == 0:
+                    continue
+                bboxes = results.boxes.xyxy.cpu().numpy().astype(int)
+                scores = results.boxes.conf.cpu().numpy()
+                for (x1, y1, x2, y2), score in zip(bboxes, scores):
+                    crops.append(image[max(0, y1):y2, max(0, x1):x2])
+                    owners.append((entry, [int(x1), int(y1), int(x2), int(y2)], float(score)))
+
+            groups = [crops[i:i + OCR_BATCH_SIZE] for i in range(0, len(crops), OCR_BATCH_SIZE)]
+            readings = [reading for group in ocr.map(plate_recognizer.recognize_batch, groups) for reading in group]
+            for (entry, bbox, score), (text, confidence) in zip(owners, readings):
+                entry["plates"].append({
+                    "text": text,
+                    "display": format_plate(text),
+                    "confidence": round(confidence, 4),
+                    "valid": is_valid_plate(text),
+                    "bbox": bbox,
+                    "detectionConfidence": round(score, 4),
+                })
+
+            total_images += len(entries)
+            total_plates += len(owners)
+            failed += len(loaded) - len(images)
+            yield from entries
 
+    yield {
+        "done": True,
+        "images": total_images,
+        "failed": failed,
+        "plates": total_plates,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
@@ -6,7 +6,7 @@ import time
 import traceback
 from datetime import datetime
 from collections import deque
-from ultralytics import YOLO
+from scipy.optimize import linear_sum_assignment
 import aiohttp
 import asyncio
 import requests
@@ -14,7 +14,11 @@ from concurrent.futures import ThreadPoolExecutor
 import atexit
 import tempfile
 from utils.yt_stream import get_stream_url
-from paddleocr import PaddleOCR
+from services.inference.budget_scheduler import inference_scheduler
+from services.inference.detector import SharedDetector
+from services.inference.stream_tracker import StreamTracker
+from services.plate_recognition import PlateVote, get_plate_detector, submit_plate_crop, shutdown_plate_ocr_pool
+from services.plate_sightings import plate_sightings, plate_snapshot_box
 
 # Constants
 VIOLATIONS_DIR = "violations"
@@ -25,14 +29,13 @@ MIN_HEAD_SIZE = 20  # Kích thước tối thiểu vùng đầu (pixel)
 RECONNECT_ATTEMPTS = 3
 RECONNECT_DELAY = 1
 VIOLATION_API_URL = "http://localhost:8081/api/violations"
-VIOLATION_DELAY_FRAMES = int(0.7 * FRAME_RATE)  # Số frame tương ứng 0.7 giây (21 frames tại 30 FPS)
+VIOLATION_DELAY_SECONDS = 0.7  # Chờ sau khi phát hiện rồi mới ghi vi phạm (tính theo giây thực, không theo số frame)
+PLATE_MIN_OVERLAP = 0.3  # Tỉ lệ diện tích biển số nằm trong vùng xe tối thiểu để ghép với người lái
+PLATE_CACHE_TTL = 10.0  # Biển số của track không còn thấy quá 10 giây sẽ bị xóa
 
-# Load the YOLO models
-helmet_model = YOLO("besthl.pt")  # Model phát hiện mũ bảo hiểm
-plate_model = YOLO("best90.pt")   # Model phát hiện biển số
-
-# Initialize PaddleOCR reader
-ocr_reader = PaddleOCR(use_angle_cls=True, lang='en')
+# Load the YOLO models (dùng chung, không giữ trạng thái tracking)
+helmet_model = SharedDetector("besthl.pt")  # Model phát hiện mũ bảo hiểm
+plate_model = get_plate_detector()  # Model phát hiện biển số, OCR qua plate_recognition dùng chung
 
 # Define class names mapping for helmet model (removed LP class completely)
 helmet_class_names = {
@@ -44,109 +47,29 @@ helmet_class_names = {
 # Thread pool for async violation sending
 violation_executor = ThreadPoolExecutor(max_workers=5)
 
-def extract_license_plate_text(image, bbox):
+def assign_plates_to_riders(plate_boxes, rider_boxes, min_overlap=PLATE_MIN_OVERLAP):
     """
-    Trích xuất text từ vùng biển số bằng PaddleOCR
-    Xử lý biển số 2 dòng bằng cách ghép lại
+    Ghép một-một biển số với người lái (track ID) theo độ chồng lấn.
+    Vùng xe của người lái là box người lái nới rộng xuống dưới (biển số nằm ở thân/đuôi xe);
+    điểm ghép là phần diện tích biển số nằm trong vùng đó.
+    Trả về {track_id: index biển số}
     """
-    try:
-        x1, y1, x2, y2 = map(int, bbox)
-        # Crop vùng biển số
-        plate_crop = image[y1:y2, x1:x2]
-        
-        if plate_crop.size == 0:
-            return "Unknown"
-            
-        # Resize để OCR dễ đọc hơn
-        height, width = plate_crop.shape[:2]
-        if height < 64:  # Tăng kích thước tối thiểu cho PaddleOCR
-            scale = 64 / height
-            new_width = int(width * scale)
-            new_height = int(height * scale)
-            plate_crop = cv2.resize(plate_crop, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
-        
-        # Áp dụng preprocessing để cải thiện OCR
-        if len(plate_crop.shape) == 3:
-            gray = cv2.cvtColor(plate_crop, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = plate_crop
-        
-        # Tăng độ tương phản
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-        enhanced = clahe.apply(gray)
-        
-        # Gaussian blur nhẹ để giảm noise
-        blurred = cv2.GaussianBlur(enhanced, (3, 3), 0)
-        
-        # Thử với ảnh gốc và ảnh đã xử lý
-        for img_to_process in [plate_crop, blurred]:
-            try:
-                # PaddleOCR
-                results = ocr_reader.ocr(img_to_process, cls=True)
-                
-                if results and results[0]:
-                    # Tách các dòng text và sắp xếp theo tọa độ y
-                    text_lines = []
-                    for line in results[0]:
-                        if len(line) >= 2 and line[1][1] > 0.6:  # Confidence threshold
-                            bbox_coords = line[0]
-                            text = line[1][0]
-                            # Tính tọa độ y trung bình của text
-                            avg_y = sum([point[1] for point in bbox_coords]) / len(bbox_coords)
-                            text_lines.append((avg_y, text.strip()))
-                    
-                    if text_lines:
-                        # Sắp xếp theo tọa độ y (từ trên xuống dưới)
-                        text_lines.sort(key=lambda x: x[0])
-                        
-                        # Ghép các dòng lại với nhau
-                        if len(text_lines) == 1:
-                            # Biển số 1 dòng
-                            final_text = text_lines[0][1]
-                        else:
-                            # Biển số nhiều dòng - ghép lại
-                            final_text = ''.join([line[1] for line in text_lines])
-                        
-                        # Làm sạch text: chỉ giữ chữ cái, số và dấu gạch ngang
-                        cleaned_text = ''.join(c for c in final_text if c.isalnum() or c == '-')
-                        
-                        if len(cleaned_text) >= 4:  # Biển số tối thiểu 4 ký tự
-                            print(f"[+] OCR Success: Raw='{final_text}' -> Cleaned='{cleaned_text}'")
-                            return cleaned_text
-                            
-            except Exception as ocr_error:
-                print(f"[-] PaddleOCR processing error: {str(ocr_error)}")
-                continue
-        
-        return "Unknown"
-        
-    except Exception as e:
-        print(f"[-] OCR Error: {str(e)}")
-        return "Unknown"
-
-def find_closest_license_plate(rider_center, cached_plates, max_distance=200):
-    """
-    Tìm biển số gần nhất với người lái xe từ cache
-    """
-    if not cached_plates:
-        return "Unknown", None
-    
-    min_distance = float('inf')
-    closest_plate = "Unknown"
-    closest_plate_bbox = None
-    
-    rider_x, rider_y = rider_center
-    
-    for plate_info in cached_plates.values():
-        plate_x, plate_y = plate_info['center']
-        distance = np.sqrt((rider_x - plate_x)**2 + (rider_y - plate_y)**2)
-        
-        if distance < min_distance and distance < max_distance:
-            min_distance = distance
-            closest_plate = plate_info['text']
-            closest_plate_bbox = plate_info['bbox']
-    
-    return closest_plate, closest_plate_bbox
+    if not plate_boxes or not rider_boxes:
+        return {}
+    plates = np.asarray(plate_boxes, dtype=np.float32)[:, :4]
+    riders = np.asarray([box[:4] for box in rider_boxes], dtype=np.float32)
+    widths = riders[:, 2] - riders[:, 0]
+    heights = riders[:, 3] - riders[:, 1]
+    regions = np.stack([riders[:, 0] - 0.25 * widths, riders[:, 1],
+                        riders[:, 2] + 0.25 * widths, riders[:, 3] + heights], axis=1)
+
+    ix = np.clip(np.minimum(plates[:, None, 2], regions[None, :, 2]) - np.maximum(plates[:, None, 0], regions[None, :, 0]), 0, None)
+    iy = np.clip(np.minimum(plates[:, None, 3], regions[None, :, 3]) - np.maximum(plates[:, None, 1], regions[None, :, 1]), 0, None)
+    plate_areas = np.maximum((plates[:, 2] - plates[:, 0]) * (plates[:, 3] - plates[:, 1]), 1.0)
+    overlap = ix * iy / plate_areas[:, None]
+
+    plate_idx, rider_idx = linear_sum_assignment(-overlap)
+    return {rider_boxes[r][4]: int(p) for p, r in zip(plate_idx, rider_idx) if overlap[p, r] >= min_overlap}
 
 async def fetch_camera_config(cid: int, retries=3, delay=1):
     """
@@ -257,10 +180,11 @@ async def stream_no_helmet_service(youtube_url: str, camera_id: int):
     frame_buffer = deque(maxlen=int(fps))  # Buffer 1 giây frames
     recording_tasks = {}
     reconnect_attempts = 0
+    tracker = StreamTracker("bytetrack.yaml")  # Tracker riêng cho stream này
     
-    # Cache để lưu trữ biển số đã OCR
-    license_plate_cache = {}  # {plate_id: {'text': str, 'center': tuple, 'bbox': tuple, 'last_seen': timestamp, 'confidence': float}}
-    plate_ocr_interval = 30  # OCR biển số mỗi 30 frames (1 giây với 30fps)
+    # Biển số theo track ID người lái: mỗi biển số vật lý chỉ OCR tối đa PlateVote.max_readings lần
+    rider_plates = {}  # {track_id: {'bbox': tuple, 'confidence': float, 'last_seen': timestamp, 'vote': PlateVote}}
+    plate_ocr_interval = 5 / FRAME_RATE  # Giây giữa hai lần OCR một biển số để các lần đọc độc lập hơn
     frame_count = 0
 
     # Cooldown để tránh gửi quá nhiều vi phạm cho cùng 1 track_id
@@ -268,8 +192,9 @@ async def stream_no_helmet_service(youtube_url: str, camera_id: int):
     VIOLATION_COOLDOWN_TIME = 10  # 10 giây
 
     # Dictionary để lưu trữ các vi phạm đang chờ xử lý
-    pending_violations = {}  # {track_id: {'detected_frame': int, 'license_plate': str, 'rider_center': tuple, 'rider_bbox': tuple, 'plate_bbox': tuple, 'class_name': str}}
+    pending_violations = {}  # {track_id: {'detected_at': float, 'license_plate': str, 'rider_center': tuple, 'rider_bbox': tuple, 'plate_bbox': tuple, 'class_name': str}}
 
+    inference_scheduler.register(camera_id)
     try:
         while True:
             ret, frame = cap.read()
@@ -300,93 +225,38 @@ async def stream_no_helmet_service(youtube_url: str, camera_id: int):
             # Add frame to buffer
             frame_buffer.append(frame_for_buffer.copy())
 
-            # Detect license plates - chỉ detect mỗi frame, OCR theo interval
-            current_plates = {}
+            # Bỏ qua suy luận khi camera đã dùng hết ngân sách, nhưng vẫn gửi frame cho người xem
+            if not inference_scheduler.acquire(camera_id):
+                yield frame_annotated
+                continue
+
+            # Detect license plates - ghép với người lái sau khi tracking, OCR theo track
+            plate_detections = []  # [(x1, y1, x2, y2, confidence)]
             try:
                 plate_results = plate_model(frame, conf=0.3, iou=0.4)
-                if plate_results and len(plate_results) > 0 and plate_results[0].boxes is not None:
-                    for idx, box in enumerate(plate_results[0].boxes):
+                if plate_results.boxes is not None:
+                    for box in plate_results.boxes:
                         x1, y1, x2, y2 = map(int, box.xyxy[0])
-                        confidence = float(box.conf[0])
-                        
-                        # Tạo ID cho plate dựa trên vị trí (để track qua các frame)
-                        center_x = (x1 + x2) // 2
-                        center_y = (y1 + y2) // 2
-                        plate_id = f"plate_{center_x//50}_{center_y//50}"  # Gom nhóm theo vùng 50x50 pixel
-                        
-                        current_plates[plate_id] = {
-                            'bbox': (x1, y1, x2, y2),
-                            'center': (center_x, center_y),
-                            'confidence': confidence,
-                            'detected_this_frame': True
-                        }
-                        
-                        # Kiểm tra xem có cần OCR không
-                        need_ocr = False
-                        if plate_id not in license_plate_cache:
-                            need_ocr = True
-                        elif frame_count % plate_ocr_interval == 0:
-                            # Chỉ OCR lại nếu confidence cao hơn hoặc đã lâu không OCR
-                            if (confidence > license_plate_cache[plate_id].get('confidence', 0) or 
-                                time.time() - license_plate_cache[plate_id].get('last_ocr', 0) > 5.0):
-                                need_ocr = True
-                        
-                        if need_ocr:
-                            print(f"[+] Performing OCR for {plate_id} (confidence: {confidence:.2f})")
-                            plate_text = extract_license_plate_text(frame, (x1, y1, x2, y2))
-                            
-                            license_plate_cache[plate_id] = {
-                                'text': plate_text,
-                                'center': (center_x, center_y),
-                                'bbox': (x1, y1, x2, y2),
-                                'confidence': confidence,
-                                'last_seen': time.time(),
-                                'last_ocr': time.time()
-                            }
-                            print(f"[+] OCR Result for {plate_id}: {plate_text}")
-                        else:
-                            # Cập nhật thông tin vị trí và thời gian nhìn thấy
-                            if plate_id in license_plate_cache:
-                                license_plate_cache[plate_id]['center'] = (center_x, center_y)
-                                license_plate_cache[plate_id]['bbox'] = (x1, y1, x2, y2)
-                                license_plate_cache[plate_id]['last_seen'] = time.time()
-                                if confidence > license_plate_cache[plate_id]['confidence']:
-                                    license_plate_cache[plate_id]['confidence'] = confidence
-                        
-                        # Vẽ biển số trên frame
-                        plate_text = license_plate_cache.get(plate_id, {}).get('text', 'Detecting...')
+                        plate_detections.append((x1, y1, x2, y2, float(box.conf[0])))
                         cv2.rectangle(frame_annotated, (x1, y1), (x2, y2), (255, 255, 0), 2)  # Cyan for plate
-                        cv2.putText(frame_annotated, f"LP: {plate_text}", (x1, y1 - 10),
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
-                        
             except Exception as e:
                 print(f"[-] License plate detection error: {str(e)}")
 
-            # Dọn dẹp cache - xóa những biển số không nhìn thấy trong 10 giây
+            # Dọn dẹp cache - xóa biển số của những track không nhìn thấy trong PLATE_CACHE_TTL giây
             current_time = time.time()
-            plates_to_remove = []
-            for plate_id, plate_info in license_plate_cache.items():
-                if current_time - plate_info['last_seen'] > 10.0:
-                    plates_to_remove.append(plate_id)
-            
-            for plate_id in plates_to_remove:
-                print(f"[+] Removing expired plate from cache: {plate_id}")
-                del license_plate_cache[plate_id]
+            for track_id in [tid for tid, info in rider_plates.items() if current_time - info['last_seen'] > PLATE_CACHE_TTL]:
+                del rider_plates[track_id]
 
             # YOLO helmet tracking
             try:
-                helmet_results = helmet_model.track(source=frame, persist=True, conf=0.4, iou=0.4, tracker="bytetrack.yaml")[0]
+                helmet_results = tracker.update(helmet_model.detect(frame, conf=0.4, iou=0.4))
             except Exception as e:
                 print(f"[-] YOLO helmet tracking error: {str(e)}")
-                ret, jpeg = cv2.imencode(".jpg", frame_annotated, [cv2.IMWRITE_JPEG_QUALITY, 80])
-                if ret and jpeg is not None:
-                    yield (b"--frame\r\n" + b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n")
+                yield frame_annotated
                 continue
 
             if helmet_results.boxes is None or helmet_results.boxes.id is None:
-                ret, jpeg = cv2.imencode(".jpg", frame_annotated, [cv2.IMWRITE_JPEG_QUALITY, 80])
-                if ret and jpeg is not None:
-                    yield (b"--frame\r\n" + b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n")
+                yield frame_annotated
                 continue
 
             active_track_ids = set()
@@ -409,11 +279,33 @@ async def stream_no_helmet_service(youtube_url: str, camera_id: int):
                     active_track_ids.add(track_id)
                     rider_boxes.append((x1, y1, x2, y2, track_id, class_name))
 
+            # Ghép biển số với track người lái và OCR bất đồng bộ cho tới khi bỏ phiếu đủ tin cậy
+            riders_by_track = {rider[4]: rider for rider in rider_boxes}
+            for track_id, plate_idx in assign_plates_to_riders(plate_detections, rider_boxes).items():
+                px1, py1, px2, py2, confidence = plate_detections[plate_idx]
+                plate_info = rider_plates.get(track_id)
+                if plate_info is None:
+                    plate_info = rider_plates[track_id] = {'confidence': confidence, 'vote': PlateVote()}
+                plate_info['bbox'] = (px1, py1, px2, py2)
+                plate_info['last_seen'] = current_time
+                plate_info['confidence'] = max(plate_info['confidence'], confidence)
+                vote = plate_info['vote']
+                if not vote.done and (vote.attempts == 0 or current_time - plate_info.get('last_ocr', 0) >= plate_ocr_interval):
+                    plate_info['last_ocr'] = current_time
+                    submit_plate_crop((camera_id, track_id), frame, (px1, py1, px2, py2), vote)
+                if vote.readings:
+                    # Công bố vào chỉ mục biển số liên camera để tra cứu theo văn bản
+                    plate_sightings.publish(vote.text, camera_id, track_id, vote.confidence, frame,
+                                            plate_snapshot_box((px1, py1, px2, py2), riders_by_track.get(track_id)),
+                                            source="helmet")
+                plate_text = vote.text if vote.readings or vote.done else 'Detecting...'
+                cv2.putText(frame_annotated, f"LP: {plate_text}", (px1, py1 - 10),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
+
             # Process pending violations
             violations_to_process = []
             for track_id, violation_info in list(pending_violations.items()):
-                frames_elapsed = frame_count - violation_info['detected_frame']
-                if frames_elapsed >= VIOLATION_DELAY_FRAMES:
+                if current_time - violation_info['detected_at'] >= VIOLATION_DELAY_SECONDS:
                     violations_to_process.append((track_id, violation_info))
                     del pending_violations[track_id]
 
@@ -501,8 +393,10 @@ async def stream_no_helmet_service(youtube_url: str, camera_id: int):
                                     no_helmet = True
                                 break
 
-                # Find closest license plate for this rider from cache
-                license_plate_text, plate_bbox = find_closest_license_plate((rider_center_x, rider_center_y), license_plate_cache)
+                # Biển số của người lái theo track ID (O(1))
+                rider_plate = rider_plates.get(track_id)
+                license_plate_text = rider_plate['vote'].text if rider_plate else "Unknown"
+                plate_bbox = rider_plate['bbox'] if rider_plate else None
 
                 # Check for NO HELMET violation
                 if no_helmet:
@@ -522,7 +416,7 @@ async def stream_no_helmet_service(youtube_url: str, camera_id: int):
                         
                         # Store violation in pending list with bounding box info
                         pending_violations[track_id] = {
-                            'detected_frame': frame_count,
+                            'detected_at': current_time,
                             'license_plate': license_plate_text,
                             'rider_center': (rider_center_x, rider_center_y),
                             'rider_bbox': (x1, y1, x2, y2),
@@ -563,21 +457,21 @@ async def stream_no_helmet_service(youtube_url: str, camera_id: int):
                 if track_id not in active_track_ids:
                     del pending_violations[track_id]
 
+            inference_scheduler.report_activity(camera_id, tracked=len(active_track_ids),
+                                                pending_violations=len(pending_violations))
+
             # Hiển thị thông tin cache trên frame
-            cache_info = f"Cached Plates: {len(license_plate_cache)} | Frame: {frame_count} | Active: {len(active_track_ids)}"
+            cache_info = f"Cached Plates: {len(rider_plates)} | Frame: {frame_count} | Active: {len(active_track_ids)}"
             cv2.putText(frame_annotated, cache_info, (10, 30),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
 
-            ret, jpeg = cv2.imencode(".jpg", frame_annotated, [cv2.IMWRITE_JPEG_QUALITY, 80])
-            if ret and jpeg is not None:
-                yield (b"--frame\r\n" + b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n")
-            else:
-                print(f"[-] Failed to encode frame to JPEG")
+            yield frame_annotated
 
     except Exception as e:
         print(f"[-] Error in stream_no_helmet_service: {str(e)}")
         traceback.print_exc()
     finally:
+        inference_scheduler.unregister(camera_id)
         cap.release()
         for task in recording_tasks.values():
             if "writer" in task and task["writer"]:
@@ -591,6 +485,7 @@ def cleanup_on_exit():
     print("🛑 Shutting down violation executor...")
     violation_executor.shutdown(wait=True)
     print("✅ Violation executor shutdown complete")
+    shutdown_plate_ocr_pool()
 
 # Đăng ký hàm cleanup
 atexit.register(cleanup_on_exit)
\ No newline at end of file
@@ -0,0 +1,221 @@
+import os
+import re
+import threading
+import cv2
+from services.inference.ocr_pool import OCRWorkerPool, PlateVote
+
+# Một engine OCR duy nhất cho mọi dịch vụ: "paddle" (mặc định, đọc tốt biển 2 dòng) hoặc "easyocr"
+PLATE_OCR_ENGINE = os.getenv("PLATE_OCR_ENGINE", "paddle").lower()
+PLATE_DETECTOR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "best90.pt")
+
+MIN_PLATE_HEIGHT = 64  # Crop thấp hơn được phóng to trước khi OCR
+MIN_LINE_CONFIDENCE = 0.6
+MIN_PLATE_CHARS = 4
+INVALID_FORMAT_PENALTY = 0.5  # Chuỗi không đúng định dạng biển số VN vẫn được giữ nhưng ít trọng số khi bỏ phiếu
+
+# Biển số Việt Nam: 2 số mã tỉnh + sê-ri (1-2 chữ, hoặc chữ + số với xe máy) + 4-5 số
+VN_PLATE_PATTERN = re.compile(r"^\d{2}(?:[A-Z]{1,2}|[A-Z]\d)\d{4,5}$")
+TO_DIGIT = {"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "Z": "2", "A": "4", "S": "5", "G": "6", "B": "8"}
+TO_LETTER = {"0": "D", "2": "Z", "4": "A", "5": "S", "6": "G", "8": "B"}
+
+
+def clean_plate_text(text):
+    """Chỉ giữ chữ và số, viết hoa (bỏ '-', '.', khoảng trắng)"""
+    return "".join(c for c in text if c.isalnum()).upper()
+
+
+def normalize_plate(text):
+    """Chuẩn hóa theo định dạng biển số VN, sửa các nhầm lẫn chữ/số thường gặp theo vị trí"""
+    text = clean_plate_text(text)
+    if len(text) < 7:
+        return text
+    chars = list(text)
+    for i in (0, 1):
+        chars[i] = TO_DIGIT.get(chars[i], chars[i])
+    chars[2] = TO_LETTER.get(chars[2], chars[2])
+    # Ký tự thứ 4 có thể là chữ (sê-ri 2 chữ) hoặc số (xe máy); phần còn lại luôn là số
+    for i in range(4, len(chars)):
+        chars[i] = TO_DIGIT.get(chars[i], chars[i])
+    return "".join(chars)
+
+
+def is_valid_plate(text):
+    return bool(VN_PLATE_PATTERN.match(text))
+
+
+def format_plate(text):
+    """Dạng hiển thị: 51F12345 -> 51F-123.45, 29A112345 -> 29A1-123.45"""
+    if not is_valid_plate(text):
+        return text
+    # Sê-ri 2 chữ, hoặc chữ + số khi còn 5 số phía sau (xe máy)
+    series_end = 4 if text[3].isalpha() or len(text) == 9 else 3
+    head, digits = text[:series_end], text[series_end:]
+    if len(digits) == 5:
+        digits = f"{digits[:3]}.{digits[3:]}"
+    return f"{head}-{digits}"
+
+
+def _prepare(crop):
+    """Phóng to crop nhỏ và tạo bản tăng tương phản (CLAHE + blur) cho lượt đọc thứ hai"""
+    height, width = crop.shape[:2]
+    if height < MIN_PLATE_HEIGHT:
+        scale = MIN_PLATE_HEIGHT / height
+        crop = cv2.resize(crop, (int(width * scale), MIN_PLATE_HEIGHT), interpolation=cv2.INTER_CUBIC)
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+    enhanced = cv2.GaussianBlur(clahe.apply(gray), (3, 3), 0)
+    return crop, cv2.cvtColor(enhanced, cv2.COLOR_GRAY2BGR)
+
+
+class PlateRecognizer:
+    """Nhận dạng biển số dùng chung cho helmet, overspeed và tra cứu.
+
+    Engine OCR được nạp một lần (lười) cho cả process và chỉ dùng qua API công khai
+    (PaddleOCR.ocr / easyocr readtext). recognize_batch() đọc nhiều crop trong một lần giữ
+    khóa engine; crop không đọc được sẽ thử lại trên bản tăng tương phản. Kết quả được
+    chuẩn hóa theo định dạng VN. Không cache theo nội dung crop: hai crop giống hệt nhau
+    từng byte gần như không xảy ra với video, còn việc gộp các lần đọc thuộc về PlateVote.
+    """
+
+    def __init__(self, engine=PLATE_OCR_ENGINE):
+        self.engine_name = engine
+        self._engine = None
+        self._engine_lock = threading.Lock()
+
+    @property
+    def engine(self):
+        with self._engine_lock:
+            if self._engine is None:
+                self._engine = self._load_engine()
+            return self._engine
+
+    def _load_engine(self):
+        if self.engine_name == "easyocr":
+            import easyocr
+            import torch
+            print("Loading EasyOCR plate reader...")
+            return easyocr.Reader(['en'], gpu=torch.cuda.is_available())
+        from paddleocr import PaddleOCR
+        print("Loading PaddleOCR plate reader...")
+        return PaddleOCR(use_angle_cls=True, lang='en')
+
+    def recognize(self, crop):
+        return self.recognize_batch([crop])[0]
+
+    def recognize_batch(self, crops):
+        """Đọc danh sách crop BGR, trả về [(text, confidence)] ("Unknown", 0.0 nếu không đọc được)"""
+        results = [("Unknown", 0.0)] * len(crops)
+        todo = [i for i, crop in enumerate(crops) if crop is not None and crop.size > 0]
+        if not todo:
+            return results
+
+        prepared = {i: _prepare(crops[i]) for i in todo}
+        engine = self.engine
+        # Lượt 1 trên ảnh gốc, lượt 2 (chỉ các crop còn lỗi) trên ảnh tăng tương phản
+        for variant in (0, 1):
+            if not todo:
+                break
+            with self._engine_lock:
+                texts = self._read(engine, [prepared[i][variant] for i in todo])
+            remaining = []
+            for i, (text, confidence) in zip(todo, texts):
+                text = normalize_plate(text)
+                if len(text) >= MIN_PLATE_CHARS:
+                    if not is_valid_plate(text):
+                        confidence *= INVALID_FORMAT_PENALTY
+                    results[i] = (text, confidence)
+                else:
+                    remaining.append(i)
+            todo = remaining
+        return results
+
+    def _read(self, engine, images):
+        if self.engine_name == "easyocr":
+            return [self._read_easyocr(engine, image) for image in images]
+        return [self._read_paddle(engine, image) for image in images]
+
+    def _read_paddle(self, engine, image):
+        results = engine.ocr(image, cls=True)
+        if not results or not results[0]:
+            return "", 0.0
+        lines = []
+        for line in results[0]:
+            if len(line) >= 2 and line[1][1] > MIN_LINE_CONFIDENCE:
+                avg_y = sum(point[1] for point in line[0]) / len(line[0])
+                lines.append((avg_y, line[1][0].strip(), float(line[1][1])))
+        return self._join_lines(lines)
+
+    def _read_easyocr(self, engine, image):
+        lines = []
+        for box, text, score in engine.readtext(image, detail=1):
+            if score > MIN_LINE_CONFIDENCE and text.strip():
+                lines.append((sum(point[1] for point in box) / len(box), text.strip(), float(score)))
+        return self._join_lines(lines)
+
+    @staticmethod
+    def _join_lines(lines):
+        """Ghép các dòng từ trên xuống (biển 2 dòng), confidence là trung bình các dòng"""
+        if not lines:
+            return "", 0.0
+        lines.sort(key=lambda line: line[0])
+        return "".join(line[1] for line in lines), sum(line[2] for line in lines) / len(lines)
+
+
+plate_recognizer = PlateRecognizer()
+_plate_ocr_pool = None
+_plate_detector = None
+_plate_lock = threading.Lock()
+
+
+def get_plate_ocr_pool():
+    """Pool OCR chung: crop từ mọi stream được gom lô trước khi gọi engine; chỉ tạo luồng khi cần"""
+    global _plate_ocr_pool
+    with _plate_lock:
+        if _plate_ocr_pool is None:
+            _plate_ocr_pool = OCRWorkerPool(plate_recognizer.recognize_batch, name="plate-ocr")
+        return _plate_ocr_pool
+
+
+def shutdown_plate_ocr_pool():
+    with _plate_lock:
+        if _plate_ocr_pool is not None:
+            _plate_ocr_pool.shutdown()
+
+
+def get_plate_detector():
+    global _plate_detector
+    with _plate_lock:
+        if _plate_detector is None:
+            from services.inference.detector import SharedDetector
+            _plate_detector = SharedDetector(PLATE_DETECTOR_PATH)
+        return _plate_detector
+
+
+def submit_plate_crop(key, image, bbox, vote):
+    """Gửi vùng biển số của một track đi OCR bất đồng bộ; kết quả được gộp vào vote"""
+    x1, y1, x2, y2 = map(int, bbox)
+    crop = image[max(0, y1):max(0, y2), max(0, x1):max(0, x2)]
+    if crop.size == 0:
+        return False
+    return get_plate_ocr_pool().submit(key, crop.copy(), vote)
+
+
+def recognize_plates(image, conf=0.6):
+    """Phát hiện và đọc mọi biển số trong ảnh (đồng bộ), dùng cho tra cứu ảnh tĩnh"""
+    results = get_plate_detector().detect(image, conf=conf)
+    plates = []
+    if results.boxes is None or len(results.boxes) == 0:
+        return plates
+    bboxes = results.boxes.xyxy.cpu().numpy().astype(int)
+    scores = results.boxes.conf.cpu().numpy()
+    crops = [image[max(0, y1):y2, max(0, x1):x2] for x1, y1, x2, y2 in bboxes]
+    for bbox, score, (text, confidence) in zip(bboxes, scores, plate_recognizer.recognize_batch(crops)):
+        plates.append({
+            "text": text,
+            "display": format_plate(text),
+            "confidence": round(confidence, 4),
+            "valid": is_valid_plate(text),
+            "bbox": bbox.tolist(),
+            "detectionConfidence": round(float(score), 4),
+        })
+    return plates
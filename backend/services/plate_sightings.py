@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+import cv2
+from services.plate_recognition import normalize_plate, format_plate, is_valid_plate
+
+# Chỉ mục biển số đã đọc được trên mọi camera (helmet, overspeed), giữ trong bộ nhớ theo thời gian
+PLATE_SIGHTING_RETENTION_HOURS = float(os.getenv("PLATE_SIGHTING_RETENTION_HOURS", "6"))
+PLATE_SIGHTING_SPILL_DIR = os.getenv("PLATE_SIGHTING_SPILL_DIR", "")  # Rỗng = không ghi ra đĩa khi hết hạn
+PLATE_SIGHTING_MAX_DISTANCE = min(int(os.getenv("PLATE_SIGHTING_MAX_DISTANCE", "1")), 2)
+
+SWEEP_SECONDS = 30
+SNAPSHOT_QUALITY = 80
+SNAPSHOT_MARGIN = 1.0  # Nới crop biển số ra mỗi phía bằng chừng này lần kích thước khi không có box xe
+
+
+def edit_distance(a, b, max_distance=None):
+    """Khoảng cách Levenshtein; dừng sớm và trả về max_distance + 1 khi chắc chắn vượt ngưỡng"""
+    if max_distance is not None and abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def deletion_variants(text, depth):
+    """Mọi chuỗi thu được khi xóa tối đa depth ký tự (kiểu SymSpell) để tìm ứng viên gần đúng"""
+    variants = {text}
+    frontier = {text}
+    for _ in range(depth):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        variants |= frontier
+    return variants
+
+
+class PlateSightings:
+    """Chỉ mục ngược biển số -> các lần xuất hiện (camera, thời điểm, track, ảnh chụp).
+
+    Mỗi track của một pipeline là một bản ghi: các lần publish sau chỉ cập nhật lastSeen,
+    confidence và biển số nếu kết quả bỏ phiếu thay đổi. Tra cứu chính xác theo biển số đã
+    chuẩn hóa, tra gần đúng qua chỉ mục biến thể xóa ký tự rồi kiểm tra lại bằng khoảng cách
+    sửa đổi. Bản ghi quá hạn được dọn định kỳ và, nếu cấu hình, ghi ra đĩa (jsonl theo ngày
+    + ảnh chụp) để vẫn tra cứu được các khoảng thời gian cũ hơn.
+    """
+
+    def __init__(self, retention_hours=PLATE_SIGHTING_RETENTION_HOURS, spill_dir=PLATE_SIGHTING_SPILL_DIR,
+                 max_distance=PLATE_SIGHTING_MAX_DISTANCE):
+        self.retention_seconds = retention_hours * 3600
+        self.spill_dir = spill_dir or None
+        self.max_distance = max_distance
+        self._sightings = OrderedDict()  # sighting_id -> bản ghi
+        self._snapshots = {}  # sighting_id -> JPEG bytes
+        self._by_track = {}  # (source, camera_id, track_id) -> sighting_id
+        self._by_plate = defaultdict(set)  # biển số -> sighting_id
+        self._by_variant = defaultdict(set)  # biến thể xóa ký tự -> biển số
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def publish(self, plate, camera_id, track_id, confidence, frame=None, bbox=None, source="", timestamp=None):
+        """Ghi nhận biển số đọc được của một track, trả về sighting_id (None nếu sai định dạng)"""
+        plate = normalize_plate(plate)
+        if not is_valid_plate(plate):
+            return None
+        now = timestamp or time.time()
+        key = (source, camera_id, track_id)
+        with self._lock:
+            sighting_id = self._update_track(key, plate, confidence, now)
+            if sighting_id is not None:
+                return sighting_id
+
+        # Ảnh chụp chỉ mã hóa một lần khi track xuất hiện lần đầu, ngoài khóa
+        snapshot = self._encode_snapshot(frame, bbox)
+        sighting_id = uuid.uuid4().hex[:12]
+        sighting = {
+            "id": sighting_id,
+            "plate": plate,
+            "display": format_plate(plate),
+            "cameraId": camera_id,
+            "trackId": track_id,
+            "source": source,
+            "firstSeen": now,
+            "lastSeen": now,
+            "confidence": round(float(confidence), 4),
+            "snapshot": snapshot is not None,
+        }
+        with self._lock:
+            # Luồng khác có thể đã thêm bản ghi cho track này trong lúc mã hóa ảnh: cập nhật bản ghi đó
+            existing_id = self._update_track(key, plate, confidence, now)
+            if existing_id is not None:
+                return existing_id
+            self._sightings[sighting_id] = sighting
+            self._by_track[key] = sighting_id
+            self._link(sighting_id, plate)
+            if snapshot is not None:
+                self._snapshots[sighting_id] = snapshot
+        self._ensure_sweeper()
+        return sighting_id
+
+    def lookup(self, query, max_distance=None, start_time=None, end_time=None, camera_ids=None, limit=50):
+        """Các lần xuất hiện khớp biển số, gần nhất trước; distance = 0 là khớp chính xác"""
+        query = normalize_plate(query or "")
+        if not query:
+            return []
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        now = time.time()
+        end_time = end_time or now
+        start_time = start_time or now - self.retention_seconds
+        camera_ids = set(camera_ids) if camera_ids else None
+
+        def wanted(sighting):
+            return (sighting["lastSeen"] >= start_time and sighting["firstSeen"] <= end_time
+                    and (camera_ids is None or sighting["cameraId"] in camera_ids))
+
+        matches = {}
+        with self._lock:
+            candidates = set()
+            for variant in deletion_variants(query, max_distance):
+                candidates |= self._by_variant.get(variant, set())
+            for plate in candidates:
+                distance = edit_distance(query, plate, max_distance)
+                if distance > max_distance:
+                    continue
+                for sighting_id in self._by_plate[plate]:
+                    sighting = self._sightings[sighting_id]
+                    if wanted(sighting):
+                        matches[sighting_id] = dict(sighting, distance=distance)
+
+        if self.spill_dir and start_time < now - self.retention_seconds:
+            for sighting in self._search_archive(query, max_distance, start_time, end_time):
+                if wanted(sighting):
+                    matches.setdefault(sighting["id"], sighting)
+        return sorted(matches.values(), key=lambda s: (s["distance"], -s["lastSeen"]))[:limit]
+
+    def snapshot(self, sighting_id):
+        with self._lock:
+            snapshot = self._snapshots.get(sighting_id)
+        if snapshot is not None or not self.spill_dir:
+            return snapshot
+        path = os.path.join(self.spill_dir, "snapshots", f"{os.path.basename(sighting_id)}.jpg")
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def stats(self):
+        with self._lock:
+            return {"sightings": len(self._sightings), "plates": len(self._by_plate),
+                    "snapshots": len(self._snapshots)}
+
+    def expire(self, now=None):
+        """Bỏ các bản ghi không còn thấy trong thời gian lưu giữ, ghi ra đĩa nếu bật spill"""
+        cutoff = (now or time.time()) - self.retention_seconds
+        expired = []
+        with self._lock:
+            for sighting_id in [sid for sid, s in self._sightings.items() if s["lastSeen"] < cutoff]:
+                sighting = self._sightings.pop(sighting_id)
+                self._unlink(sighting_id, sighting["plate"])
+                key = (sighting["source"], sighting["cameraId"], sighting["trackId"])
+                if self._by_track.get(key) == sighting_id:
+                    del self._by_track[key]
+                expired.append((sighting, self._snapshots.pop(sighting_id, None)))
+        if expired and self.spill_dir:
+            self._spill(expired)
+        return len(expired)
+
+    def _update_track(self, key, plate, confidence, now):
+        """Cập nhật bản ghi sẵn có của track (gọi khi đang giữ khóa), trả về sighting_id hoặc None"""
+        sighting_id = self._by_track.get(key)
+        sighting = self._sightings.get(sighting_id)
+        if sighting is None:
+            return None
+        sighting["lastSeen"] = now
+        sighting["confidence"] = round(float(confidence), 4)
+        if sighting["plate"] != plate:
+            self._unlink(sighting_id, sighting["plate"])
+            sighting["plate"], sighting["display"] = plate, format_plate(plate)
+            self._link(sighting_id, plate)
+        return sighting_id
+
+    def _link(self, sighting_id, plate):
+        if not self._by_plate[plate]:
+            for variant in deletion_variants(plate, self.max_distance):
+                self._by_variant[variant].add(plate)
+        self._by_plate[plate].add(sighting_id)
+
+    def _unlink(self, sighting_id, plate):
+        ids = self._by_plate.get(plate)
+        if ids is None:
+            return
+        ids.discard(sighting_id)
+        if ids:
+            return
+        del self._by_plate[plate]
+        for variant in deletion_variants(plate, self.max_distance):
+            plates = self._by_variant.get(variant)
+            if plates is not None:
+                plates.discard(plate)
+                if not plates:
+                    del self._by_variant[variant]
+
+    @staticmethod
+    def _encode_snapshot(frame, bbox):
+        if frame is None or bbox is None:
+            return None
+        height, width = frame.shape[:2]
+        x1, y1, x2, y2 = map(int, bbox)
+        crop = frame[max(0, y1):min(height, y2), max(0, x1):min(width, x2)]
+        if crop.size == 0:
+            return None
+        ok, jpeg = cv2.imencode(".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_QUALITY])
+        return jpeg.tobytes() if ok else None
+
+    def _spill(self, expired):
+        try:
+            os.makedirs(os.path.join(self.spill_dir, "snapshots"), exist_ok=True)
+            by_day = defaultdict(list)
+            for sighting, snapshot in expired:
+                if snapshot is not None:
+                    with open(os.path.join(self.spill_dir, "snapshots", f"{sighting['id']}.jpg"), "wb") as f:
+                        f.write(snapshot)
+                by_day[datetime.fromtimestamp(sighting["lastSeen"]).strftime("%Y-%m-%d")].append(sighting)
+            for day, sightings in by_day.items():
+                with open(os.path.join(self.spill_dir, f"{day}.jsonl"), "a", encoding="utf-8") as f:
+                    for sighting in sightings:
+                        f.write(json.dumps(sighting, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"[-] Failed to spill {len(expired)} plate sightings: {e}")
+
+    def _search_archive(self, query, max_distance, start_time, end_time):
+        start_day = datetime.fromtimestamp(start_time).strftime("%Y-%m-%d")
+        end_day = datetime.fromtimestamp(end_time).strftime("%Y-%m-%d")
+        try:
+            names = sorted(os.listdir(self.spill_dir))
+        except OSError:
+            return
+        for name in names:
+            day, ext = os.path.splitext(name)
+            if ext != ".jsonl" or not start_day <= day <= end_day:
+                continue
+            with open(os.path.join(self.spill_dir, name), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        sighting = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    distance = edit_distance(query, sighting.get("plate", ""), max_distance)
+                    if distance <= max_distance:
+                        sighting["distance"] = distance
+                        yield sighting
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep, daemon=True, name="plate-sightings")
+                self._sweeper.start()
+
+    def _sweep(self):
+        while True:
+            time.sleep(SWEEP_SECONDS)
+            try:
+                self.expire()
+            except Exception as e:
+                print(f"[-] Plate sighting sweep error: {e}")
+
+
+plate_sightings = PlateSightings()
+
+
+def plate_snapshot_box(plate_bbox, vehicle_bbox=None, margin=SNAPSHOT_MARGIN):
+    """Vùng ảnh chụp cho một lần xuất hiện: box xe gộp với biển số, hoặc biển số nới rộng"""
+    x1, y1, x2, y2 = map(int, plate_bbox)
+    if vehicle_bbox is not None:
+        vx1, vy1, vx2, vy2 = map(int, vehicle_bbox[:4])
+        return min(x1, vx1), min(y1, vy1), max(x2, vx2), max(y2, vy2)
+    # Thân xe nằm phía trên biển số nên nới lên trên nhiều hơn
+    dx, dy = int((x2 - x1) * margin), int((y2 - y1) * margin)
+    return x1 - dx, y1 - dy * 4, x2 + dx, y2 + dy
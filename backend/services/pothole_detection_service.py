@@ -234,11 +234,7 @@ def detect_potholes_in_video(stream_url, camera_id):
 
             # Stream the annotated frame
             try:
-                _, jpeg = cv2.imencode('.jpg', frame_annotated, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                yield (
-                    b"--frame\r\n"
-                    b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
-                )
+                yield frame_annotated
             except Exception as e:
                 print(f"[ERROR] Frame encoding failed: {e}")
                 
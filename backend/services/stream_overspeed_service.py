@@ -6,13 +6,17 @@ import time
 import traceback
 from datetime import datetime
 from collections import deque
-from ultralytics import YOLO
 import requests
-import easyocr
 from fastapi import FastAPI
 from fastapi.responses import StreamingResponse
 from filterpy.kalman import KalmanFilter
 from utils.yt_stream import get_stream_url
+from services.inference.budget_scheduler import inference_scheduler
+from services.inference.detector import SharedDetector
+from services.inference.model_tier import TieredDetector
+from services.plate_recognition import PlateVote, submit_plate_crop, shutdown_plate_ocr_pool
+from services.plate_sightings import plate_sightings, plate_snapshot_box
+from services.inference.stream_tracker import StreamTracker
 from concurrent.futures import ThreadPoolExecutor
 import atexit
 
@@ -28,8 +32,8 @@ DISTANCE_REF = 10  # Reference real-world distance (meters) for calibration
 PIXEL_REF = 100  # Corresponding pixel distance for DISTANCE_REF
 VIOLATION_API_URL = "http://localhost:8081/api/violations"
 
-# Load YOLOv8m model
-model = YOLO("yolov8m.pt")  # Pre-trained YOLOv8m model
+# Load YOLOv8m model (shared, stateless); each stream owns its own tracker
+model = SharedDetector("yolov8m.pt")  # Pre-trained YOLOv8m model
 
 # Define class names mapping
 class_names = {
@@ -40,9 +44,6 @@ class_names = {
     # Add number_plate if your model is fine-tuned to detect it
 }
 
-# Initialize EasyOCR
-ocr_reader = easyocr.Reader(['en'], gpu=True)
-
 # Initialize FastAPI
 app = FastAPI()
 
@@ -77,23 +78,19 @@ def fetch_camera_config(cid: int, retries=3, delay=1):
             time.sleep(delay)
     raise ValueError("Failed to fetch camera config after retries")
 
-def extract_license_plate(frame, boxes):
-    """Extract license plate text using EasyOCR."""
+def extract_license_plate(frame, boxes, plate_votes, camera_id):
+    """Gửi crop biển số sang pool OCR và trả về biển số đã bỏ phiếu cho track đó."""
     license_plate_text = "Unknown"
     for box in boxes:
         if class_names.get(int(box.cls), model.names[int(box.cls)]) == "number_plate":
             x1, y1, x2, y2 = map(int, box.xyxy[0])
-            plate_roi = frame[y1:y2, x1:x2]
-            if plate_roi.size > 0:
-                try:
-                    plate_roi = cv2.cvtColor(plate_roi, cv2.COLOR_BGR2GRAY)
-                    plate_roi = cv2.equalizeHist(plate_roi)
-                    ocr_results = ocr_reader.readtext(plate_roi, detail=0)
-                    license_plate_text = ocr_results[0] if ocr_results else "Unknown"
-                    license_plate_text = "".join(c for c in license_plate_text if c.isalnum()).upper()
-                except Exception as e:
-                    print(f"Error in OCR: {e}")
-                    license_plate_text = "Unknown"
+            plate_id = int(box.id) if box.id is not None else -1
+            vote = plate_votes.setdefault(plate_id, PlateVote())
+            submit_plate_crop((camera_id, plate_id), frame, (x1, y1, x2, y2), vote)
+            if vote.readings:
+                license_plate_text = vote.text
+                plate_sightings.publish(vote.text, camera_id, plate_id, vote.confidence, frame,
+                                        plate_snapshot_box((x1, y1, x2, y2)), source="overspeed")
             break
     return license_plate_text
 
@@ -108,6 +105,17 @@ def calculate_speed(prev_pos, curr_pos, frame_time, pixel_to_meter):
     km_per_hour = meters_per_second * 3.6  # Convert m/s to km/h
     return km_per_hour
 
+def write_recording_frame(recording_tasks, frame):
+    """Ghi frame vào các video vi phạm đang quay, đóng writer khi đủ số frame."""
+    for track_id in list(recording_tasks.keys()):
+        task = recording_tasks[track_id]
+        if task['frames_remaining'] > 0:
+            task['writer'].write(frame)
+            task['frames_remaining'] -= 1
+        else:
+            task['writer'].release()
+            del recording_tasks[track_id]
+
 def send_violation_async(violation_data, snapshot_filepath, video_filepath, track_id):
     """Gửi dữ liệu vi phạm đến API bất đồng bộ và xóa file ngay sau khi gửi."""
     def send_violation():
@@ -154,9 +162,14 @@ def stream_overspeed_service(youtube_url: str, camera_id: int):
     recording_tasks = {}
     kalman_filters = {}
     speed_history = {}
+    plate_votes = {}  # track_id biển số -> PlateVote, OCR chạy nền trên pool OCR biển số chung
     pixel_to_meter = DISTANCE_REF / PIXEL_REF  # Conversion factor
     frame_time = 1.0 / FRAME_RATE
+    frame_index = 0
+    tracker = StreamTracker("bytetrack.yaml", frame_rate=FRAME_RATE)
+    detector = TieredDetector(camera_id)  # Model theo bậc tải, dùng chung model giữa các camera
 
+    inference_scheduler.register(camera_id)
     try:
         while True:
             ret, frame = cap.read()
@@ -166,17 +179,26 @@ def stream_overspeed_service(youtube_url: str, camera_id: int):
                 cap = cv2.VideoCapture(stream_url)
                 continue
 
-            frame_annotated = frame.copy()
+            frame_index += 1
             frame_for_video = frame.copy()
+
+            # Bỏ qua suy luận khi camera đã dùng hết ngân sách, nhưng vẫn giữ frame cho video bằng chứng
+            # và vẫn gửi frame cho người xem để hình không bị đứng
+            if not inference_scheduler.acquire(camera_id):
+                frame_buffer.append(frame_for_video)
+                write_recording_frame(recording_tasks, frame_for_video)
+                yield frame
+                continue
+
+            frame_annotated = frame.copy()
             h, w, _ = frame.shape
 
-            results = model.track(source=frame, persist=True, conf=0.5, iou=0.5, tracker="bytetrack.yaml")[0]
+            results = tracker.update(detector.detect(frame, conf=0.5, iou=0.5, classes=list(class_names)))
             if results.boxes is None or results.boxes.id is None:
+                inference_scheduler.report_activity(camera_id, pending_violations=len(recording_tasks))
+                detector.frame_done()
                 frame_buffer.append(frame_for_video.copy())
-                yield (
-                    b"--frame\r\n"
-                    b"Content-Type: image/jpeg\r\n\r\n" + cv2.imencode('.jpg', frame_annotated, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes() + b"\r\n"
-                )
+                yield frame_annotated
                 continue
 
             active_track_ids = set()
@@ -185,9 +207,7 @@ def stream_overspeed_service(youtube_url: str, camera_id: int):
 
             for i in range(len(results.boxes)):
                 cls_id = int(results.boxes.cls[i])
-                class_name = class_names.get(cls_id, model.names[cls_id])
-                if class_name not in class_names.values():
-                    continue
+                class_name = class_names[cls_id]
 
                 x1, y1, x2, y2 = map(int, results.boxes.xyxy[i])
                 track_id = int(results.boxes.id[i])
@@ -200,7 +220,7 @@ def stream_overspeed_service(youtube_url: str, camera_id: int):
                 if class_name == "number_plate":
                     plate_boxes.append(results.boxes[i])
 
-            license_plate_text = extract_license_plate(frame, plate_boxes)
+            license_plate_text = extract_license_plate(frame, plate_boxes, plate_votes, camera_id)
 
             for x1, y1, x2, y2, track_id, class_name in vehicle_boxes:
                 if track_id not in kalman_filters:
@@ -210,16 +230,20 @@ def stream_overspeed_service(youtube_url: str, camera_id: int):
                 kf = kalman_filters[track_id]
                 center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
 
+                # Frame có thể bị bỏ qua theo ngân sách, nên dùng số frame thực tế giữa hai lần đo
+                history = speed_history[track_id]
+                prev_pos, prev_index = history[-1] if history else (None, frame_index - 1)
+                elapsed_frames = max(1, frame_index - prev_index)
+                kf.F[0, 2] = kf.F[1, 3] = elapsed_frames
                 kf.predict()
                 kf.update(np.array([[center_x], [center_y]]))
 
                 smoothed_pos = kf.x[:2].flatten()
-                prev_pos = speed_history[track_id][-1] if speed_history[track_id] else None
-                speed = calculate_speed(prev_pos, smoothed_pos, frame_time, pixel_to_meter)
-                speed_history[track_id].append(smoothed_pos)
+                speed = calculate_speed(prev_pos, smoothed_pos, elapsed_frames * frame_time, pixel_to_meter)
+                history.append((smoothed_pos, frame_index))
 
-                avg_speed = np.mean([calculate_speed(speed_history[track_id][i-1], speed_history[track_id][i], frame_time, pixel_to_meter) 
-                                     for i in range(1, len(speed_history[track_id]))]) if len(speed_history[track_id]) > 1 else speed
+                avg_speed = np.mean([calculate_speed(history[i-1][0], history[i][0], (history[i][1] - history[i-1][1]) * frame_time, pixel_to_meter)
+                                     for i in range(1, len(history))]) if len(history) > 1 else speed
 
                 if avg_speed > SPEED_LIMIT and track_id not in vehicle_violations and track_id not in recording_tasks:
                     vehicle_violations[track_id] = "OVERSPEED"
@@ -268,32 +292,28 @@ def stream_overspeed_service(youtube_url: str, camera_id: int):
                             cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
 
             frame_buffer.append(frame_for_video.copy())
-
-            for track_id in list(recording_tasks.keys()):
-                task = recording_tasks[track_id]
-                if task['frames_remaining'] > 0:
-                    task['writer'].write(frame_for_video)
-                    task['frames_remaining'] -= 1
-                else:
-                    task['writer'].release()
-                    del recording_tasks[track_id]
+            write_recording_frame(recording_tasks, frame_for_video)
+            inference_scheduler.report_activity(camera_id, tracked=len(active_track_ids),
+                                                pending_violations=len(recording_tasks))
+            detector.frame_done()
 
             for track_id in list(vehicle_violations.keys()):
                 if track_id not in active_track_ids:
                     vehicle_violations.pop(track_id, None)
                     kalman_filters.pop(track_id, None)
                     speed_history.pop(track_id, None)
+            for track_id in list(plate_votes.keys()):
+                if track_id not in active_track_ids:
+                    del plate_votes[track_id]
 
-            _, jpeg = cv2.imencode('.jpg', frame_annotated, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
-            )
+            yield frame_annotated
 
     except Exception as e:
         print(f"[-] Error in stream_overspeed_service: {e}")
         traceback.print_exc()
     finally:
+        inference_scheduler.unregister(camera_id)
+        detector.close()
         cap.release()
         for task in recording_tasks.values():
             task['writer'].release()
@@ -304,6 +324,7 @@ def cleanup_on_exit():
     print("[+] Shutting down violation executor...")
     violation_executor.shutdown(wait=True)
     print("[+] Violation executor shutdown complete")
+    shutdown_plate_ocr_pool()
 
 # Đăng ký hàm cleanup
 atexit.register(cleanup_on_exit)
@@ -0,0 +1,87 @@
+import os
+import time
+import threading
+import cv2
+
+try:
+    from turbojpeg import TurboJPEG, TJFLAG_FASTDCT, TJSAMP_420, TJSAMP_422, TJSAMP_444
+except ImportError:  # PyTurboJPEG là tùy chọn; không có thì mã hóa bằng OpenCV
+    TurboJPEG = None
+
+JPEG_ENCODER = os.getenv("JPEG_ENCODER", "auto")  # auto | turbo | opencv
+JPEG_FAST_DCT = os.getenv("JPEG_FAST_DCT", "1") == "1"  # Chỉ áp dụng cho turbo
+JPEG_SUBSAMPLING = os.getenv("JPEG_SUBSAMPLING", "420")  # 420 | 422 | 444
+
+MULTIPART_HEADER = b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n"
+
+
+class JpegEncoder:
+    """Mã hóa JPEG cho luồng MJPEG, dùng libjpeg-turbo (PyTurboJPEG) nếu có.
+
+    Đo thời gian CPU của luồng gọi cho mỗi lần mã hóa (time.thread_time), để so sánh
+    encoder và cấu hình qua /api/metrics/streams.
+    """
+
+    def __init__(self, backend=JPEG_ENCODER, fast_dct=JPEG_FAST_DCT, subsampling=JPEG_SUBSAMPLING):
+        self.backend = "opencv"
+        self.fast_dct = fast_dct
+        self.subsampling = subsampling
+        self._turbo = None
+        if backend in ("auto", "turbo") and TurboJPEG is not None:
+            try:
+                self._turbo = TurboJPEG()
+                self.backend = "turbo"
+            except (OSError, RuntimeError) as e:  # Có gói Python nhưng thiếu thư viện libturbojpeg
+                print(f"[-] libturbojpeg not available, using OpenCV JPEG encoder: {e}")
+        elif backend == "turbo":
+            print("[-] PyTurboJPEG not installed, using OpenCV JPEG encoder")
+
+        self._opencv_params = []
+        sampling = {"422": "IMWRITE_JPEG_SAMPLING_FACTOR_422II", "444": "IMWRITE_JPEG_SAMPLING_FACTOR_444"}.get(subsampling)
+        if sampling and hasattr(cv2, sampling):  # 4:2:0 là mặc định của OpenCV
+            self._opencv_params = [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, getattr(cv2, sampling)]
+        if self._turbo is not None:
+            self._turbo_subsample = {"422": TJSAMP_422, "444": TJSAMP_444}.get(subsampling, TJSAMP_420)
+
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.cpu_seconds = 0.0
+        self.bytes = 0
+
+    def encode(self, frame, quality):
+        """JPEG của frame BGR dưới dạng bytes-like (bytes hoặc mảng uint8), None nếu lỗi"""
+        started = time.thread_time()
+        if self._turbo is not None:
+            jpeg = self._turbo.encode(frame, quality=quality, jpeg_subsample=self._turbo_subsample,
+                                      flags=TJFLAG_FASTDCT if self.fast_dct else 0)
+        else:
+            ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality] + self._opencv_params)
+            if not ok:
+                return None
+        elapsed = time.thread_time() - started
+        with self._lock:
+            self.frames += 1
+            self.cpu_seconds += elapsed
+            self.bytes += len(memoryview(jpeg).cast("B"))
+        return jpeg
+
+    def stats(self):
+        with self._lock:
+            frames = self.frames
+            return {
+                "backend": self.backend,
+                "fastDct": self.fast_dct if self.backend == "turbo" else False,
+                "subsampling": self.subsampling,
+                "frames": frames,
+                "cpuMsPerFrame": round(self.cpu_seconds * 1000 / frames, 3) if frames else None,
+                "avgBytes": self.bytes // frames if frames else None,
+            }
+
+
+def multipart_chunk(jpeg):
+    """Một phần multipart/x-mixed-replace; ghép header, ảnh và CRLF trong một lần cấp phát"""
+    data = memoryview(jpeg).cast("B")
+    return b"".join((MULTIPART_HEADER % len(data), data, b"\r\n"))
+
+
+jpeg_encoder = JpegEncoder()
@@ -0,0 +1,265 @@
+import os
+import time
+import asyncio
+import inspect
+import threading
+import cv2
+import numpy as np
+from services.streaming.jpeg import jpeg_encoder, multipart_chunk
+
+MJPEG_QUALITY = int(os.getenv("MJPEG_QUALITY", "85"))
+MJPEG_MIN_QUALITY, MJPEG_MAX_QUALITY = 30, 95
+MJPEG_MIN_WIDTH = 160
+MJPEG_WIDTH_STEP = 32  # Làm tròn width để người xem gần giống nhau dùng chung một biến thể
+STREAM_IDLE_SECONDS = 10.0  # Pipeline dừng khi không còn người xem quá lâu (cho phép tải lại trang)
+FRAME_WAIT_TIMEOUT = 5.0
+STREAM_REAP_INTERVAL = 1.0
+
+
+def iterate_source(source):
+    """Duyệt generator của dịch vụ trong luồng hiện tại; generator async chạy trên event loop riêng"""
+    if not inspect.isasyncgen(source):
+        try:
+            yield from source
+        finally:
+            source.close()
+        return
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(source.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(source.aclose())
+        loop.close()
+
+
+def viewer_params(max_fps=None, width=None, quality=None):
+    """Chuẩn hóa tham số của người xem thành (max_fps, width, quality) dùng cho subscribe"""
+    max_fps = float(max_fps) if max_fps and max_fps > 0 else None
+    if width:
+        width = max(MJPEG_MIN_WIDTH, int(round(width / MJPEG_WIDTH_STEP)) * MJPEG_WIDTH_STEP)
+    quality = min(MJPEG_MAX_QUALITY, max(MJPEG_MIN_QUALITY, int(quality))) if quality else MJPEG_QUALITY
+    return max_fps, width or None, quality
+
+
+class FrameDecimator:
+    """Giảm tốc độ frame cho một người xem: bỏ frame đến sớm hơn 1/max_fps"""
+
+    def __init__(self, max_fps=None):
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self._next_due = 0.0
+
+    def accept(self):
+        if not self.interval:
+            return True
+        now = time.monotonic()
+        if now < self._next_due:
+            return False
+        # Bám theo lịch cố định; nếu tụt lại quá một khoảng thì bắt đầu lại từ bây giờ
+        slot = self._next_due if now - self._next_due < self.interval else now
+        self._next_due = slot + self.interval
+        return True
+
+
+class LiveFrame:
+    """Một frame đã chú thích; mỗi biến thể (quality, width) chỉ mã hóa một lần cho mọi người xem"""
+
+    def __init__(self, item, seq):
+        self.seq = seq
+        self.frame = item if isinstance(item, np.ndarray) else None
+        self.raw = None if self.frame is not None else bytes(item)  # Thông báo lỗi của pipeline, gửi nguyên văn
+        self._chunks = {}
+        self._lock = threading.Lock()
+
+    def variants(self):
+        with self._lock:
+            return [{"quality": quality, "width": width} for quality, width in self._chunks]
+
+    def chunk(self, quality=MJPEG_QUALITY, width=None):
+        if self.frame is None:
+            return self.raw
+        height, frame_width = self.frame.shape[:2]
+        if width is not None and width >= frame_width:
+            width = None
+        key = (quality, width)
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                frame = self.frame
+                if width is not None:
+                    frame = cv2.resize(frame, (width, max(1, round(height * width / frame_width))),
+                                       interpolation=cv2.INTER_AREA)
+                jpeg = jpeg_encoder.encode(frame, quality)
+                chunk = self._chunks[key] = multipart_chunk(jpeg) if jpeg is not None else b""
+        return chunk
+
+
+class LiveStream:
+    """Một pipeline xử lý cho một camera, phát frame cho mọi người xem.
+
+    Generator của dịch vụ (yield frame đã chú thích) chạy trong một luồng riêng, bất kể
+    có bao nhiêu người xem; mỗi người xem chỉ chờ frame mới nhất và lấy bytes đã mã hóa.
+    Pipeline dừng (đóng generator, giải phóng stream) khi không còn ai xem quá STREAM_IDLE_SECONDS;
+    việc kiểm tra do LiveStreamHub chạy theo chu kỳ nên không phụ thuộc nguồn còn ra frame hay không.
+    """
+
+    def __init__(self, key, source_factory):
+        self.key = key
+        self._source_factory = source_factory
+        self.latest = None
+        self.seq = 0
+        self.subscribers = 0
+        self.ended = False
+        self.stopping = False
+        self.started_at = time.time()
+        self._idle_since = time.monotonic()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"live-{key}")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        source = iterate_source(self._source_factory())
+        try:
+            for item in source:
+                with self._condition:
+                    if self.stopping:
+                        break
+                    self.seq += 1
+                    self.latest = LiveFrame(item, self.seq)
+                    self._condition.notify_all()
+        except Exception as e:
+            print(f"[-] Live stream {self.key} error: {e}")
+        finally:
+            source.close()
+            with self._condition:
+                self.ended = True
+                self._condition.notify_all()
+
+    def stop_if_idle(self, now=None):
+        """Đánh dấu dừng pipeline nếu không còn người xem quá STREAM_IDLE_SECONDS; trả về True nếu đã dừng"""
+        now = time.monotonic() if now is None else now
+        with self._condition:
+            if self.ended or self.stopping:
+                return True
+            if self.subscribers or now - self._idle_since <= STREAM_IDLE_SECONDS:
+                return False
+            self.stopping = True
+            self._condition.notify_all()
+        print(f"[INFO] Live stream {self.key}: no viewers, stopping pipeline")
+        return True
+
+    def subscribe(self, quality=MJPEG_QUALITY, width=None, max_fps=None):
+        """Iterator multipart cho một người xem (đã thu nhỏ và giảm fps theo tham số của họ)"""
+        return Subscription(self, quality, width, max_fps)
+
+    def _attach(self):
+        with self._condition:
+            self.subscribers += 1
+
+    def _detach(self):
+        with self._condition:
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self._idle_since = time.monotonic()
+
+    def info(self):
+        with self._condition:
+            latest = self.latest
+            info = {"key": str(self.key), "subscribers": self.subscribers, "frames": self.seq,
+                    "startTime": self.started_at, "ended": self.ended}
+        info["variants"] = latest.variants() if latest is not None else []
+        return info
+
+
+class Subscription:
+    """Một người xem của LiveStream: được tính ngay khi tạo, giải phóng đúng một lần khi đóng.
+
+    Người xem ngắt kết nối trước khi nhận frame đầu tiên vẫn được giải phóng (close/__del__),
+    điều mà generator chưa từng chạy không làm được.
+    """
+
+    def __init__(self, stream, quality=MJPEG_QUALITY, width=None, max_fps=None):
+        self._stream = stream
+        self._quality = quality
+        self._width = width
+        self._decimator = FrameDecimator(max_fps)
+        self._last_seq = 0
+        self._closed = False
+        stream._attach()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        stream = self._stream
+        while not self._closed:
+            with stream._condition:
+                if not stream._condition.wait_for(lambda: stream.seq > self._last_seq or stream.ended,
+                                                  timeout=FRAME_WAIT_TIMEOUT):
+                    continue
+                if stream.seq <= self._last_seq:
+                    break
+                frame = stream.latest
+            self._last_seq = frame.seq
+            if frame.frame is not None and not self._decimator.accept():
+                continue
+            chunk = frame.chunk(self._quality, self._width)
+            if chunk:
+                return chunk
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._stream._detach()
+
+    def __del__(self):
+        self.close()
+
+
+class LiveStreamHub:
+    """Các pipeline đang chạy theo khóa (camera, loại xử lý); người xem sau dùng lại pipeline có sẵn"""
+
+    def __init__(self):
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def subscribe(self, key, source_factory, quality=MJPEG_QUALITY, width=None, max_fps=None):
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None or stream.ended or stream.stopping:
+                stream = self._streams[key] = LiveStream(key, source_factory).start()
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_forever, daemon=True, name="live-reaper")
+                self._reaper.start()
+            # Tính người xem ngay trong khóa để bộ dọn không dừng pipeline vừa tạo
+            return stream.subscribe(quality, width, max_fps)
+
+    def reap(self):
+        """Dừng và gỡ các pipeline đã kết thúc hoặc không còn người xem"""
+        now = time.monotonic()
+        with self._lock:
+            for key in [key for key, stream in self._streams.items() if stream.stop_if_idle(now)]:
+                del self._streams[key]
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(STREAM_REAP_INTERVAL)
+            self.reap()
+
+    def snapshot(self):
+        self.reap()
+        with self._lock:
+            streams = list(self._streams.values())
+        return {"streams": [stream.info() for stream in streams], "encoder": jpeg_encoder.stats()}
+
+
+live_streams = LiveStreamHub()
@@ -1,5 +1,19 @@
 # byte_tracker.py
 import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# Trạng thái track
+TRACKED, LOST = 0, 1
+
+# Hệ số nhiễu Kalman theo chiều cao box (giống ByteTrack gốc)
+STD_WEIGHT_POSITION = 1.0 / 20
+STD_WEIGHT_VELOCITY = 1.0 / 160
+# Phương sai nhiễu cho (cx, cy, a, h) = h^2 * SCALE + FIXED: a không phụ thuộc chiều cao
+_HEIGHT_DEPENDENT = np.array([1.0, 1.0, 0.0, 1.0])
+Q_POS_SCALE, Q_POS_FIXED = STD_WEIGHT_POSITION ** 2 * _HEIGHT_DEPENDENT, np.array([0, 0, 1e-4, 0])
+Q_VEL_SCALE, Q_VEL_FIXED = STD_WEIGHT_VELOCITY ** 2 * _HEIGHT_DEPENDENT, np.array([0, 0, 1e-10, 0])
+R_SCALE, R_FIXED = STD_WEIGHT_POSITION ** 2 * _HEIGHT_DEPENDENT, np.array([0, 0, 1e-2, 0])
+
 
 class STrack:
     def __init__(self, tlwh, score, cls, track_id):
@@ -8,44 +22,269 @@ class STrack:
         self.cls = cls
         self.track_id = track_id
 
+
+def tlbr_to_xyah(tlbr):
+    """(N, 4) x1, y1, x2, y2 -> cx, cy, aspect ratio w/h, h"""
+    w = tlbr[:, 2] - tlbr[:, 0]
+    h = np.maximum(tlbr[:, 3] - tlbr[:, 1], 1e-6)
+    return np.stack([tlbr[:, 0] + w / 2, tlbr[:, 1] + h / 2, w / h, h], axis=1)
+
+
+def xyah_to_tlbr(xyah):
+    w = xyah[:, 2] * xyah[:, 3]
+    h = xyah[:, 3]
+    x1 = xyah[:, 0] - w / 2
+    y1 = xyah[:, 1] - h / 2
+    return np.stack([x1, y1, x1 + w, y1 + h], axis=1)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU giữa mọi cặp box (tlbr), trả về ma trận (len(a), len(b))"""
+    iw = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2]) - np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    ih = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3]) - np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    inter = np.maximum(iw, 0) * np.maximum(ih, 0)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def overlapping_pairs(boxes_a, boxes_b):
+    """Các cặp (i, j) có IoU > 0, tìm bằng quét theo trục x thay vì tính cả ma trận.
+
+    Trả về (idx_a, idx_b, iou). Với vài trăm box rải trên khung hình, số cặp gần như
+    tuyến tính theo số box. Tọa độ được tách thành từng cột liền nhau; ứng viên bị loại
+    theo phần giao trục x rồi trục y trước khi tính IoU nên chỉ cặp giao nhau mới tốn phép chia.
+    """
+    order = np.argsort(boxes_b[:, 0], kind="stable")
+    bx1, by1, bx2, by2 = boxes_b[order].T
+    ax1, ay1, ax2, ay2 = boxes_a.T
+    max_width = (bx2 - bx1).max()
+    lo = np.searchsorted(bx1, ax1 - max_width, side="left")
+    hi = np.searchsorted(bx1, ax2, side="left")
+    counts = np.maximum(hi - lo, 0)
+    ends = np.cumsum(counts)
+    idx_a = np.repeat(np.arange(len(boxes_a)), counts)
+    idx_b = np.arange(ends[-1]) + np.repeat(lo - (ends - counts), counts)
+    iw = np.minimum(ax2[idx_a], bx2[idx_b]) - np.maximum(ax1[idx_a], bx1[idx_b])
+    keep = np.flatnonzero(iw > 0)
+    idx_a, idx_b, iw = idx_a[keep], idx_b[keep], iw[keep]
+    ih = np.minimum(ay2[idx_a], by2[idx_b]) - np.maximum(ay1[idx_a], by1[idx_b])
+    keep = np.flatnonzero(ih > 0)
+    idx_a, idx_b = idx_a[keep], idx_b[keep]
+    inter = iw[keep] * ih[keep]
+    area_a = (ax2 - ax1) * (ay2 - ay1)
+    area_b = (bx2 - bx1) * (by2 - by1)
+    iou = inter / (area_a[idx_a] + area_b[idx_b] - inter + 1e-9)
+    return idx_a, order[idx_b], iou
+
+
+class BatchKalmanFilter:
+    """Kalman filter vận tốc hằng cho không gian (cx, cy, a, h), xử lý cả lô track một lúc.
+
+    F chỉ nối mỗi tọa độ với vận tốc của chính nó, nhiễu Q, R và hiệp phương sai ban đầu
+    đều chéo, nên P luôn gồm bốn khối 2x2 độc lập (vị trí, vận tốc) cho cx, cy, a, h.
+    Hiệp phương sai lưu dạng (N, 3, 4): phương sai vị trí, hiệp phương sai vị trí-vận tốc,
+    phương sai vận tốc; predict/update là phép tính từng phần tử, cho kết quả như ma trận 8x8.
+    """
+
+    def initiate(self, measurements):
+        n = len(measurements)
+        mean = np.concatenate([measurements, np.zeros((n, 4))], axis=1)
+        h = measurements[:, 3]
+        covariance = np.zeros((n, 3, 4))
+        covariance[:, 0] = np.stack([2 * STD_WEIGHT_POSITION * h, 2 * STD_WEIGHT_POSITION * h,
+                                     np.full(n, 1e-2), 2 * STD_WEIGHT_POSITION * h], axis=1) ** 2
+        covariance[:, 2] = np.stack([10 * STD_WEIGHT_VELOCITY * h, 10 * STD_WEIGHT_VELOCITY * h,
+                                     np.full(n, 1e-5), 10 * STD_WEIGHT_VELOCITY * h], axis=1) ** 2
+        return mean, covariance
+
+    def predict(self, mean, covariance):
+        # Nhiễu theo chiều cao box; tỉ lệ khung hình a dùng nhiễu cố định
+        h2 = mean[:, 3:4] ** 2
+        mean = mean.copy()
+        mean[:, :4] += mean[:, 4:]
+        pp, pv, vv = covariance[:, 0], covariance[:, 1], covariance[:, 2]
+        predicted = np.empty_like(covariance)
+        predicted[:, 0] = pp + 2 * pv + vv + (h2 * Q_POS_SCALE + Q_POS_FIXED)
+        predicted[:, 1] = pv + vv
+        predicted[:, 2] = vv + (h2 * Q_VEL_SCALE + Q_VEL_FIXED)
+        return mean, predicted
+
+    def update(self, mean, covariance, measurements):
+        pp, pv, vv = covariance[:, 0], covariance[:, 1], covariance[:, 2]
+        s = pp + (mean[:, 3:4] ** 2 * R_SCALE + R_FIXED)
+        gain_pos, gain_vel = pp / s, pv / s
+        innovation = measurements - mean[:, :4]
+        mean = mean.copy()
+        mean[:, :4] += gain_pos * innovation
+        mean[:, 4:] += gain_vel * innovation
+        updated = np.empty_like(covariance)
+        updated[:, 0] = pp - gain_pos * pp
+        updated[:, 1] = pv - gain_pos * pv
+        updated[:, 2] = vv - gain_vel * pv
+        return mean, updated
+
+
 class BYTETracker:
-    def __init__(self, track_thresh=0.5, match_thresh=0.7):
+    """ByteTrack với trạng thái lưu dạng mảng NumPy.
+
+    Mỗi frame: dự đoán Kalman cho mọi track, ghép hai giai đoạn (detection điểm cao
+    rồi điểm thấp) bằng linear_sum_assignment trên ma trận IoU, giữ track bị mất
+    trong track_buffer frame để có thể nối lại với ID cũ.
+
+    match_thresh là ngưỡng chi phí (1 - IoU * score) như ByteTrack gốc.
+    """
+
+    def __init__(self, track_thresh=0.5, match_thresh=0.8, track_buffer=30, frame_rate=30,
+                 low_thresh=0.1, new_track_thresh=None):
         self.track_thresh = track_thresh
         self.match_thresh = match_thresh
-        self.tracks = []
+        self.low_thresh = low_thresh
+        # Như ByteTrack gốc: chỉ mở track mới với detection cao hơn track_thresh một bậc, tránh track nhiễu
+        self.new_track_thresh = track_thresh + 0.1 if new_track_thresh is None else new_track_thresh
+        self.max_time_lost = int(frame_rate / 30.0 * track_buffer)
+        self.kalman = BatchKalmanFilter()
+        self.frame_id = 0
         self.next_id = 0
+        self._reset_state()
+
+    def _reset_state(self):
+        self.mean = np.zeros((0, 8))
+        self.covariance = np.zeros((0, 3, 4))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.classes = np.zeros(0, dtype=np.int64)
+        self.states = np.zeros(0, dtype=np.int8)
+        self.activated = np.zeros(0, dtype=bool)
+        self.last_frame = np.zeros(0, dtype=np.int64)
+
+    @property
+    def tracks(self):
+        output = self.output_array()
+        return [STrack(row[:4], row[5], int(row[6]), int(row[4])) for row in output.tolist()]
+
+    def output_array(self):
+        """Các track đang hoạt động dạng mảng (N, 7): x, y, w, h, track_id, score, cls"""
+        idx = np.flatnonzero(self.activated & (self.states == TRACKED))
+        tlbr = xyah_to_tlbr(self.mean[idx, :4])
+        return np.column_stack([tlbr[:, :2], tlbr[:, 2:] - tlbr[:, :2], self.ids[idx], self.scores[idx], self.classes[idx]])
 
     def update(self, detections, img_info=None, timer=None):
-        new_tracks = []
-        for det in detections:
-            x1, y1, x2, y2, score, cls = det
-            if score < self.track_thresh:
-                continue
-            matched = False
-            tlwh = [x1, y1, x2-x1, y2-y1]
-            for track in self.tracks:
-                iou = self._iou(track.tlwh, tlwh)
-                if iou > self.match_thresh:
-                    track.tlwh = tlwh
-                    track.score = score
-                    track.cls = int(cls)
-                    matched = True
-                    new_tracks.append(track)
-                    break
-            if not matched:
-                track = STrack(tlwh, score, int(cls), self.next_id)
-                self.next_id += 1
-                new_tracks.append(track)
-        self.tracks = new_tracks
+        """Cập nhật với detections (N, 6): x1, y1, x2, y2, score, cls; trả về list STrack"""
+        self.step(detections)
         return self.tracks
 
-    def _iou(self, box1, box2):
-        x1, y1, w1, h1 = box1
-        x2, y2, w2, h2 = box2
-        xa = max(x1, x2)
-        ya = max(y1, y2)
-        xb = min(x1 + w1, x2 + w2)
-        yb = min(y1 + h1, y2 + h2)
-        inter = max(0, xb - xa) * max(0, yb - ya)
-        union = w1 * h1 + w2 * h2 - inter
-        return inter / union if union > 0 else 0
+    def update_array(self, detections):
+        """Như update() nhưng trả về mảng từ output_array(), tránh tạo object cho từng track"""
+        self.step(detections)
+        return self.output_array()
+
+    def step(self, detections):
+        self.frame_id += 1
+        dets = np.asarray(detections, dtype=np.float64).reshape(-1, 6)
+        scores = dets[:, 4]
+        high_idx = np.flatnonzero(scores >= self.track_thresh)
+        low_idx = np.flatnonzero((scores > self.low_thresh) & (scores < self.track_thresh))
+        det_tlbr = dets[:, :4]
+
+        if len(self.mean):
+            # Track bị mất không giữ vận tốc theo chiều cao
+            self.mean[self.states != TRACKED, 7] = 0
+            self.mean, self.covariance = self.kalman.predict(self.mean, self.covariance)
+        track_tlbr = xyah_to_tlbr(self.mean[:, :4])
+
+        # Giai đoạn 1: track đã xác nhận (đang track hoặc bị mất) với detection điểm cao
+        pool = np.flatnonzero(self.activated)
+        m1_t, m1_d, u1_t, u1_d = self._associate(pool, high_idx, track_tlbr, det_tlbr, scores, self.match_thresh, fuse=True)
+
+        # Giai đoạn 2: track đang track còn lại với detection điểm thấp
+        remaining = u1_t[self.states[u1_t] == TRACKED]
+        m2_t, m2_d, u2_t, _ = self._associate(remaining, low_idx, track_tlbr, det_tlbr, scores, 0.5, fuse=False)
+
+        # Track mới chưa xác nhận chỉ được ghép với detection điểm cao còn lại
+        unconfirmed = np.flatnonzero(~self.activated)
+        m3_t, m3_d, u3_t, u3_d = self._associate(unconfirmed, u1_d, track_tlbr, det_tlbr, scores, 0.7, fuse=True)
+
+        matched_t = np.concatenate([m1_t, m2_t, m3_t])
+        matched_d = np.concatenate([m1_d, m2_d, m3_d])
+        if len(matched_t):
+            det_xyah = tlbr_to_xyah(det_tlbr[matched_d])
+            self.mean[matched_t], self.covariance[matched_t] = self.kalman.update(
+                self.mean[matched_t], self.covariance[matched_t], det_xyah)
+            self.states[matched_t] = TRACKED
+            self.activated[matched_t] = True
+            self.scores[matched_t] = scores[matched_d]
+            self.classes[matched_t] = dets[matched_d, 5].astype(np.int64)
+            self.last_frame[matched_t] = self.frame_id
+        self.states[u2_t] = LOST
+
+        keep = np.ones(len(self.mean), dtype=bool)
+        keep[u3_t] = False
+        keep &= ~((self.states == LOST) & (self.frame_id - self.last_frame > self.max_time_lost))
+        self._compact(keep)
+
+        new_d = u3_d[scores[u3_d] >= self.new_track_thresh]
+        if len(new_d):
+            self._start_tracks(dets[new_d])
+
+    def _associate(self, track_idx, det_idx, track_tlbr, det_tlbr, scores, thresh, fuse):
+        empty = np.zeros(0, dtype=np.int64)
+        if len(track_idx) == 0 or len(det_idx) == 0:
+            return empty, empty, track_idx, det_idx
+        rows, cols, iou = overlapping_pairs(track_tlbr[track_idx], det_tlbr[det_idx])
+        cost = 1 - iou * scores[det_idx[cols]] if fuse else 1 - iou
+        # Cặp vượt ngưỡng không bao giờ được ghép (giống cost_limit của lapjv)
+        valid = cost <= thresh
+        rows, cols, cost = rows[valid], cols[valid], cost[valid]
+
+        # Cặp chỉ có một ứng viên ở cả hai phía được ghép thẳng, phần còn lại mới cần Hungarian
+        row_degree = np.bincount(rows, minlength=len(track_idx))
+        col_degree = np.bincount(cols, minlength=len(det_idx))
+        unique = (row_degree[rows] == 1) & (col_degree[cols] == 1)
+        match_rows, match_cols = [rows[unique]], [cols[unique]]
+        if not unique.all():
+            amb_rows, amb_cols, amb_cost = rows[~unique], cols[~unique], cost[~unique]
+            # Đánh số lại hàng/cột tranh chấp qua bảng tra (rẻ hơn np.unique vì không cần sắp xếp)
+            sub_rows = np.flatnonzero(np.bincount(amb_rows, minlength=len(track_idx)))
+            sub_cols = np.flatnonzero(np.bincount(amb_cols, minlength=len(det_idx)))
+            row_pos = np.empty(len(track_idx), dtype=np.int64)
+            row_pos[sub_rows] = np.arange(len(sub_rows))
+            col_pos = np.empty(len(det_idx), dtype=np.int64)
+            col_pos[sub_cols] = np.arange(len(sub_cols))
+            matrix = np.full((len(sub_rows), len(sub_cols)), thresh + 1e-6)
+            matrix[row_pos[amb_rows], col_pos[amb_cols]] = amb_cost
+            r, c = linear_sum_assignment(matrix)
+            accepted = matrix[r, c] <= thresh
+            match_rows.append(sub_rows[r[accepted]])
+            match_cols.append(sub_cols[c[accepted]])
+        rows, cols = np.concatenate(match_rows), np.concatenate(match_cols)
+
+        unmatched_t = np.ones(len(track_idx), dtype=bool)
+        unmatched_t[rows] = False
+        unmatched_d = np.ones(len(det_idx), dtype=bool)
+        unmatched_d[cols] = False
+        return track_idx[rows], det_idx[cols], track_idx[unmatched_t], det_idx[unmatched_d]
+
+    def _start_tracks(self, dets):
+        n = len(dets)
+        mean, covariance = self.kalman.initiate(tlbr_to_xyah(dets[:, :4]))
+        self.mean = np.concatenate([self.mean, mean])
+        self.covariance = np.concatenate([self.covariance, covariance])
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + n)])
+        self.next_id += n
+        self.scores = np.concatenate([self.scores, dets[:, 4].astype(np.float32)])
+        self.classes = np.concatenate([self.classes, dets[:, 5].astype(np.int64)])
+        self.states = np.concatenate([self.states, np.full(n, TRACKED, dtype=np.int8)])
+        # Frame đầu tiên kích hoạt ngay, sau đó cần khớp thêm một frame để tránh track nhiễu
+        self.activated = np.concatenate([self.activated, np.full(n, self.frame_id == 1)])
+        self.last_frame = np.concatenate([self.last_frame, np.full(n, self.frame_id, dtype=np.int64)])
+
+    def _compact(self, keep):
+        self.mean = self.mean[keep]
+        self.covariance = self.covariance[keep]
+        self.ids = self.ids[keep]
+        self.scores = self.scores[keep]
+        self.classes = self.classes[keep]
+        self.states = self.states[keep]
+        self.activated = self.activated[keep]
+        self.last_frame = self.last_frame[keep]
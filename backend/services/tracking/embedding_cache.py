@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+
+REFRESH_INTERVAL_FRAMES = 30  # Trích xuất lại định kỳ dù chất lượng không đổi
+AREA_GAIN = 1.3  # Box lớn hơn 30% so với lần trích xuất tốt nhất
+SHARPNESS_GAIN = 1.5  # Crop nét hơn 50%
+SHARPNESS_CHECK_INTERVAL = 5  # Đo độ nét mỗi N frame cho một track, không phải mọi frame
+MAX_SAMPLES = 20  # Sau MAX_SAMPLES lần, trung bình chạy trở thành EMA
+MAX_MISSING_FRAMES = 90  # Track vắng lâu hơn mức này bị xóa khỏi cache
+
+
+def crop_sharpness(image, box):
+    """Phương sai Laplacian trên crop xám thu nhỏ, dùng làm thước đo độ nét rẻ"""
+    x1, y1, x2, y2 = map(int, box)
+    crop = image[max(0, y1):max(0, y2), max(0, x1):max(0, x2)]
+    if crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    if gray.shape[0] > 128:
+        scale = 128.0 / gray.shape[0]
+        gray = cv2.resize(gray, (max(1, int(gray.shape[1] * scale)), 128), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+class TrackEmbeddingEntry:
+    def __init__(self):
+        self.mean = None
+        self.count = 0
+        self.best_area = 0.0
+        self.best_sharpness = 0.0
+        self.refreshed_at = -1
+        self.sharpness_checked_at = -1
+        self.last_seen = -1
+
+
+class TrackEmbeddingCache:
+    """Cache embedding ReID theo track.
+
+    Chỉ trích xuất khi track mới xuất hiện, khi box lớn hơn / nét hơn đáng kể so với
+    lần tốt nhất, hoặc sau REFRESH_INTERVAL_FRAMES. Mỗi track giữ một embedding
+    trung bình chạy đã chuẩn hóa, nên chi phí ReID tỉ lệ với số xe mới thay vì
+    số xe nhân số frame.
+    """
+
+    def __init__(self, dim=512, refresh_interval=REFRESH_INTERVAL_FRAMES):
+        self.dim = dim
+        self.refresh_interval = refresh_interval
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def select_for_refresh(self, image, track_ids, bboxes, frame_idx):
+        """Trả về danh sách (index, area, sharpness) của các track cần trích xuất lại"""
+        selected = []
+        for i, (tid, box) in enumerate(zip(track_ids, bboxes)):
+            entry = self.entries.get(tid)
+            x1, y1, x2, y2 = box
+            area = max(0.0, float(x2 - x1)) * max(0.0, float(y2 - y1))
+            if entry is None or entry.mean is None:
+                selected.append((i, area, crop_sharpness(image, box)))
+                continue
+            entry.last_seen = frame_idx
+            if frame_idx - entry.refreshed_at >= self.refresh_interval or area > entry.best_area * AREA_GAIN:
+                selected.append((i, area, crop_sharpness(image, box)))
+                continue
+            if frame_idx - entry.sharpness_checked_at >= SHARPNESS_CHECK_INTERVAL:
+                entry.sharpness_checked_at = frame_idx
+                sharpness = crop_sharpness(image, box)
+                if sharpness > entry.best_sharpness * SHARPNESS_GAIN:
+                    selected.append((i, area, sharpness))
+        return selected
+
+    def update(self, track_id, feature, area, sharpness, frame_idx):
+        entry = self.entries.setdefault(track_id, TrackEmbeddingEntry())
+        feature = np.asarray(feature, dtype=np.float32)
+        feature = feature / (np.linalg.norm(feature) + 1e-8)
+        n = min(entry.count, MAX_SAMPLES - 1)
+        mean = feature if entry.mean is None else (entry.mean * n + feature) / (n + 1)
+        entry.mean = mean / (np.linalg.norm(mean) + 1e-8)
+        entry.count += 1
+        entry.best_area = max(entry.best_area, area)
+        entry.best_sharpness = max(entry.best_sharpness, sharpness)
+        entry.refreshed_at = frame_idx
+        entry.sharpness_checked_at = frame_idx
+        entry.last_seen = frame_idx
+
+    def embeddings(self, track_ids):
+        """Ma trận (N, dim) embedding trung bình theo thứ tự track_ids"""
+        if not track_ids:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.stack([self.entries[tid].mean for tid in track_ids])
+
+    def prune(self, frame_idx, max_missing=MAX_MISSING_FRAMES):
+        """Xóa các track vắng mặt quá lâu, trả về dict track ID -> entry đã xóa"""
+        stale = [tid for tid, entry in self.entries.items() if frame_idx - entry.last_seen > max_missing]
+        return {tid: self.entries.pop(tid) for tid in stale}
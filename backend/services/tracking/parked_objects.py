@@ -0,0 +1,111 @@
+import os
+import itertools
+import cv2
+import numpy as np
+
+# Chế độ đỗ xe: lấy mẫu vùng ở tần số thấp, đo thời gian dừng theo đồng hồ thực
+PARKING_SAMPLE_FPS = float(os.getenv("PARKING_SAMPLE_FPS", "1"))
+PARKING_DWELL_SECONDS = float(os.getenv("PARKING_DWELL_SECONDS", "8"))
+PARKING_MATCH_IOU = 0.5  # So với box lúc bắt đầu dừng: xe nhích ra khỏi chỗ cũ là bản ghi mới
+PARKING_MIN_APPEARANCE = 0.6  # Tương đồng histogram màu tối thiểu để coi là cùng một xe
+PARKING_FORGET_SECONDS = 5.0  # Cho phép bị che khuất ngắn trước khi xóa bản ghi
+HIST_BINS = (16, 8)  # H x S
+
+
+def appearance(frame, bbox):
+    """Histogram H-S (chuẩn hóa L2) của crop xe, đủ rẻ để tính ở 1 fps"""
+    x1, y1, x2, y2 = map(int, bbox)
+    crop = frame[max(0, y1):max(0, y2), max(0, x1):max(0, x2)]
+    if crop.size == 0:
+        return np.zeros(HIST_BINS[0] * HIST_BINS[1], dtype=np.float32)
+    hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, list(HIST_BINS), [0, 180, 0, 256]).ravel()
+    return hist / max(float(np.linalg.norm(hist)), 1e-6)
+
+
+def box_iou(a, b):
+    """IoU NxM giữa hai mảng box xyxy"""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class ParkedObjectTracker:
+    """Bản ghi "xe đang dừng" bền qua các lần lấy mẫu thưa, không phụ thuộc track ID.
+
+    Mỗi lần lấy mẫu, các detection trong vùng được ghép với bản ghi theo IoU so với box
+    lúc xe bắt đầu dừng cộng độ tương đồng màu; detection không ghép được mở bản ghi mới.
+    Thời gian dừng là giây thực từ firstSeen, nên không bị ảnh hưởng khi ByteTrack đổi ID
+    hay khi tốc độ frame thay đổi. Bản ghi vắng quá forget_seconds bị xóa.
+    """
+
+    def __init__(self, dwell_seconds=PARKING_DWELL_SECONDS, match_iou=PARKING_MATCH_IOU,
+                 min_appearance=PARKING_MIN_APPEARANCE, forget_seconds=PARKING_FORGET_SECONDS):
+        self.dwell_seconds = dwell_seconds
+        self.match_iou = match_iou
+        self.min_appearance = min_appearance
+        self.forget_seconds = forget_seconds
+        self.records = {}  # record_id -> bản ghi
+        self._ids = itertools.count(1)
+
+    def update(self, frame, boxes, class_names, zones, now):
+        """Ghép detection (chỉ những cái có zone) với bản ghi; trả về các bản ghi thấy ở lần này"""
+        keep = [i for i, zone in enumerate(zones) if zone]
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)[keep]
+        features = [appearance(frame, box) for box in boxes]
+        records = list(self.records.values())
+
+        matched, used = {}, set()
+        if records and len(boxes):
+            overlap = box_iou([record["anchor"] for record in records], boxes)
+            similarity = np.array([[float(record["appearance"] @ feature) for feature in features]
+                                   for record in records])
+            score = np.where((overlap >= self.match_iou) & (similarity >= self.min_appearance),
+                             overlap + similarity, -1.0)
+            # Ghép tham lam theo điểm cao nhất, mỗi bản ghi và mỗi detection chỉ một lần
+            for flat in np.argsort(score, axis=None)[::-1]:
+                r, d = np.unravel_index(flat, score.shape)
+                if score[r, d] < 0:
+                    break
+                if r in used or d in matched:
+                    continue
+                matched[d] = r
+                used.add(r)
+
+        seen = []
+        for d, box in enumerate(boxes):
+            i = keep[d]
+            if d in matched:
+                record = records[matched[d]]
+                record["appearance"] = record["appearance"] * 0.8 + features[d] * 0.2
+                record["appearance"] /= max(float(np.linalg.norm(record["appearance"])), 1e-6)
+            else:
+                record_id = next(self._ids)
+                record = self.records[record_id] = {
+                    "id": record_id,
+                    "anchor": box.copy(),
+                    "appearance": features[d],
+                    "firstSeen": now,
+                    "reported": False,
+                }
+            record.update(bbox=box.astype(int).tolist(), className=class_names[i], zone=zones[i], lastSeen=now)
+            seen.append(record)
+
+        for record_id in [rid for rid, record in self.records.items() if now - record["lastSeen"] > self.forget_seconds]:
+            del self.records[record_id]
+        return seen
+
+    def dwell(self, record, now):
+        return now - record["firstSeen"]
+
+    def due(self, now):
+        """Bản ghi đã dừng đủ lâu và chưa báo vi phạm"""
+        return [record for record in self.records.values()
+                if not record["reported"] and record["lastSeen"] == now and self.dwell(record, now) >= self.dwell_seconds]
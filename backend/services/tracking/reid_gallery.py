@@ -0,0 +1,124 @@
+import time
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # FAISS là tùy chọn, chỉ dùng cho gallery lớn
+    faiss = None
+
+DEFAULT_CAPACITY = 2048
+DEFAULT_MAX_AGE_SECONDS = 600  # Xe không xuất hiện lại sau 10 phút sẽ bị loại khỏi gallery
+FAISS_MIN_CAPACITY = 20000  # Dưới mức này một phép nhân ma trận NumPy đã đủ nhanh
+
+
+class ReIDGallery:
+    """Gallery đặc trưng ReID lưu dạng ma trận float32 liên tục, đã chuẩn hóa.
+
+    Mọi query trong một frame được so khớp bằng một phép nhân ma trận và lấy top-1.
+    Kích thước bị giới hạn bởi capacity: khi đầy, mục lâu nhất không được nhìn thấy
+    (LRU) bị thay thế; mục quá max_age_seconds cũng bị loại.
+    """
+
+    def __init__(self, dim=512, score_th=0.5, capacity=DEFAULT_CAPACITY,
+                 max_age_seconds=DEFAULT_MAX_AGE_SECONDS, use_faiss=None):
+        self.dim = dim
+        self.score_th = score_th
+        self.capacity = capacity
+        self.max_age_seconds = max_age_seconds
+        self.features = np.zeros((capacity, dim), dtype=np.float32)
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.last_seen = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+        self.next_id = 0
+        if use_faiss is None:
+            use_faiss = faiss is not None and capacity >= FAISS_MIN_CAPACITY
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim)) if use_faiss and faiss is not None else None
+
+    def __len__(self):
+        return self.size
+
+    def match(self, features):
+        """Top-1 cho mỗi query: trả về (global_ids, similarities), id = -1 nếu dưới ngưỡng"""
+        features = self._normalize(features)
+        if self.size == 0 or len(features) == 0:
+            return np.full(len(features), -1, dtype=np.int64), np.zeros(len(features), dtype=np.float32)
+        if self.index is not None:
+            sims, slots = self.index.search(features, 1)
+            sims, slots = sims[:, 0], slots[:, 0]
+        else:
+            scores = features @ self.features[:self.size].T
+            slots = np.argmax(scores, axis=1)
+            sims = scores[np.arange(len(features)), slots]
+        matched = (sims > self.score_th) & (slots >= 0)
+        gids = np.where(matched, self.ids[np.maximum(slots, 0)], -1)
+        if matched.any():
+            self.last_seen[slots[matched]] = time.monotonic()
+        return gids, sims
+
+    def touch(self, gids):
+        """Đánh dấu các global ID đang còn thấy trên khung hình, để không bị hết hạn hay bị LRU thay thế"""
+        if self.size == 0 or len(gids) == 0:
+            return
+        seen = np.isin(self.ids[:self.size], np.asarray(gids, dtype=np.int64))
+        self.last_seen[:self.size][seen] = time.monotonic()
+
+    def match_or_register(self, features):
+        """Ghép từng đặc trưng với gallery, đăng ký ID mới cho đặc trưng chưa khớp"""
+        features = self._normalize(features)
+        gids, _ = self.match(features)
+        pending = np.flatnonzero(gids < 0)
+        if len(pending):
+            self._evict_expired()
+        new_rows, new_gids = [], []
+        for i in pending:
+            # Hai xe mới trong cùng frame có thể là một: so với những mục vừa đăng ký
+            if new_rows:
+                sims = features[new_rows] @ features[i]
+                best = int(np.argmax(sims))
+                if sims[best] > self.score_th:
+                    gids[i] = new_gids[best]
+                    continue
+            gids[i] = self._register(features[i])
+            new_rows.append(i)
+            new_gids.append(gids[i])
+        return gids.tolist()
+
+    def _register(self, feature):
+        if self.size < self.capacity:
+            slot = self.size
+            self.size += 1
+        else:
+            slot = int(np.argmin(self.last_seen[:self.size]))
+            if self.index is not None:
+                self.index.remove_ids(np.array([slot], dtype=np.int64))
+        gid = self.next_id
+        self.next_id += 1
+        self.features[slot] = feature
+        self.ids[slot] = gid
+        self.last_seen[slot] = time.monotonic()
+        if self.index is not None:
+            self.index.add_with_ids(feature[None, :], np.array([slot], dtype=np.int64))
+        return gid
+
+    def _evict_expired(self):
+        if self.size == 0 or self.max_age_seconds is None:
+            return
+        alive = time.monotonic() - self.last_seen[:self.size] <= self.max_age_seconds
+        if alive.all():
+            return
+        keep = np.flatnonzero(alive)
+        n = len(keep)
+        self.features[:n] = self.features[keep]
+        self.ids[:n] = self.ids[keep]
+        self.last_seen[:n] = self.last_seen[keep]
+        self.ids[n:self.size] = -1
+        self.size = n
+        if self.index is not None:
+            # Slot đã dịch chuyển nên dựng lại chỉ mục
+            self.index.reset()
+            if n:
+                self.index.add_with_ids(self.features[:n], np.arange(n, dtype=np.int64))
+
+    def _normalize(self, features):
+        features = np.ascontiguousarray(np.asarray(features, dtype=np.float32).reshape(-1, self.dim))
+        return features / (np.linalg.norm(features, axis=1, keepdims=True) + 1e-8)
@@ -0,0 +1,85 @@
+import os
+import threading
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+REID_INPUT_WIDTH, REID_INPUT_HEIGHT = 128, 256
+REID_FEATURE_DIM = 512
+# Batch động được đệm lên các kích thước cố định để ORT tái sử dụng kế hoạch thực thi
+REID_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+REID_INTRA_OP_THREADS = int(os.getenv("REID_INTRA_OP_THREADS", str(max(1, (os.cpu_count() or 2) // 2))))
+REID_INTER_OP_THREADS = int(os.getenv("REID_INTER_OP_THREADS", "1"))
+
+# Mean/std theo thứ tự kênh của frame đầu vào (giữ nguyên như pipeline cũ)
+PIXEL_MEAN = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+PIXEL_INV_STD = 1.0 / np.array([58.395, 57.12, 57.375], dtype=np.float32)
+
+_extractors = {}
+_extractors_lock = threading.Lock()
+
+
+def create_reid_session(model_path):
+    """ONNX session cấu hình rõ cho CPU; chỉ dùng CUDA khi provider thực sự có"""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = REID_INTRA_OP_THREADS
+    options.inter_op_num_threads = REID_INTER_OP_THREADS
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    providers = ["CPUExecutionProvider"]
+    if "CUDAExecutionProvider" in ort.get_available_providers():
+        providers.insert(0, "CUDAExecutionProvider")
+    return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+
+class ReIDFeatureExtractor:
+    """Một session ReID dùng chung cho cả process, tiền xử lý theo lô bằng buffer cấp phát sẵn."""
+
+    def __init__(self, model_path):
+        self.session = create_reid_session(model_path)
+        self.input_name = self.session.get_inputs()[0].name
+        self._lock = threading.Lock()
+        max_batch = REID_BATCH_BUCKETS[-1]
+        self._crops = np.zeros((max_batch, REID_INPUT_HEIGHT, REID_INPUT_WIDTH, 3), dtype=np.uint8)
+        self._normalized = np.zeros((max_batch, REID_INPUT_HEIGHT, REID_INPUT_WIDTH, 3), dtype=np.float32)
+        self._inputs = {bucket: np.zeros((bucket, 3, REID_INPUT_HEIGHT, REID_INPUT_WIDTH), dtype=np.float32)
+                        for bucket in REID_BATCH_BUCKETS}
+
+    def extract(self, image, bboxes):
+        bboxes = list(bboxes)
+        if not bboxes:
+            return np.empty((0, REID_FEATURE_DIM), dtype=np.float32)
+        max_batch = REID_BATCH_BUCKETS[-1]
+        with self._lock:
+            feats = [self._extract_batch(image, bboxes[start:start + max_batch])
+                     for start in range(0, len(bboxes), max_batch)]
+        feats = np.concatenate(feats)
+        feats /= np.linalg.norm(feats, axis=1, keepdims=True) + 1e-8
+        return feats
+
+    def _extract_batch(self, image, bboxes):
+        n = len(bboxes)
+        bucket = next(b for b in REID_BATCH_BUCKETS if b >= n)
+        h, w = image.shape[:2]
+        for i, box in enumerate(bboxes):
+            x1, y1, x2, y2 = map(int, box)
+            crop = image[max(0, y1):min(h, y2), max(0, x1):min(w, x2)]
+            if crop.size == 0:
+                self._crops[i] = 0
+            else:
+                cv2.resize(crop, (REID_INPUT_WIDTH, REID_INPUT_HEIGHT), dst=self._crops[i])
+        # Chuẩn hóa cả lô một lần rồi chuyển HWC -> CHW vào buffer của bucket
+        normalized = self._normalized[:n]
+        np.subtract(self._crops[:n], PIXEL_MEAN, out=normalized)
+        np.multiply(normalized, PIXEL_INV_STD, out=normalized)
+        inputs = self._inputs[bucket]
+        inputs[:n] = normalized.transpose(0, 3, 1, 2)
+        return self.session.run(None, {self.input_name: inputs})[0][:n].astype(np.float32)
+
+
+def get_reid_extractor(model_path):
+    """Extractor dùng chung theo đường dẫn model, tạo một lần cho mỗi process"""
+    with _extractors_lock:
+        if model_path not in _extractors:
+            _extractors[model_path] = ReIDFeatureExtractor(model_path)
+        return _extractors[model_path]
@@ -0,0 +1,108 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "64"))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", "3600"))
+
+
+def content_key(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class SearchImageEntry:
+    def __init__(self, image_bytes):
+        self.image_bytes = image_bytes
+        self.box = None
+        self.features = None
+        self.error = None
+        self.computed = False
+        self.lock = threading.Lock()
+        self.last_access = time.monotonic()
+
+
+class SearchImageCache:
+    """Ảnh tìm kiếm lưu một lần theo hash nội dung, kèm box đã phát hiện và embedding chuẩn hóa.
+
+    Nhiều camera (hoặc nhiều phiên) dùng cùng một ảnh chỉ giải mã, chạy YOLO và ReID
+    cho ảnh truy vấn một lần. Kho bị giới hạn theo LRU (SEARCH_CACHE_MAX_ENTRIES) và TTL
+    tính từ lần truy cập cuối (SEARCH_CACHE_TTL_SECONDS).
+    """
+
+    def __init__(self, max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl_seconds=SEARCH_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, image_bytes):
+        """Lưu ảnh (nếu chưa có) và trả về khóa hash"""
+        key = content_key(image_bytes)
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = SearchImageEntry(image_bytes)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                entry.last_access = time.monotonic()
+                self._entries.move_to_end(key)
+        return key
+
+    def get_bytes(self, key):
+        entry = self._get(key)
+        return entry.image_bytes if entry is not None else None
+
+    def features(self, image_bytes, extract):
+        """Trả về (box, features, error) cho ảnh, chỉ tính một lần cho mỗi nội dung.
+
+        extract(query_img) -> (box, features, error) chạy phát hiện và ReID trên ảnh đã giải mã.
+        """
+        key = self.put(image_bytes)
+        entry = self._get(key)
+        if entry is None:  # Vừa bị đẩy ra ngay sau khi thêm (max_entries = 0)
+            entry = SearchImageEntry(image_bytes)
+        # Khóa riêng từng mục: các camera cùng ảnh chờ nhau thay vì tính lặp
+        with entry.lock:
+            if not entry.computed:
+                query_img = cv2.imdecode(np.frombuffer(entry.image_bytes, np.uint8), cv2.IMREAD_COLOR)
+                if query_img is None:
+                    entry.error = "Cannot read image"
+                else:
+                    entry.box, entry.features, entry.error = extract(query_img)
+                    if entry.features is not None:
+                        entry.features = np.asarray(entry.features, dtype=np.float32)
+                        entry.features.setflags(write=False)
+                entry.computed = True
+        return entry.box, entry.features, entry.error
+
+    def _get(self, key):
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_access = time.monotonic()
+                self._entries.move_to_end(key)
+            return entry
+
+    def _evict_expired(self):
+        if self.ttl_seconds is None:
+            return
+        now = time.monotonic()
+        # OrderedDict theo thứ tự truy cập: mục cũ nhất ở đầu
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.last_access <= self.ttl_seconds:
+                break
+            del self._entries[key]
+
+
+search_image_cache = SearchImageCache()
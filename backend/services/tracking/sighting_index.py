@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import datetime, timedelta
+import cv2
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # FAISS là tùy chọn; không có thì tìm bằng NumPy trên memmap
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+SIGHTING_INDEX_ENABLED = os.getenv("SIGHTING_INDEX_ENABLED", "0") == "1"
+SIGHTING_INDEX_DIR = os.getenv("SIGHTING_INDEX_DIR", "sightings")
+SIGHTING_FLUSH_SECONDS = float(os.getenv("SIGHTING_FLUSH_SECONDS", "30"))
+SIGHTING_MIN_FRAMES = 5  # Track ngắn hơn mức này thường là nhiễu, không lưu
+SIGHTING_DIM = 512
+CROP_MAX_HEIGHT = 160  # Crop lưu kèm chỉ để hiển thị, thu nhỏ cho gọn
+
+EMBEDDINGS_FILE = "embeddings.f32"
+META_FILE = "meta.jsonl"
+INDEX_FILE = "index.faiss"
+CROPS_DIR = "crops"
+DAY_FORMAT = "%Y-%m-%d"
+CROP_NAME_PATTERN = re.compile(r"^[\w\-]+\.jpg$")
+
+
+def day_of(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime(DAY_FORMAT)
+
+
+def shard_path(root, day, camera_id):
+    return os.path.join(root, day, f"cam_{camera_id}")
+
+
+class TrackSightingRecorder:
+    """Theo dõi khoảng thời gian, lớp và crop tốt nhất của các track trên một camera.
+
+    Khi track kết thúc, một embedding duy nhất (trung bình của TrackEmbeddingCache)
+    được gửi vào SightingIndex cùng metadata.
+    """
+
+    def __init__(self, camera_id, index):
+        self.camera_id = camera_id
+        self.index = index
+        self.tracks = {}
+
+    def observe(self, frame, track_ids, bboxes, class_ids, refreshed):
+        """refreshed: tập chỉ số track vừa trích xuất ReID, chỉ khi đó mới xét chụp crop mới"""
+        now = time.time()
+        for i, (tid, box, cls) in enumerate(zip(track_ids, bboxes, class_ids)):
+            record = self.tracks.get(tid)
+            if record is None:
+                record = self.tracks[tid] = {"start": now, "end": now, "frames": 0, "cls": int(cls),
+                                             "best_area": 0.0, "crop": None}
+            record["end"] = now
+            record["frames"] += 1
+            if i in refreshed:
+                x1, y1, x2, y2 = map(int, box)
+                area = max(0, x2 - x1) * max(0, y2 - y1)
+                if area > record["best_area"]:
+                    crop = frame[max(0, y1):max(0, y2), max(0, x1):max(0, x2)]
+                    if crop.size:
+                        record["best_area"] = area
+                        record["crop"] = crop.copy()
+
+    def complete(self, track_id, embedding, global_id=None):
+        record = self.tracks.pop(track_id, None)
+        if record is None or embedding is None or record["frames"] < SIGHTING_MIN_FRAMES:
+            return
+        self.index.add(self.camera_id, track_id, global_id, embedding, record["start"], record["end"],
+                       record["cls"], record["crop"])
+
+    def close(self, embeddings):
+        """Kết thúc mọi track còn mở (stream dừng); embeddings: track_id -> embedding"""
+        for tid in list(self.tracks):
+            self.complete(tid, embeddings.get(tid))
+
+
+class SightingShard:
+    """Shard chỉ đọc của một ngày + một camera, embedding nạp bằng memmap"""
+
+    def __init__(self, path, dim=SIGHTING_DIM):
+        self.path = path
+        self.dim = dim
+        self.loaded_size = -1
+        self.meta = []
+        self.embeddings = np.empty((0, dim), dtype=np.float32)
+        self.starts = np.empty(0)
+        self.ends = np.empty(0)
+        self.index = None
+
+    def refresh(self):
+        meta_path = os.path.join(self.path, META_FILE)
+        emb_path = os.path.join(self.path, EMBEDDINGS_FILE)
+        if not os.path.exists(meta_path) or not os.path.exists(emb_path):
+            return
+        size = os.path.getsize(meta_path)
+        if size == self.loaded_size:
+            return
+        meta = []
+        with open(meta_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    meta.append(json.loads(line))
+                except json.JSONDecodeError:  # Dòng cuối có thể đang được ghi dở
+                    break
+        rows = os.path.getsize(emb_path) // (self.dim * 4)
+        n = min(rows, len(meta))
+        self.meta = meta[:n]
+        self.embeddings = (np.memmap(emb_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+                           if n else np.empty((0, self.dim), dtype=np.float32))
+        self.starts = np.array([m["start"] for m in self.meta], dtype=np.float64)
+        self.ends = np.array([m["end"] for m in self.meta], dtype=np.float64)
+        self.index = None
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if faiss is not None and os.path.exists(index_path):
+            index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            if index.ntotal == n:
+                self.index = index
+        self.loaded_size = size
+
+    def search(self, query, start_time, end_time, top_k):
+        """Trả về [(similarity, meta)] của các sighting giao với [start_time, end_time]"""
+        n = len(self.meta)
+        if n == 0:
+            return []
+        in_window = (self.ends >= start_time) & (self.starts <= end_time)
+        if not in_window.any():
+            return []
+        if self.index is not None and in_window.all():
+            sims, rows = self.index.search(query[None, :], min(top_k, n))
+            return [(float(s), self.meta[r]) for s, r in zip(sims[0], rows[0]) if r >= 0]
+        rows = np.flatnonzero(in_window)
+        sims = self.embeddings[rows] @ query
+        if len(rows) > top_k:
+            best = np.argpartition(-sims, top_k)[:top_k]
+            rows, sims = rows[best], sims[best]
+        return [(float(s), self.meta[r]) for s, r in zip(sims, rows)]
+
+
+class SightingIndex:
+    """Chỉ mục ReID lưu đĩa cho tìm kiếm hồi cứu, mỗi track đã kết thúc là một embedding.
+
+    Dữ liệu chia shard theo ngày và camera: SIGHTING_INDEX_DIR/<ngày>/cam_<id>/ gồm
+    embeddings.f32 (ma trận float32 nối thêm), meta.jsonl, index.faiss (nếu có FAISS)
+    và crops/. Việc ghi chạy trên một luồng nền, gom theo lô mỗi SIGHTING_FLUSH_SECONDS;
+    shard được đọc bằng memmap và chỉ nạp lại khi có dữ liệu mới.
+    """
+
+    def __init__(self, root=SIGHTING_INDEX_DIR, enabled=SIGHTING_INDEX_ENABLED, dim=SIGHTING_DIM,
+                 flush_seconds=SIGHTING_FLUSH_SECONDS):
+        self.root = root
+        self.enabled = enabled
+        self.dim = dim
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue()
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def recorder(self, camera_id):
+        """Recorder cho một luồng camera, None nếu chỉ mục bị tắt"""
+        return TrackSightingRecorder(camera_id, self) if self.enabled else None
+
+    def add(self, camera_id, track_id, global_id, embedding, start, end, cls, crop=None):
+        if not self.enabled:
+            return
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        embedding = embedding / (np.linalg.norm(embedding) + 1e-8)
+        self._queue.put((camera_id, track_id, global_id, embedding, start, end, cls, crop))
+        self._ensure_writer()
+
+    def search(self, query, start_time, end_time, camera_ids=None, top_k=20, min_similarity=0.0):
+        """Sighting quá khứ xếp theo độ tương đồng giảm dần"""
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        query = query / (np.linalg.norm(query) + 1e-8)
+        hits = []
+        for shard in self._shards_in_window(start_time, end_time, camera_ids):
+            hits.extend(shard.search(query, start_time, end_time, top_k))
+        hits = [(sim, meta) for sim, meta in hits if sim >= min_similarity]
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [dict(meta, similarity=round(sim, 4)) for sim, meta in hits[:top_k]]
+
+    def crop_path(self, day, camera_id, crop_name):
+        """Đường dẫn crop đã kiểm tra, None nếu tên không hợp lệ hoặc không tồn tại"""
+        try:
+            datetime.strptime(day, DAY_FORMAT)
+        except ValueError:
+            return None
+        if not CROP_NAME_PATTERN.match(crop_name):
+            return None
+        path = os.path.join(shard_path(self.root, day, int(camera_id)), CROPS_DIR, crop_name)
+        return path if os.path.exists(path) else None
+
+    def _shards_in_window(self, start_time, end_time, camera_ids):
+        day = datetime.fromtimestamp(start_time).date()
+        last_day = datetime.fromtimestamp(end_time).date()
+        wanted = None if camera_ids is None else {f"cam_{cid}" for cid in camera_ids}
+        while day <= last_day:
+            day_dir = os.path.join(self.root, day.strftime(DAY_FORMAT))
+            if os.path.isdir(day_dir):
+                for name in os.listdir(day_dir):
+                    if wanted is not None and name not in wanted:
+                        continue
+                    yield self._shard(os.path.join(day_dir, name))
+            day += timedelta(days=1)
+
+    def _shard(self, path):
+        with self._shards_lock:
+            shard = self._shards.get(path)
+            if shard is None:
+                shard = self._shards[path] = SightingShard(path, self.dim)
+            shard.refresh()
+            return shard
+
+    def _ensure_writer(self):
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, daemon=True, name="sighting-index-writer")
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._flush(batch)
+            except Exception as e:
+                logger.error(f"Failed to persist {len(batch)} sightings: {e}")
+
+    def _flush(self, batch):
+        by_shard = {}
+        for item in batch:
+            camera_id, start = item[0], item[4]
+            by_shard.setdefault(shard_path(self.root, day_of(start), camera_id), []).append(item)
+        for path, items in by_shard.items():
+            os.makedirs(os.path.join(path, CROPS_DIR), exist_ok=True)
+            metas = []
+            for camera_id, track_id, global_id, embedding, start, end, cls, crop in items:
+                crop_name = None
+                if crop is not None:
+                    crop_name = f"{int(start * 1000)}_{track_id}.jpg"
+                    if crop.shape[0] > CROP_MAX_HEIGHT:
+                        scale = CROP_MAX_HEIGHT / crop.shape[0]
+                        crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), CROP_MAX_HEIGHT),
+                                          interpolation=cv2.INTER_AREA)
+                    cv2.imwrite(os.path.join(path, CROPS_DIR, crop_name), crop)
+                metas.append({
+                    "cameraId": camera_id,
+                    "trackId": int(track_id),
+                    "globalId": None if global_id is None else int(global_id),
+                    "start": start,
+                    "end": end,
+                    "classId": cls,
+                    "day": os.path.basename(os.path.dirname(path)),
+                    "crop": crop_name,
+                })
+            # Embedding ghi trước metadata: reader lấy min(số dòng, số meta) nên luôn nhất quán
+            with open(os.path.join(path, EMBEDDINGS_FILE), "ab") as f:
+                f.write(np.stack([item[3] for item in items]).astype(np.float32).tobytes())
+            with open(os.path.join(path, META_FILE), "a", encoding="utf-8") as f:
+                for meta in metas:
+                    f.write(json.dumps(meta) + "\n")
+            if faiss is not None:
+                self._write_faiss_index(path)
+        logger.info(f"Persisted {len(batch)} sightings to {len(by_shard)} shards")
+
+    def _write_faiss_index(self, path):
+        emb_path = os.path.join(path, EMBEDDINGS_FILE)
+        rows = os.path.getsize(emb_path) // (self.dim * 4)
+        index = faiss.IndexFlatIP(self.dim)
+        index.add(np.ascontiguousarray(np.memmap(emb_path, dtype=np.float32, mode="r", shape=(rows, self.dim))))
+        tmp_path = os.path.join(path, INDEX_FILE + ".tmp")
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, os.path.join(path, INDEX_FILE))
+
+
+sighting_index = SightingIndex()
@@ -1,9 +1,15 @@
 import os
 import cv2
 import numpy as np
-from ultralytics import YOLO
-import onnxruntime as ort
 from services.tracking.byte_tracker import BYTETracker
+from services.tracking.reid_gallery import ReIDGallery
+from services.tracking.embedding_cache import TrackEmbeddingCache
+from services.tracking.reid_model import get_reid_extractor
+from services.tracking.search_image_cache import search_image_cache
+from services.tracking.sighting_index import sighting_index
+from services.inference.detector import SharedDetector
+from services.inference.model_tier import TieredDetector
+from services.inference.budget_scheduler import inference_scheduler
 from typing import Optional
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
@@ -24,71 +30,39 @@ TARGET_IDS = [2, 5, 7]  # car, bus, truck
 HARDCODED_IMAGE_PATH = r"D:\multi_camera_tracking\videos\screenshot_1754414441.png"
 
 # Load models
-model_vehicle = YOLO("yolov8m.pt")
+model_vehicle = SharedDetector("yolov8m.pt")
 reid_model_path = "osnet_ain_x1_0_vehicle_reid_optimized.onnx"
 
 class VehicleReID0001:
     def __init__(self, model_path, score_th=0.5):
         self.score_th = score_th
-        self.session = ort.InferenceSession(model_path, providers=["CUDAExecutionProvider"])
-        self.input_name = self.session.get_inputs()[0].name
-        self.gallery = {}  # {global_id: feature}
+        # Session ONNX dùng chung cho cả process; gallery vẫn riêng cho mỗi instance
+        self.extractor = get_reid_extractor(model_path)
+        self.gallery = ReIDGallery(score_th=score_th)
 
     def extract_features(self, image, bboxes):
-        crops = []
-        for box in bboxes:
-            x1, y1, x2, y2 = map(int, box)
-            crop = image[y1:y2, x1:x2]
-            if crop.size == 0:
-                crop = np.zeros((256, 128, 3), dtype=np.uint8)
-            else:
-                crop = cv2.resize(crop, (128, 256))
-            crop = crop.astype(np.float32)
-            crop -= np.array([123.675, 116.28, 103.53], dtype=np.float32)
-            crop /= np.array([58.395, 57.12, 57.375], dtype=np.float32)
-            crop = crop.transpose(2, 0, 1)
-            crops.append(crop)
-
-        if not crops:
-            return np.empty((0, 512), dtype=np.float32)
-        inputs = np.stack(crops).astype(np.float32)
-        feats = self.session.run(None, {self.input_name: inputs})[0]
-        feats /= np.linalg.norm(feats, axis=1, keepdims=True) + 1e-8
-        return feats
+        return self.extractor.extract(image, bboxes)
 
     def match_or_register(self, features):
-        ids = []
-        for feat in features:
-            matched_id = None
-            best_sim = 0
-            for gid, gfeat in self.gallery.items():
-                sim = np.dot(feat, gfeat)
-                if sim > self.score_th and sim > best_sim:
-                    matched_id = gid
-                    best_sim = sim
-
-            if matched_id is None:
-                new_id = len(self.gallery)
-                self.gallery[new_id] = feat
-                matched_id = new_id
-            ids.append(matched_id)
-        return ids
+        return self.gallery.match_or_register(features)
+
+    def touch(self, gids):
+        self.gallery.touch(gids)
 
 class ByteTrackWrapper:
-    def __init__(self, track_thresh=0.3, match_thresh=0.9):
-        self.tracker = BYTETracker(track_thresh=track_thresh, match_thresh=match_thresh)
+    def __init__(self, track_thresh=0.3, match_thresh=0.8, track_buffer=30, frame_rate=30):
+        self.tracker = BYTETracker(track_thresh=track_thresh, match_thresh=match_thresh,
+                                   track_buffer=track_buffer, frame_rate=frame_rate)
 
     def update(self, bboxes, scores, class_ids, img_info):
-        outputs = []
+        # Luôn cập nhật tracker, kể cả frame không có detection, để track bị mất được tính tuổi đúng
         if len(bboxes) > 0:
-            detections = np.hstack((bboxes, np.array(scores).reshape(-1, 1), np.array(class_ids).reshape(-1, 1)))
-            online_targets = self.tracker.update(detections, img_info)
-            for t in online_targets:
-                tlwh = t.tlwh
-                x1, y1, w, h = tlwh
-                x2, y2 = x1 + w, y1 + h
-                outputs.append((t.track_id, [x1, y1, x2, y2], t.score, int(t.cls)))
-        return outputs
+            detections = np.hstack((np.asarray(bboxes).reshape(-1, 4), np.array(scores).reshape(-1, 1), np.array(class_ids).reshape(-1, 1)))
+        else:
+            detections = np.zeros((0, 6))
+        online_targets = self.tracker.update_array(detections)
+        return [(int(tid), [x1, y1, x1 + w, y1 + h], score, int(cls))
+                for x1, y1, w, h, tid, score, cls in online_targets.tolist()]
 
 class VehicleInfo(BaseModel):
     brand: Optional[str] = None
@@ -138,6 +112,10 @@ def fetch_camera_config(camera_id: int, db: Session):
     camera = db.query(Camera).filter(Camera.id == camera_id).first()
     if not camera:
         raise ValueError(f"Camera {camera_id} not found in database")
+    return camera_config_from_row(camera)
+
+def camera_config_from_row(camera: Camera):
+    """Chép các trường cần dùng ra dict để luồng stream không giữ session DB của request"""
     return {
         "id": camera.id,
         "name": camera.name,
@@ -145,9 +123,79 @@ def fetch_camera_config(camera_id: int, db: Session):
         "stream_url": camera.stream_url,
     }
 
-def stream_vehicle_tracking_service(camera_id: int,  search_image: Optional[bytes], db: Session):
+def extract_query_features(query_img, reid):
+    """Trích đặc trưng của xe có điểm cao nhất trong ảnh truy vấn, trả về (box, features, error)"""
+    results_query = model_vehicle.detect(query_img, conf=YOLO_SCORE_TH, iou=0.45, device='cuda' if torch.cuda.is_available() else 'cpu')
+    boxes_query, scores_query, class_ids_query = extract_boxes(results_query, TARGET_IDS)
+    if not boxes_query:
+        return None, None, "No vehicles detected"
+    selected_box = boxes_query[int(np.argmax(scores_query))]
+    logger.info(f"Selected box for feature extraction: {selected_box}")
+    feats_query = reid.extract_features(query_img, [selected_box])
+    if len(feats_query) == 0:
+        return selected_box, None, "No features extracted"
+    search_features = feats_query[0]
+    search_features /= np.linalg.norm(search_features, axis=0, keepdims=True) + 1e-8
+    return selected_box, search_features, None
+
+def load_search_features(search_image: Optional[bytes], reid, camera_id):
+    """Đặc trưng truy vấn từ ảnh tải lên, nếu không có thì từ ảnh cứng.
+
+    Kết quả được cache theo hash nội dung ảnh nên các camera dùng cùng ảnh chỉ tính một lần.
+    """
+    search_features = None
+    search_error = None
+    extract = lambda query_img: extract_query_features(query_img, reid)
+    if search_image is None:
+        logger.info(f"No search image provided for camera {camera_id}, using hardcoded image")
+    if search_image:
+        logger.info(f"Processing search image for camera {camera_id}")
+        _, search_features, error = search_image_cache.features(search_image, extract)
+        if error:
+            search_error = f"{error} in search image for camera {camera_id}"
+            logger.warning(search_error)
+        else:
+            logger.info(f"Search image features ready for camera {camera_id}")
+
+    # Nếu không có search_image, thử ảnh cứng
+    if search_features is None:
+        try:
+            logger.info(f"Attempting to read hardcoded image for camera {camera_id}: {HARDCODED_IMAGE_PATH}")
+            if not os.path.exists(HARDCODED_IMAGE_PATH):
+                search_error = f"Hardcoded image path does not exist: {HARDCODED_IMAGE_PATH}"
+                logger.error(search_error)
+            else:
+                with open(HARDCODED_IMAGE_PATH, "rb") as f:
+                    hardcoded_image = f.read()
+                logger.info(f"Processing hardcoded image for camera {camera_id}")
+                _, search_features, error = search_image_cache.features(hardcoded_image, extract)
+                if error:
+                    search_error = f"{error} in hardcoded image for camera {camera_id}: {HARDCODED_IMAGE_PATH}"
+                    logger.error(search_error)
+                else:
+                    logger.info(f"Hardcoded image features ready for camera {camera_id}")
+        except Exception as e:
+            search_error = f"Error processing hardcoded image for camera {camera_id}: {str(e)}"
+            logger.error(search_error)
+    return search_features, search_error
+
+_query_reid = None
+
+def search_past_sightings(search_image: bytes, start_time: float, end_time: float, camera_ids=None, top_k=20):
+    """Tìm các lần xe trong ảnh truy vấn đã xuất hiện trong khoảng thời gian, từ chỉ mục lưu đĩa"""
+    global _query_reid
+    if _query_reid is None:
+        _query_reid = VehicleReID0001(reid_model_path, score_th=REID_SCORE_TH)
+    box, search_features, error = search_image_cache.features(
+        search_image, lambda query_img: extract_query_features(query_img, _query_reid))
+    if error:
+        raise ValueError(f"{error} in search image")
+    return sighting_index.search(search_features, start_time, end_time, camera_ids=camera_ids,
+                                 top_k=top_k, min_similarity=REID_SCORE_TH)
+
+def stream_vehicle_tracking_service(camera_config: dict, search_image: Optional[bytes]):
+    camera_id = camera_config["id"]
     try:
-        camera_config = fetch_camera_config(camera_id, db)
         logger.info(f"Starting tracking stream for camera {camera_id}: {camera_config['name']}")
         stream_url = get_stream_url(camera_config["stream_url"])
         cap = cv2.VideoCapture(stream_url)
@@ -160,75 +208,15 @@ def stream_vehicle_tracking_service(camera_id: int,  search_image: Optional[byte
 
         # Khởi tạo instance riêng cho mỗi camera
         reid = VehicleReID0001(reid_model_path, score_th=REID_SCORE_TH)
-        tracker = ByteTrackWrapper(track_thresh=0.3, match_thresh=0.9)
+        tracker = ByteTrackWrapper(track_thresh=0.3, match_thresh=0.8)
         local_to_global_id = {}  # Dictionary riêng cho mỗi camera
+        embedding_cache = TrackEmbeddingCache()  # Embedding trung bình theo track
+        budget_key = f"tracking:{camera_id}"
+        inference_scheduler.register(budget_key)  # Ngân sách fps của luồng là mốc để TieredDetector chọn bậc model
+        detector = TieredDetector(budget_key)  # Model theo bậc tải cho luồng này
+        sightings = sighting_index.recorder(camera_id)  # None nếu không lưu chỉ mục hồi cứu
 
-        search_features = None
-        search_error = None
-        # Xử lý ảnh tìm kiếm
-        if search_image is None:
-            logger.info(f"No search image provided for camera {camera_id}, using hardcoded image")
-        if search_image:
-            query_img = cv2.imdecode(np.frombuffer(search_image, np.uint8), cv2.IMREAD_COLOR)
-            if query_img is None:
-                search_error = f"Cannot read search image for camera {camera_id}"
-                logger.warning(search_error)
-            else:
-                logger.info(f"Processing search image for camera {camera_id}")
-                results_query = model_vehicle.predict(query_img, conf=YOLO_SCORE_TH, iou=0.45, device='cuda' if torch.cuda.is_available() else 'cpu')[0]
-                boxes_query, scores_query, class_ids_query = extract_boxes(results_query, TARGET_IDS)
-                logger.info(f"Search image: {len(boxes_query)} vehicles detected for camera {camera_id}")
-                if boxes_query:
-                    max_score_idx = np.argmax(scores_query)
-                    selected_box = boxes_query[max_score_idx]
-                    logger.info(f"Selected box for feature extraction: {selected_box}")
-                    feats_query = reid.extract_features(query_img, [selected_box])
-                    if len(feats_query) > 0:
-                        search_features = feats_query[0]
-                        search_features /= np.linalg.norm(search_features, axis=0, keepdims=True) + 1e-8
-                        logger.info(f"Search image features extracted successfully for camera {camera_id}")
-                    else:
-                        search_error = f"No features extracted from search image for camera {camera_id}"
-                        logger.warning(search_error)
-                else:
-                    search_error = f"No vehicles detected in search image for camera {camera_id}"
-                    logger.warning(search_error)
-
-        # Nếu không có search_image, thử ảnh cứng
-        if search_features is None:
-            try:
-                logger.info(f"Attempting to read hardcoded image for camera {camera_id}: {HARDCODED_IMAGE_PATH}")
-                if not os.path.exists(HARDCODED_IMAGE_PATH):
-                    search_error = f"Hardcoded image path does not exist: {HARDCODED_IMAGE_PATH}"
-                    logger.error(search_error)
-                else:
-                    query_img = cv2.imread(HARDCODED_IMAGE_PATH)
-                    if query_img is None:
-                        search_error = f"Cannot read hardcoded image for camera {camera_id}: {HARDCODED_IMAGE_PATH}"
-                        logger.error(search_error)
-                    else:
-                        logger.info(f"Processing hardcoded image for camera {camera_id}")
-                        results_query = model_vehicle.predict(query_img, conf=YOLO_SCORE_TH, iou=0.45, device='cuda' if torch.cuda.is_available() else 'cpu')[0]
-                        boxes_query, scores_query, class_ids_query = extract_boxes(results_query, TARGET_IDS)
-                        logger.info(f"Hardcoded image: {len(boxes_query)} vehicles detected for camera {camera_id}")
-                        if boxes_query:
-                            max_score_idx = np.argmax(scores_query)
-                            selected_box = boxes_query[max_score_idx]
-                            logger.info(f"Selected box for feature extraction: {selected_box}")
-                            feats_query = reid.extract_features(query_img, [selected_box])
-                            if len(feats_query) > 0:
-                                search_features = feats_query[0]
-                                search_features /= np.linalg.norm(search_features, axis=0, keepdims=True) + 1e-8
-                                logger.info(f"Hardcoded image features extracted successfully for camera {camera_id}")
-                            else:
-                                search_error = f"No features extracted from hardcoded image for camera {camera_id}"
-                                logger.error(search_error)
-                        else:
-                            search_error = f"No vehicles detected in hardcoded image for camera {camera_id}"
-                            logger.error(search_error)
-            except Exception as e:
-                search_error = f"Error processing hardcoded image for camera {camera_id}: {str(e)}"
-                logger.error(search_error)
+        search_features, search_error = load_search_features(search_image, reid, camera_id)
 
         h, w = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         frame_idx = 0
@@ -244,41 +232,57 @@ def stream_vehicle_tracking_service(camera_id: int,  search_image: Optional[byte
                 continue
 
             logger.info(f"[INFO] Processing frame {frame_idx} for camera {camera_id}")
-            results = model_vehicle.predict(frame, conf=YOLO_SCORE_TH, iou=0.45, device='cuda' if torch.cuda.is_available() else 'cpu')[0]
+            results = detector.detect(frame, conf=YOLO_SCORE_TH, iou=0.45, classes=TARGET_IDS, device='cuda' if torch.cuda.is_available() else 'cpu')
             boxes, scores, class_ids = extract_boxes(results, TARGET_IDS)
             logger.info(f"Frame {frame_idx}: {len(boxes)} objects detected")
 
-            tracks = tracker.update(np.array(boxes), scores, class_ids, (h, w)) if boxes else []
+            tracks = tracker.update(np.array(boxes), scores, class_ids, (h, w))
             logger.info(f"Frame {frame_idx}: {len(tracks)} tracks generated")
 
             highlight_track_ids = set()
             similarities = {}
             if tracks:
+                track_ids = [t[0] for t in tracks]
                 bboxes = [t[1] for t in tracks]
-                feats = reid.extract_features(frame, bboxes)
-                logger.info(f"Frame {frame_idx}: {len(feats)} features extracted, gallery size: {len(reid.gallery)}")
+                # Chỉ trích xuất cho track mới hoặc khi chất lượng crop tốt hơn đáng kể
+                refresh = embedding_cache.select_for_refresh(frame, track_ids, bboxes, frame_idx)
+                if refresh:
+                    new_feats = reid.extract_features(frame, [bboxes[i] for i, _, _ in refresh])
+                    for (i, area, sharpness), feat in zip(refresh, new_feats):
+                        embedding_cache.update(track_ids[i], feat, area, sharpness, frame_idx)
+                if sightings is not None:
+                    sightings.observe(frame, track_ids, bboxes, [t[3] for t in tracks], {i for i, _, _ in refresh})
+                feats = embedding_cache.embeddings(track_ids)
+                logger.info(f"Frame {frame_idx}: {len(refresh)}/{len(tracks)} features extracted, gallery size: {len(reid.gallery)}")
+                # Ghép một lần cho mọi track mới trong frame
+                new_idx = [i for i, t in enumerate(tracks) if f"{camera_id}_{t[0]}" not in local_to_global_id]
+                if new_idx:
+                    new_gids = reid.match_or_register(feats[new_idx])
+                    for i, gid in zip(new_idx, new_gids):
+                        local_to_global_id[f"{camera_id}_{tracks[i][0]}"] = gid
+                # Xe vẫn trong khung hình: làm mới mục gallery của nó
+                reid.touch([local_to_global_id[f"{camera_id}_{t[0]}"] for t in tracks])
                 for i, (tid, box, score, cls) in enumerate(tracks):
                     key = f"{camera_id}_{tid}"  # Sử dụng camera_id để đảm bảo key duy nhất
-                    if key not in local_to_global_id:
-                        gid = reid.match_or_register([feats[i]])[0]
-                        local_to_global_id[key] = gid
-                    else:
-                        gid = local_to_global_id[key]
+                    gid = local_to_global_id[key]
                     if search_features is not None:
                         sim = np.dot(feats[i], search_features)
                         similarities[gid] = sim
                         if sim > 0.66:
                             highlight_track_ids.add(gid)
                     tracks[i] = (gid, box, score, cls)
+            for tid, entry in embedding_cache.prune(frame_idx).items():
+                gid = local_to_global_id.pop(f"{camera_id}_{tid}", None)
+                if sightings is not None:
+                    sightings.complete(tid, entry.mean, gid)
             if search_features is None and search_error:
                 logger.info(f"Frame {frame_idx}: Search error - {search_error}")
 
+            inference_scheduler.report_activity(budget_key, tracked=len(tracks),
+                                                pending_violations=len(highlight_track_ids))
             debug_frame = draw_debug(frame, tracks, highlight_track_ids, similarities, camera_name=camera_config["name"], search_error=search_error)
-            _, jpeg = cv2.imencode('.jpg', debug_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
-            )
+            detector.frame_done()
+            yield debug_frame  # Mã hóa JPEG theo từng người xem do live stream đảm nhận
 
             frame_idx += 1
 
@@ -289,4 +293,9 @@ def stream_vehicle_tracking_service(camera_id: int,  search_image: Optional[byte
     finally:
         if 'cap' in locals():
             cap.release()
+        if 'detector' in locals():
+            detector.close()
+            inference_scheduler.unregister(budget_key)
+        if locals().get('sightings') is not None:
+            sightings.close({tid: entry.mean for tid, entry in embedding_cache.entries.items()})
         logger.info(f"Stream cleanup completed for camera {camera_id}")
\ No newline at end of file
@@ -0,0 +1,299 @@
+import threading
+import time
+import logging
+from collections import deque
+import cv2
+import numpy as np
+import torch
+from services.tracking.tracking_service import (
+    VehicleReID0001,
+    ByteTrackWrapper,
+    reid_model_path,
+    extract_boxes,
+    draw_debug,
+    load_search_features,
+    YOLO_SCORE_TH,
+    REID_SCORE_TH,
+    TARGET_IDS,
+)
+from services.tracking.embedding_cache import TrackEmbeddingCache
+from services.tracking.sighting_index import sighting_index
+from services.inference.budget_scheduler import inference_scheduler
+from services.inference.model_tier import TieredDetector
+from services.streaming.live_stream import LiveFrame, FrameDecimator, MJPEG_QUALITY
+from utils.yt_stream import get_stream_url
+
+logger = logging.getLogger(__name__)
+
+MATCH_SIM_TH = 0.66  # Ngưỡng tương đồng với ảnh truy vấn để coi là xe mục tiêu
+MAX_EVENTS = 500  # Số sự kiện giữ lại cho mỗi phiên
+SESSION_IDLE_TIMEOUT = 120  # Phiên không còn ai xem quá lâu sẽ tự dừng (giây)
+FRAME_WAIT_TIMEOUT = 5.0
+
+
+class CameraFeed:
+    """Frame đã chú thích mới nhất của một camera trong phiên; mỗi biến thể chỉ mã hóa một lần cho mọi người xem"""
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.frame = None
+        self.seq = 0
+        self.condition = threading.Condition()
+
+    def publish(self, frame):
+        with self.condition:
+            self.seq += 1
+            self.frame = LiveFrame(frame, self.seq)
+            self.condition.notify_all()
+
+    def wait_next(self, last_seq, timeout=FRAME_WAIT_TIMEOUT):
+        """Chờ frame mới hơn last_seq, trả về (LiveFrame, seq); frame = None nếu hết thời gian chờ"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > last_seq, timeout=timeout):
+                return None, last_seq
+            return self.frame, self.seq
+
+
+class TrackingSession:
+    """Một phiên truy vết nhiều camera.
+
+    Phiên sở hữu tất cả camera của nó: detector và session ReID dùng chung cho cả process,
+    một gallery ReID chung giữa các camera (cùng một xe giữ cùng global ID khi đi qua
+    camera khác) và một đặc trưng truy vấn tính một lần. Mỗi camera có một luồng xử lý;
+    các luồng MJPEG chỉ đăng ký nhận frame đã chú thích thay vì chạy lại pipeline.
+    """
+
+    def __init__(self, session_id, cameras, search_image=None):
+        self.session_id = session_id
+        self.cameras = {camera["id"]: camera for camera in cameras}
+        self.feeds = {camera_id: CameraFeed(camera) for camera_id, camera in self.cameras.items()}
+        self.reid = VehicleReID0001(reid_model_path, score_th=REID_SCORE_TH)
+        self.gallery_lock = threading.Lock()
+        self.search_features, self.search_error = load_search_features(search_image, self.reid, session_id)
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.event_seq = 0
+        self.events_lock = threading.Lock()
+        # global_id -> camera_id nơi xe được thấy gần nhất
+        self.last_camera_by_gid = {}
+        self.started_at = time.time()
+        self.last_access = time.monotonic()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def start(self):
+        for camera_id in self.cameras:
+            thread = threading.Thread(target=self._run_camera, args=(camera_id,), daemon=True,
+                                      name=f"{self.session_id}-cam{camera_id}")
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Tracking session {self.session_id} started with {len(self.cameras)} cameras")
+
+    def stop(self):
+        self._stop.set()
+        for feed in self.feeds.values():
+            with feed.condition:
+                feed.condition.notify_all()
+
+    def touch(self):
+        self.last_access = time.monotonic()
+
+    def idle_seconds(self):
+        return time.monotonic() - self.last_access
+
+    def subscribe(self, camera_id, quality=MJPEG_QUALITY, width=None, max_fps=None):
+        """Generator MJPEG cho một camera của phiên"""
+        feed = self.feeds[camera_id]
+        decimator = FrameDecimator(max_fps)
+        last_seq = 0
+        while self.running:
+            self.touch()
+            frame, last_seq = feed.wait_next(last_seq)
+            if frame is None or not decimator.accept():
+                continue
+            chunk = frame.chunk(quality, width)
+            if chunk:
+                yield chunk
+
+    def events_since(self, since=0):
+        self.touch()
+        with self.events_lock:
+            return [event for event in self.events if event["seq"] > since]
+
+    def info(self):
+        return {
+            "sessionId": self.session_id,
+            "cameraIds": list(self.cameras),
+            "status": "active" if self.running else "stopped",
+            "startTime": self.started_at,
+            "searchError": self.search_error,
+            "gallerySize": len(self.reid.gallery),
+            "eventCount": self.event_seq,
+        }
+
+    def _emit(self, event):
+        with self.events_lock:
+            self.event_seq += 1
+            event["seq"] = self.event_seq
+            self.events.append(event)
+
+    def _assign_global_ids(self, feats, new_idx):
+        with self.gallery_lock:
+            return self.reid.match_or_register(feats[new_idx])
+
+    def _touch_global_ids(self, gids):
+        with self.gallery_lock:
+            self.reid.touch(gids)
+
+    def _run_camera(self, camera_id):
+        camera = self.cameras[camera_id]
+        feed = self.feeds[camera_id]
+        budget_key = f"tracking:{self.session_id}:{camera_id}"
+        inference_scheduler.register(budget_key)
+        cap = None
+        embedding_cache = TrackEmbeddingCache()
+        sightings = sighting_index.recorder(camera_id)
+        detector = TieredDetector(budget_key)
+        try:
+            stream_url = get_stream_url(camera["stream_url"])
+            cap = cv2.VideoCapture(stream_url)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1000)
+            if not cap.isOpened():
+                logger.error(f"Session {self.session_id}: cannot open stream for camera {camera_id}")
+                return
+
+            tracker = ByteTrackWrapper(track_thresh=0.3, match_thresh=0.8)
+            local_to_global_id = {}
+            matched_gids = set()  # Global ID đang khớp truy vấn trên camera này
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            frame_idx = 0
+
+            while self.running:
+                if self.idle_seconds() > SESSION_IDLE_TIMEOUT:
+                    logger.info(f"Session {self.session_id} idle for {SESSION_IDLE_TIMEOUT}s, stopping")
+                    self.stop()
+                    break
+                ret, frame = cap.read()
+                if not ret or frame is None or frame.size == 0:
+                    cap.release()
+                    cap = cv2.VideoCapture(stream_url)
+                    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1000)
+                    time.sleep(0.5)
+                    continue
+                if frame_idx > 0 and not inference_scheduler.acquire(budget_key):
+                    continue
+
+                results = detector.detect(frame, conf=YOLO_SCORE_TH, iou=0.45, classes=TARGET_IDS, device=device)
+                boxes, scores, class_ids = extract_boxes(results, TARGET_IDS)
+                tracks = tracker.update(np.array(boxes), scores, class_ids, frame.shape[:2])
+
+                highlight_track_ids = set()
+                similarities = {}
+                if tracks:
+                    track_ids = [t[0] for t in tracks]
+                    bboxes = [t[1] for t in tracks]
+                    refresh = embedding_cache.select_for_refresh(frame, track_ids, bboxes, frame_idx)
+                    if refresh:
+                        new_feats = self.reid.extract_features(frame, [bboxes[i] for i, _, _ in refresh])
+                        for (i, area, sharpness), feat in zip(refresh, new_feats):
+                            embedding_cache.update(track_ids[i], feat, area, sharpness, frame_idx)
+                    if sightings is not None:
+                        sightings.observe(frame, track_ids, bboxes, [t[3] for t in tracks], {i for i, _, _ in refresh})
+                    feats = embedding_cache.embeddings(track_ids)
+                    new_idx = [i for i, tid in enumerate(track_ids) if tid not in local_to_global_id]
+                    if new_idx:
+                        for i, gid in zip(new_idx, self._assign_global_ids(feats, new_idx)):
+                            local_to_global_id[track_ids[i]] = gid
+                    self._touch_global_ids([local_to_global_id[tid] for tid in track_ids])
+                    sims = feats @ self.search_features if self.search_features is not None else None
+                    for i, (tid, box, score, cls) in enumerate(tracks):
+                        gid = local_to_global_id[tid]
+                        if sims is not None:
+                            similarities[gid] = float(sims[i])
+                            if sims[i] > MATCH_SIM_TH:
+                                highlight_track_ids.add(gid)
+                                if gid not in matched_gids:
+                                    self._record_match(camera, gid, float(sims[i]), box, cls)
+                        tracks[i] = (gid, box, score, cls)
+                matched_gids = highlight_track_ids
+                for tid, entry in embedding_cache.prune(frame_idx).items():
+                    gid = local_to_global_id.pop(tid, None)
+                    if sightings is not None:
+                        sightings.complete(tid, entry.mean, gid)
+                inference_scheduler.report_activity(budget_key, tracked=len(tracks),
+                                                    pending_violations=len(highlight_track_ids))
+
+                debug_frame = draw_debug(frame, tracks, highlight_track_ids, similarities,
+                                         camera_name=camera["name"], search_error=self.search_error)
+                feed.publish(debug_frame)
+                detector.frame_done()
+                frame_idx += 1
+        except Exception as e:
+            logger.error(f"Error in tracking session {self.session_id} for camera {camera_id}: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            if cap is not None:
+                cap.release()
+            if sightings is not None:
+                sightings.close({tid: entry.mean for tid, entry in embedding_cache.entries.items()})
+            inference_scheduler.unregister(budget_key)
+            detector.close()
+            logger.info(f"Session {self.session_id}: camera {camera_id} worker stopped")
+
+    def _record_match(self, camera, gid, similarity, box, cls):
+        previous_camera = self.last_camera_by_gid.get(gid)
+        self.last_camera_by_gid[gid] = camera["id"]
+        self._emit({
+            "type": "target_match",
+            "cameraId": camera["id"],
+            "cameraName": camera["name"],
+            "location": camera["location"],
+            "globalId": int(gid),
+            "similarity": round(similarity, 4),
+            "bbox": [int(v) for v in box],
+            "classId": int(cls),
+            "previousCameraId": previous_camera,
+            "timestamp": time.time(),
+        })
+        logger.info(f"Session {self.session_id}: target {gid} matched on camera {camera['id']} (sim={similarity:.2f})")
+
+
+class TrackingSessionManager:
+    """Sổ đăng ký các phiên truy vết đang chạy trong process"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, session_id, cameras, search_image=None):
+        session = TrackingSession(session_id, cameras, search_image)
+        with self._lock:
+            self._cleanup()
+            self._sessions[session_id] = session
+        session.start()
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None or not session.running:
+            return None
+        return session
+
+    def stop(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.stop()
+        return session is not None
+
+    def _cleanup(self):
+        for session_id in [sid for sid, s in self._sessions.items() if not s.running]:
+            del self._sessions[session_id]
+
+
+tracking_sessions = TrackingSessionManager()
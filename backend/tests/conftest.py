@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Cho phép chạy `pytest` từ thư mục backend hoặc thư mục gốc: module được import như khi chạy main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+import pytest
+
+from services.inference.budget_scheduler import InferenceBudgetScheduler
+
+
+def budgets(scheduler):
+    return {camera_id: scheduler.budget(camera_id) for camera_id in scheduler.snapshot()}
+
+
+def test_idle_cameras_split_the_budget_evenly():
+    scheduler = InferenceBudgetScheduler(total_fps=30, floor_fps=2, max_fps=30)
+    for camera_id in (1, 2, 3):
+        scheduler.register(camera_id)
+    assert budgets(scheduler) == pytest.approx({1: 10, 2: 10, 3: 10})
+
+
+def test_remainder_follows_activity_and_every_camera_keeps_its_floor():
+    scheduler = InferenceBudgetScheduler(total_fps=30, floor_fps=2, max_fps=30)
+    for camera_id in (1, 2, 3):
+        scheduler.register(camera_id)
+    scheduler.report_activity(1, tracked=6)
+    scheduler.report_activity(2, tracked=1, red_phase=True)  # 1 + 5 = cùng trọng số với camera 1
+    result = budgets(scheduler)
+    assert result[3] == pytest.approx(2)
+    assert result[1] == pytest.approx(result[2]) == pytest.approx(14)
+    assert sum(result.values()) == pytest.approx(30)
+
+
+def test_capped_cameras_hand_their_excess_to_the_others():
+    scheduler = InferenceBudgetScheduler(total_fps=30, floor_fps=2, max_fps=30)
+    scheduler.register(1, max_fps=5)
+    scheduler.register(2)
+    scheduler.report_activity(1, tracked=100)
+    scheduler.report_activity(2, tracked=1)
+    assert budgets(scheduler) == pytest.approx({1: 5, 2: 25})
+
+
+def test_floor_shrinks_when_cameras_outnumber_the_budget():
+    scheduler = InferenceBudgetScheduler(total_fps=4, floor_fps=2, max_fps=30)
+    for camera_id in range(8):
+        scheduler.register(camera_id)
+    assert all(budget == pytest.approx(0.5) for budget in budgets(scheduler).values())
+
+
+def test_unregister_returns_the_budget_after_the_last_viewer():
+    scheduler = InferenceBudgetScheduler(total_fps=30, floor_fps=2, max_fps=30)
+    scheduler.register(1)
+    scheduler.register(1)
+    scheduler.register(2)
+    scheduler.unregister(1)
+    assert budgets(scheduler) == pytest.approx({1: 15, 2: 15})
+    scheduler.unregister(1)
+    assert budgets(scheduler) == pytest.approx({2: 30})
+
+
+def test_acquire_spends_tokens_and_counts_skips():
+    scheduler = InferenceBudgetScheduler(total_fps=1, floor_fps=1, max_fps=1)
+    scheduler.register(1)
+    assert scheduler.acquire(1)
+    assert not scheduler.acquire(1)
+    stats = scheduler.snapshot()[1]
+    assert (stats["inferences"], stats["skipped"]) == (1, 1)
+    assert scheduler.acquire("unregistered")
@@ -0,0 +1,124 @@
+import numpy as np
+
+from services.tracking.byte_tracker import (
+    BYTETracker, BatchKalmanFilter, iou_matrix, overlapping_pairs, tlbr_to_xyah,
+    STD_WEIGHT_POSITION, STD_WEIGHT_VELOCITY,
+)
+
+
+def scalar_iou(a, b):
+    iw = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    ih = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / (union + 1e-9)
+
+
+def random_boxes(rng, n, extent=1000):
+    xy = rng.uniform(0, extent, (n, 2))
+    return np.column_stack([xy, xy + rng.uniform(10, 120, (n, 2))])
+
+
+class ScalarKalman:
+    """Kalman 8x8 của ByteTrack gốc cho một track, làm chuẩn so sánh"""
+
+    def __init__(self):
+        self.F = np.eye(8)
+        self.F[:4, 4:] = np.eye(4)
+        self.H = np.eye(4, 8)
+
+    def initiate(self, m):
+        std = [2 * STD_WEIGHT_POSITION * m[3], 2 * STD_WEIGHT_POSITION * m[3], 1e-2, 2 * STD_WEIGHT_POSITION * m[3],
+               10 * STD_WEIGHT_VELOCITY * m[3], 10 * STD_WEIGHT_VELOCITY * m[3], 1e-5, 10 * STD_WEIGHT_VELOCITY * m[3]]
+        return np.r_[m, np.zeros(4)], np.diag(np.square(std))
+
+    def predict(self, mean, cov):
+        h = mean[3]
+        std = [STD_WEIGHT_POSITION * h, STD_WEIGHT_POSITION * h, 1e-2, STD_WEIGHT_POSITION * h,
+               STD_WEIGHT_VELOCITY * h, STD_WEIGHT_VELOCITY * h, 1e-5, STD_WEIGHT_VELOCITY * h]
+        return self.F @ mean, self.F @ cov @ self.F.T + np.diag(np.square(std))
+
+    def update(self, mean, cov, m):
+        h = mean[3]
+        r = np.diag(np.square([STD_WEIGHT_POSITION * h, STD_WEIGHT_POSITION * h, 1e-1, STD_WEIGHT_POSITION * h]))
+        s = self.H @ cov @ self.H.T + r
+        gain = cov @ self.H.T @ np.linalg.inv(s)
+        return mean + gain @ (m - self.H @ mean), cov - gain @ s @ gain.T
+
+
+def full_covariance(blocks):
+    """(3, 4) vị trí/chéo/vận tốc -> ma trận 8x8"""
+    cov = np.zeros((8, 8))
+    cov[:4, :4] = np.diag(blocks[0])
+    cov[:4, 4:] = cov[4:, :4] = np.diag(blocks[1])
+    cov[4:, 4:] = np.diag(blocks[2])
+    return cov
+
+
+def test_iou_matrix_matches_scalar_iou():
+    rng = np.random.default_rng(1)
+    a, b = random_boxes(rng, 20, 300), random_boxes(rng, 15, 300)
+    expected = np.array([[scalar_iou(x, y) for y in b] for x in a])
+    np.testing.assert_allclose(iou_matrix(a, b), expected, atol=1e-9)
+
+
+def test_overlapping_pairs_finds_every_overlap():
+    rng = np.random.default_rng(2)
+    a, b = random_boxes(rng, 200), random_boxes(rng, 150)
+    rows, cols, iou = overlapping_pairs(a, b)
+    dense = iou_matrix(a, b)
+    expected = set(zip(*np.nonzero(dense > 0)))
+    assert set(zip(rows.tolist(), cols.tolist())) == expected
+    np.testing.assert_allclose(iou, dense[rows, cols], atol=1e-9)
+
+
+def test_batch_kalman_matches_scalar_filter():
+    rng = np.random.default_rng(3)
+    measurements = tlbr_to_xyah(random_boxes(rng, 5))
+    batch, scalar = BatchKalmanFilter(), ScalarKalman()
+    mean, cov = batch.initiate(measurements)
+    states = [scalar.initiate(m) for m in measurements]
+    for _ in range(4):
+        mean, cov = batch.predict(mean, cov)
+        states = [scalar.predict(m, c) for m, c in states]
+        measurements = measurements + rng.normal(0, 2, measurements.shape)
+        mean, cov = batch.update(mean, cov, measurements)
+        states = [scalar.update(m, c, z) for (m, c), z in zip(states, measurements)]
+    for i, (m, c) in enumerate(states):
+        np.testing.assert_allclose(mean[i], m, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(full_covariance(cov[i]), c, rtol=1e-9, atol=1e-12)
+
+
+def moving_detections(frame, n=10, score=0.9):
+    x = np.arange(n) * 100.0 + frame * 3
+    return np.column_stack([x, np.full(n, 50.0), x + 40, np.full(n, 90.0), np.full(n, score), np.zeros(n)])
+
+
+def test_ids_survive_short_occlusion():
+    tracker = BYTETracker(track_thresh=0.5, match_thresh=0.8)
+    for frame in range(10):
+        before = tracker.update_array(moving_detections(frame))
+    for frame in range(10, 15):
+        tracker.update_array(moving_detections(frame)[5:])  # Nửa số xe bị che
+    for frame in range(15, 20):
+        after = tracker.update_array(moving_detections(frame))
+    assert set(before[:, 4]) == set(after[:, 4])
+    assert tracker.next_id == 10
+
+
+def test_empty_frames_age_out_lost_tracks():
+    tracker = BYTETracker(track_buffer=5)
+    tracker.update_array(moving_detections(0, n=3))
+    tracker.update_array(moving_detections(1, n=3))
+    for _ in range(7):
+        assert len(tracker.update_array(np.zeros((0, 6)))) == 0
+    assert len(tracker.mean) == 0
+
+
+def test_new_tracks_need_score_above_track_thresh_plus_margin():
+    tracker = BYTETracker(track_thresh=0.5)
+    assert tracker.new_track_thresh == 0.6
+    tracker.update_array(moving_detections(0, n=2, score=0.55))
+    assert tracker.next_id == 0
+    tracker.update_array(moving_detections(1, n=2, score=0.65))
+    assert tracker.next_id == 2
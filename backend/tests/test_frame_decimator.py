@@ -0,0 +1,51 @@
+import pytest
+
+from services.streaming import live_stream
+from services.streaming.live_stream import FrameDecimator, viewer_params
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    class Clock:
+        now = 100.0
+
+        def monotonic(self):
+            return self.now
+
+    clock = Clock()
+    monkeypatch.setattr(live_stream, "time", clock)
+    return clock
+
+
+def accepted(decimator, clock, timestamps):
+    result = []
+    for timestamp in timestamps:
+        clock.now = timestamp
+        result.append(decimator.accept())
+    return result
+
+
+def test_no_limit_accepts_every_frame(clock):
+    assert accepted(FrameDecimator(None), clock, [100, 100, 100]) == [True, True, True]
+
+
+def test_30fps_source_is_reduced_to_10fps(clock):
+    timestamps = [100 + i / 30 for i in range(30)]
+    assert sum(accepted(FrameDecimator(10), clock, timestamps)) == 10
+
+
+def test_schedule_restarts_after_a_stall(clock):
+    decimator = FrameDecimator(10)
+    assert accepted(decimator, clock, [100.0, 100.05, 100.12, 105.0, 105.05, 105.12]) == \
+        [True, False, True, True, False, True]
+
+
+@pytest.mark.parametrize("args, expected", [
+    ((None, None, None), (None, None, live_stream.MJPEG_QUALITY)),
+    ((0, 0, 0), (None, None, live_stream.MJPEG_QUALITY)),
+    ((12, 500, 50), (12.0, 512, 50)),
+    ((5, 10, 5), (5.0, live_stream.MJPEG_MIN_WIDTH, live_stream.MJPEG_MIN_QUALITY)),
+    ((5, 640, 100), (5.0, 640, live_stream.MJPEG_MAX_QUALITY)),
+])
+def test_viewer_params_are_clamped_and_rounded(args, expected):
+    assert viewer_params(*args) == expected
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import numpy as np
+
+from services.streaming import live_stream
+from services.streaming.live_stream import LiveStreamHub
+
+
+def frames(stop=None):
+    while stop is None or not stop.is_set():
+        yield np.zeros((16, 16, 3), np.uint8)
+        time.sleep(0.01)
+
+
+def stalled():
+    yield np.zeros((16, 16, 3), np.uint8)
+    threading.Event().wait()  # Nguồn treo: không bao giờ ra frame thứ hai
+
+
+def test_viewers_are_counted_on_subscribe_and_released_once():
+    hub = LiveStreamHub()
+    viewer = hub.subscribe("cam", frames)
+    assert hub.snapshot()["streams"][0]["subscribers"] == 1  # Chưa lấy frame nào
+    assert next(viewer).startswith(b"--frame")
+    viewer.close()
+    viewer.close()
+    assert hub.snapshot()["streams"][0]["subscribers"] == 0
+
+
+def test_viewers_share_one_pipeline_per_key():
+    hub = LiveStreamHub()
+    first, second = hub.subscribe("cam", frames), hub.subscribe("cam", frames)
+    next(first), next(second)
+    assert len(hub.snapshot()["streams"]) == 1
+    first.close()
+    second.close()
+
+
+def test_idle_pipeline_is_stopped_even_when_the_source_stalls(monkeypatch):
+    monkeypatch.setattr(live_stream, "STREAM_IDLE_SECONDS", 0.05)
+    hub = LiveStreamHub()
+    viewer = hub.subscribe("cam", stalled)
+    next(viewer)
+    viewer.close()
+    time.sleep(0.1)
+    hub.reap()
+    assert hub.snapshot()["streams"] == []
+    # Người xem mới được một pipeline mới thay vì bám vào pipeline đã dừng
+    viewer = hub.subscribe("cam", frames)
+    assert next(viewer)
+    viewer.close()
@@ -0,0 +1,37 @@
+import pytest
+
+from services.plate_recognition import VN_PLATE_PATTERN, format_plate, is_valid_plate, normalize_plate
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("51F-123.45", "51F12345"),
+    ("5lF12345", "51F12345"),  # l -> 1 ở phần mã tỉnh
+    ("518-12345", "51B12345"),  # 8 -> B ở ký tự sê-ri
+    ("29a1 123.45", "29A112345"),
+    ("30K1234S", "30K12345"),  # S -> 5 ở phần số
+    ("51F", "51F"),  # Quá ngắn thì chỉ làm sạch
+])
+def test_normalize_plate(raw, expected):
+    assert normalize_plate(raw) == expected
+
+
+@pytest.mark.parametrize("plate", ["51F12345", "30A1234", "51AB12345", "29A112345", "59X312345"])
+def test_valid_plates(plate):
+    assert VN_PLATE_PATTERN.match(plate)
+    assert is_valid_plate(plate)
+
+
+@pytest.mark.parametrize("plate", ["5F12345", "51F123", "51F1234567", "ABF12345", "51F1234A", ""])
+def test_invalid_plates(plate):
+    assert not is_valid_plate(plate)
+
+
+@pytest.mark.parametrize("plate, display", [
+    ("51F12345", "51F-123.45"),
+    ("30A1234", "30A-1234"),
+    ("51AB12345", "51AB-123.45"),
+    ("29A112345", "29A1-123.45"),
+    ("NOTAPLATE", "NOTAPLATE"),
+])
+def test_format_plate(plate, display):
+    assert format_plate(plate) == display
@@ -0,0 +1,63 @@
+import numpy as np
+
+from services.plate_sightings import PlateSightings, deletion_variants, edit_distance
+
+
+def test_deletion_variants():
+    assert deletion_variants("ABC", 0) == {"ABC"}
+    assert deletion_variants("ABC", 1) == {"ABC", "BC", "AC", "AB"}
+    assert deletion_variants("ABC", 2) == {"ABC", "BC", "AC", "AB", "A", "B", "C"}
+
+
+def test_edit_distance_stops_early_past_the_limit():
+    assert edit_distance("51F12345", "51F12345") == 0
+    assert edit_distance("51F12345", "51F12845") == 1
+    assert edit_distance("51F12345", "51F1234") == 1
+    assert edit_distance("51F12345", "29A99999", max_distance=1) == 2
+
+
+def index_with(*plates, max_distance=1):
+    index = PlateSightings(max_distance=max_distance)
+    for track_id, plate in enumerate(plates):
+        index.publish(plate, camera_id=track_id % 2, track_id=track_id, confidence=0.9, source="helmet")
+    return index
+
+
+def test_exact_and_fuzzy_lookup_rank_by_distance():
+    index = index_with("51F12345", "51F12845", "51F1234", "29A99999")
+    results = index.lookup("51F-123.45")
+    assert [(r["plate"], r["distance"]) for r in results][0] == ("51F12345", 0)
+    assert {r["plate"] for r in results} == {"51F12345", "51F12845", "51F1234"}
+    assert index.lookup("51F12345", max_distance=0)[0]["plate"] == "51F12345"
+    assert len(index.lookup("51F12345", max_distance=0)) == 1
+
+
+def test_lookup_filters_by_camera():
+    index = index_with("51F12345", "51F12345")
+    assert [r["cameraId"] for r in index.lookup("51F12345", camera_ids=[1])] == [1]
+
+
+def test_republishing_a_track_updates_one_record_and_its_links():
+    index = PlateSightings(max_distance=1)
+    frame = np.zeros((60, 60, 3), np.uint8)
+    first = index.publish("51F12345", 1, 7, 0.6, frame, (0, 0, 30, 30), source="overspeed")
+    second = index.publish("30A99999", 1, 7, 0.9, frame, (0, 0, 30, 30), source="overspeed")
+    assert first == second
+    assert index.lookup("51F12345") == []
+    assert index.lookup("30A99999")[0]["confidence"] == 0.9
+    assert index.stats() == {"sightings": 1, "plates": 1, "snapshots": 1}
+    assert index.snapshot(first)[:2] == b"\xff\xd8"
+
+
+def test_invalid_plates_are_not_indexed():
+    index = PlateSightings()
+    assert index.publish("UNKNOWN", 1, 1, 0.9) is None
+    assert index.stats()["sightings"] == 0
+
+
+def test_expire_unlinks_old_sightings():
+    index = PlateSightings(retention_hours=1)
+    index.publish("51F12345", 1, 1, 0.9, timestamp=1000.0)
+    assert index.expire(now=1000.0 + 3601) == 1
+    assert index.lookup("51F12345") == []
+    assert index.stats() == {"sightings": 0, "plates": 0, "snapshots": 0}
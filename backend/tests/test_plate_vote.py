@@ -0,0 +1,38 @@
+import pytest
+
+from services.inference.ocr_pool import PlateVote
+
+
+def test_characters_are_voted_per_position():
+    vote = PlateVote()
+    vote.add("51F12345", 0.9)
+    vote.add("51F12845", 0.8)
+    vote.add("51F12345", 0.7)
+    assert vote.text == "51F12345"
+    # Vị trí bất đồng có 1.6 / 2.4 phiếu; nhân với confidence trung bình 0.8
+    assert vote.confidence == pytest.approx(1.6 / 2.4 * 0.8)
+
+
+def test_length_is_chosen_by_total_confidence():
+    vote = PlateVote()
+    vote.add("51F1234", 0.9)
+    vote.add("51F12345", 0.6)
+    vote.add("51F12346", 0.6)
+    assert len(vote.text) == 8
+
+
+def test_unknown_readings_count_as_attempts_only():
+    vote = PlateVote(max_readings=3)
+    vote.add("Unknown", 0.0)
+    vote.add("", 0.0)
+    assert vote.readings == [] and vote.text == "Unknown" and not vote.done
+    vote.add("Unknown", 0.0)
+    assert vote.done
+
+
+def test_done_needs_confidence_and_enough_readings():
+    vote = PlateVote(confident_score=0.85, min_readings=2)
+    vote.add("51F12345", 0.95)
+    assert not vote.done
+    vote.add("51F12345", 0.95)
+    assert vote.done
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from services.tracking import reid_gallery
+from services.tracking.reid_gallery import ReIDGallery
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(reid_gallery, "time", clock)
+    return clock
+
+
+def unit(i, dim=8):
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+def test_matches_known_features_and_registers_new_ones(clock):
+    gallery = ReIDGallery(dim=8, capacity=4, use_faiss=False)
+    assert gallery.match_or_register([unit(0), unit(1)]) == [0, 1]
+    assert gallery.match_or_register([unit(1) * 3, unit(2)]) == [1, 2]
+    assert len(gallery) == 3
+
+
+def test_duplicates_within_one_frame_share_an_id(clock):
+    gallery = ReIDGallery(dim=8, capacity=4, use_faiss=False)
+    assert gallery.match_or_register([unit(0), unit(0) + 0.1 * unit(1)]) == [0, 0]
+
+
+def test_full_gallery_replaces_the_least_recently_seen_entry(clock):
+    gallery = ReIDGallery(dim=8, capacity=3, use_faiss=False)
+    for i in range(3):
+        gallery.match_or_register([unit(i)])
+        clock.now += 1
+    gallery.match([unit(0)])  # ID 0 vừa được thấy lại, ID 1 giờ là cũ nhất
+    clock.now += 1
+    assert gallery.match_or_register([unit(3)]) == [3]
+    gids, _ = gallery.match([unit(1), unit(0)])
+    assert gids.tolist() == [-1, 0]
+
+
+def test_touch_keeps_visible_ids_from_being_replaced(clock):
+    gallery = ReIDGallery(dim=8, capacity=2, use_faiss=False)
+    gallery.match_or_register([unit(0)])
+    clock.now += 1
+    gallery.match_or_register([unit(1)])
+    clock.now += 1
+    gallery.touch([0])
+    gallery.match_or_register([unit(2)])
+    gids, _ = gallery.match([unit(0), unit(1)])
+    assert gids.tolist() == [0, -1]
+
+
+def test_expired_entries_are_dropped_before_registering(clock):
+    gallery = ReIDGallery(dim=8, capacity=4, max_age_seconds=10, use_faiss=False)
+    gallery.match_or_register([unit(0), unit(1)])
+    clock.now += 5
+    gallery.touch([1])
+    clock.now += 6
+    gallery.match_or_register([unit(2)])
+    assert len(gallery) == 2
+    gids, _ = gallery.match([unit(0), unit(1), unit(2)])
+    assert gids.tolist() == [-1, 1, 2]
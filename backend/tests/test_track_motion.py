@@ -0,0 +1,69 @@
+import numpy as np
+
+from services.geometry.motion import TrackMotion, side_of_lines, line_segments
+
+STOP_LINE = [[0, 100], [200, 100]]
+
+
+def test_side_of_lines_is_positive_below_the_line():
+    sides = side_of_lines([[50, 150], [50, 50]], line_segments([STOP_LINE]))
+    assert sides[0, 0] > 0 > sides[1, 0]
+
+
+def test_crossings_are_reported_once_in_each_direction():
+    motion = TrackMotion([STOP_LINE])
+    up, down, _ = motion.update([1, 2], [[50, 120], [80, 80]])
+    assert not up.any() and not down.any()  # Frame đầu chưa có vị trí trước
+    up, down, _ = motion.update([1, 2], [[50, 90], [80, 110]])
+    assert up[:, 0].tolist() == [True, False]
+    assert down[:, 0].tolist() == [False, True]
+    up, down, _ = motion.update([1, 2], [[50, 80], [80, 120]])
+    assert not up.any() and not down.any()
+
+
+def test_lines_with_a_single_point_never_cross():
+    motion = TrackMotion([STOP_LINE, [[5, 5]]])
+    motion.update([1], [[50, 120]])
+    up, _, _ = motion.update([1], [[50, 90]])
+    assert up.tolist() == [[True, False]]
+
+
+def test_headings_average_unit_steps_and_ignore_jitter():
+    motion = TrackMotion(min_step=5)
+    motion.update([7], [[0, 0]])
+    _, _, moved = motion.update([7], [[10, 0]])
+    assert moved.tolist() == [True]
+    _, _, moved = motion.update([7], [[12, 1]])  # Dưới min_step: không phải mẫu hướng
+    assert moved.tolist() == [False]
+    motion.update([7], [[12, 21]])
+    headings, counts = motion.headings([7, 99])
+    np.testing.assert_allclose(headings, [[0.5, 0.5], [0, 0]])
+    assert counts.tolist() == [2, 0]
+
+
+def test_heading_window_keeps_the_latest_samples():
+    motion = TrackMotion(window=2, min_step=0)
+    points = [[0, 0], [10, 0], [10, 10], [10, 20]]
+    for point in points:
+        motion.update([1], [point])
+    headings, counts = motion.headings([1])
+    np.testing.assert_allclose(headings, [[0, 1]])
+    assert counts.tolist() == [2]
+
+
+def test_stale_tracks_are_forgotten_and_rows_reused():
+    motion = TrackMotion([STOP_LINE], max_missing=2, capacity=1)
+    motion.update([1], [[0, 120]])
+    for _ in range(3):
+        motion.update([2], [[0, 120]])
+    assert 1 not in motion._rows
+    up, _, _ = motion.update([1], [[0, 90]])  # Track quay lại được coi như mới
+    assert not up.any()
+
+
+def test_capacity_grows_with_the_number_of_tracks():
+    motion = TrackMotion([STOP_LINE], capacity=2)
+    ids = list(range(10))
+    motion.update(ids, [[i * 10, 120] for i in ids])
+    up, _, _ = motion.update(ids, [[i * 10, 90] for i in ids])
+    assert up[:, 0].all()
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+
+from services.geometry.zone_index import ZoneIndex, box_centers
+
+ZONES = {
+    "left": [[0, 0], [50, 0], [50, 100], [0, 100]],
+    "right": [[50, 0], [100, 0], [100, 100], [50, 100]],
+    "overlap": [[40, 40], [60, 40], [60, 60], [40, 60]],
+}
+
+
+def test_zone_lookup_matches_point_polygon_test_with_first_zone_winning():
+    index = ZoneIndex(100, 100, ZONES)
+    rng = np.random.default_rng(0)
+    points = rng.integers(0, 100, (500, 2))
+    expected = []
+    for x, y in points.tolist():
+        hit = None
+        for zone_id, polygon in ZONES.items():
+            if cv2.pointPolygonTest(np.array(polygon, np.int32), (x, y), False) >= 0:
+                hit = zone_id
+                break
+        expected.append(hit)
+    assert index.zone_at(points) == expected
+    assert index.zone_at([[50, 50]]) == ["left"]  # Vùng khai báo trước thắng ở chỗ chồng lấn
+
+
+def test_points_outside_the_frame_are_clamped_and_empty_queries_work():
+    index = ZoneIndex(100, 100, {"all": [[0, 0], [99, 0], [99, 99], [0, 99]]})
+    assert index.zone_at([[-20, 500]]) == ["all"]
+    assert index.zone_at(np.zeros((0, 2))) == []
+    assert index.line_at(np.zeros((0, 2))) == []
+
+
+def test_line_band_reports_the_nearest_line():
+    lines = {"stop": [[0, 50], [99, 50]], "far": [[0, 90], [99, 90]]}
+    index = ZoneIndex(100, 100, lines=lines, line_band=5)
+    assert index.line_at([[10, 52], [10, 70], [10, 88], [10, 10]]) == ["stop", None, "far", None]
+
+
+def test_degenerate_zones_and_lines_are_ignored():
+    index = ZoneIndex(20, 20, {"bad": [[0, 0], [5, 5]]}, lines={"dot": [[3, 3]]})
+    assert index.zone_at([[1, 1]]) == [None]
+    assert index.line_at([[3, 3]]) == [None]
+
+
+def test_box_centers_use_integer_midpoints():
+    assert box_centers([[0, 0, 11, 21], [10.7, 4.2, 20.9, 8.8]]).tolist() == [[5, 10], [15, 6]]
@@ -76,6 +76,11 @@ interface TrackingSession {
   totalCameras: number
 }
 
+const API_BASE_URL = "http://localhost:8000"
+
+// Grid tiles ask the server for a small, low-fps variant; selected and fullscreen views get full frames
+const TILE_STREAM_PARAMS = "width=480&max_fps=10&quality=70"
+
 const normalizeVietnamese = (text: string): string => {
   return text
     .normalize("NFD")
@@ -107,6 +112,17 @@ export default function VehicleTrackingDashboard() {
     loadCameras()
   }, [])
 
+  // Stop the server-side session when tracking stops, a new search replaces it, or the page unmounts
+  useEffect(() => {
+    const sessionId = trackingSession?.sessionId
+    if (!sessionId) return
+    return () => {
+      fetch(`${API_BASE_URL}/api/tracking/sessions/${sessionId}`, { method: "DELETE" }).catch((error) =>
+        console.error("Failed to stop tracking session:", error),
+      )
+    }
+  }, [trackingSession?.sessionId])
+
   useEffect(() => {
     if (locationSearchQuery.trim()) {
       const normalizedQuery = normalizeVietnamese(locationSearchQuery)
@@ -338,9 +354,11 @@ export default function VehicleTrackingDashboard() {
     }
   }
 
-  const getStreamUrl = (cameraStream: CameraStream) => {
-    const baseUrl = "http://localhost:8000"
-    return `${baseUrl}/api/tracking/stream_with_image/${cameraStream.cameraId}`
+  // The session stream served by the shared tracking engine started in start_session
+  const getStreamUrl = (cameraStream: CameraStream, tile = false) => {
+    const url = `${API_BASE_URL}${cameraStream.streamUrl}`
+    if (!tile) return url
+    return `${url}${url.includes("?") ? "&" : "?"}${TILE_STREAM_PARAMS}`
   }
 
   const canStartTracking = () => {
@@ -630,7 +648,7 @@ export default function VehicleTrackingDashboard() {
                       >
                         <div className="relative bg-black aspect-video">
                           <img
-                            src={getStreamUrl(cameraStream)}
+                            src={getStreamUrl(cameraStream, true)}
                             alt={`Live stream from ${cameraStream.cameraName}`}
                             className="w-full h-full object-cover"
                             onError={(e) => {